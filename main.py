@@ -1,13 +1,54 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from src.api.endpoints import (
     get_product_info,
     creator,
     chatbot,
     analytics,
+    profiling,
 )
+from src.api.command_monitoring import CommandMonitoringMiddleware
+from src.api.profiling import ProfilingMiddleware, profiling_enabled
+from src.models.ad_index import ad_index_refresher, current_ad_index, load_ad_index
+from src.models.amazon_product_key import amazon_product_key_pool
+from src.models.api_event import api_event_sink
+from src.models.indexes import ensure_indexes
+from src.models.mongo import DatabaseClient
 
-app = FastAPI()
+
+async def preload():
+    """
+    Startup work shared by every worker of the server. serve.py runs it once
+    before forking the workers, a single server runs it in its lifespan.
+    """
+    await ensure_indexes()
+    await load_ad_index()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One connection pool for the lifetime of the app, shared by every router
+    DatabaseClient.connect()
+    await DatabaseClient.warm_up()
+    if current_ad_index() is None:
+        await preload()
+    await ad_index_refresher.start()
+    await api_event_sink.start()
+    await amazon_product_key_pool.start()
+    yield
+    await amazon_product_key_pool.stop()
+    await api_event_sink.stop()
+    await ad_index_refresher.stop()
+    await DatabaseClient.disconnect()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(get_product_info.router)
 app.include_router(creator.router)
 app.include_router(chatbot.router)
 app.include_router(analytics.router)
+app.include_router(profiling.router)
+app.add_middleware(CommandMonitoringMiddleware)
+# Profiling costs nothing unless a profiling token is configured
+if profiling_enabled():
+    app.add_middleware(ProfilingMiddleware)
@@ -0,0 +1,370 @@
+import argparse
+import asyncio
+import errno
+import gc
+import logging
+import os
+import random
+import select
+import signal
+import socket
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import uvicorn
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Production entry point of the API server: one supervisor process preloads the
+# app, the ad index and the database indexes, then forks WEB_CONCURRENCY workers
+# (one per CPU by default) that share the listening socket and the preloaded
+# memory copy-on-write. Each worker runs its own event loop and connection pool.
+#
+# Signals to the supervisor:
+#   SIGTERM / SIGINT  drain the workers and stop
+#   SIGHUP            reload the ad index, then replace the workers one at a time,
+#                     retiring each old worker once its replacement is ready
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1
+
+# A worker exits after serving about this many requests (0 never) and is replaced
+# by a fresh fork, which bounds the memory a worker can accumulate. The jitter
+# keeps workers from all being replaced at the same time.
+WORKER_MAX_REQUESTS = int(os.getenv("WORKER_MAX_REQUESTS", "0"))
+WORKER_MAX_REQUESTS_JITTER = int(os.getenv("WORKER_MAX_REQUESTS_JITTER", "0"))
+
+# Seconds a stopping worker gets to finish the requests it is serving
+WORKER_GRACEFUL_TIMEOUT = float(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30"))
+
+
+class WorkerServer(uvicorn.Server):
+    """
+    Uvicorn server of a forked worker. It tells the supervisor when it is ready,
+    i.e. once the app's lifespan startup is done and it accepts requests, and
+    stops if the supervisor goes away.
+    """
+
+    def __init__(self, config: uvicorn.Config, ready_fd: int):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+        self.supervisor_pid = os.getppid()
+
+    def install_signal_handlers(self) -> None:
+        # The supervisor asks workers to stop with SIGTERM; SIGINT from a
+        # terminal goes to the whole process group and is left to the supervisor
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, self.handle_exit, signal.SIGTERM, None)
+
+    async def startup(self, sockets: Optional[List[socket.socket]] = None) -> None:
+        await super().startup(sockets=sockets)
+        if self.started:
+            os.write(self.ready_fd, b"ready")
+            os.close(self.ready_fd)
+
+    async def on_tick(self, counter: int) -> bool:
+        if os.getppid() != self.supervisor_pid:
+            self.should_exit = True
+        return await super().on_tick(counter)
+
+
+class Worker:
+    def __init__(self, pid: int, ready_fd: int):
+        self.pid = pid
+        self.ready_fd = ready_fd
+        self.ready = False
+
+
+class Supervisor:
+    """
+    Pre-fork process supervisor. preload runs once in the supervisor before the
+    first workers are forked, and again before the workers are replaced on SIGHUP.
+    """
+
+    def __init__(
+        self,
+        app,
+        sock: socket.socket,
+        workers: int,
+        preload: Optional[Callable[[], Awaitable[None]]] = None,
+        max_requests: int = 0,
+        max_requests_jitter: int = 0,
+        graceful_timeout: float = WORKER_GRACEFUL_TIMEOUT,
+        log_level: str = "info",
+    ):
+        self.app = app
+        self.sock = sock
+        self.worker_count = workers
+        self.preload = preload
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.log_level = log_level
+        self.workers: Dict[int, Worker] = {}
+        # Workers asked to stop, which are not replaced when they exit
+        self._retiring: Set[int] = set()
+        # Ready workers still to be replaced by a rolling restart, and the worker
+        # started to replace the first of them
+        self._to_replace: List[int] = []
+        self._replacement: Optional[int] = None
+        self._wakeup_fds = (-1, -1)
+        self._signals: List[int] = []
+        self._exit_code: Optional[int] = None
+
+    def run(self) -> int:
+        """
+        Preload, start the workers and supervise them until asked to stop.
+        Returns the exit code of the server.
+        """
+        self._preload()
+
+        wakeup_read, wakeup_write = self._wakeup_fds = os.pipe()
+        os.set_blocking(wakeup_read, False)
+        os.set_blocking(wakeup_write, False)
+        signal.set_wakeup_fd(wakeup_write)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, self._handle_signal)
+
+        for _ in range(self.worker_count):
+            self._spawn()
+        logger.info(f"Supervisor [{os.getpid()}] started {self.worker_count} workers")
+
+        while self._exit_code is None:
+            fds = [wakeup_read] + [
+                worker.ready_fd for worker in self.workers.values() if not worker.ready
+            ]
+            try:
+                readable, _, _ = select.select(fds, [], [], 1.0)
+            except InterruptedError:
+                readable = []
+            if wakeup_read in readable:
+                while True:
+                    try:
+                        if not os.read(wakeup_read, 512):
+                            break
+                    except BlockingIOError:
+                        break
+            for worker in list(self.workers.values()):
+                if not worker.ready and worker.ready_fd in readable:
+                    self._check_ready(worker)
+
+            signals, self._signals = self._signals, []
+            for signum in signals:
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    self._exit_code = 0
+                elif signum == signal.SIGHUP:
+                    self._reload()
+            self._reap()
+            self._replace_next()
+
+        self._stop_workers()
+        logger.info(f"Supervisor [{os.getpid()}] stopped")
+        return self._exit_code
+
+    def _handle_signal(self, signum: int, frame) -> None:
+        self._signals.append(signum)
+
+    def _preload(self) -> None:
+        if self.preload is not None:
+            asyncio.run(self.preload())
+        # Keep the preloaded objects out of garbage collection, which would touch
+        # and so copy their pages in every worker
+        gc.collect()
+        gc.freeze()
+
+    def _spawn(self) -> int:
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            code = 1
+            try:
+                self._run_worker(ready_write)
+                code = 0
+            except BaseException:
+                logger.exception(f"Worker [{os.getpid()}] failed")
+            finally:
+                os._exit(code)
+
+        os.close(ready_write)
+        self.workers[pid] = Worker(pid, ready_read)
+        return pid
+
+    def _run_worker(self, ready_fd: int) -> None:
+        signal.set_wakeup_fd(-1)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        for fd in self._wakeup_fds:
+            os.close(fd)
+        for worker in self.workers.values():
+            if worker.ready_fd >= 0:
+                os.close(worker.ready_fd)
+        # Forked workers would otherwise pick the same "random" ads
+        random.seed()
+
+        max_requests = None
+        if self.max_requests > 0:
+            max_requests = self.max_requests + random.randint(0, self.max_requests_jitter)
+        config = uvicorn.Config(
+            self.app,
+            lifespan="on",
+            log_level=self.log_level,
+            limit_max_requests=max_requests,
+            timeout_graceful_shutdown=self.graceful_timeout,
+        )
+        WorkerServer(config, ready_fd).run(sockets=[self.sock])
+
+    def _check_ready(self, worker: Worker) -> None:
+        # A worker that exits before it is ready closes the pipe without writing
+        if os.read(worker.ready_fd, 16):
+            worker.ready = True
+            logger.info(f"Worker [{worker.pid}] ready")
+        os.close(worker.ready_fd)
+        worker.ready_fd = -1
+
+    def _reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            if worker.ready_fd >= 0:
+                os.close(worker.ready_fd)
+            if pid in self._retiring:
+                self._retiring.discard(pid)
+                continue
+            if pid in self._to_replace:
+                self._to_replace.remove(pid)
+            if pid == self._replacement:
+                self._replacement = None
+
+            code = os.waitstatus_to_exitcode(status)
+            if not worker.ready:
+                logger.error(f"Worker [{pid}] failed to start (exit code {code})")
+                self._exit_code = 1
+                return
+            logger.info(f"Worker [{pid}] exited (exit code {code}), replacing it")
+            self._spawn()
+
+    def _reload(self) -> None:
+        logger.info("Reloading and replacing the workers")
+        try:
+            self._preload()
+        except Exception as e:
+            logger.error(f"Reload failed, keeping the current workers: {e}")
+            return
+        self._to_replace = [pid for pid, worker in self.workers.items() if worker.ready]
+
+    def _replace_next(self) -> None:
+        """
+        Rolling restart: fork a replacement for the next worker to replace and
+        retire that worker once the replacement is ready
+        """
+        if not self._to_replace or self._exit_code is not None:
+            return
+        if self._replacement is None:
+            self._replacement = self._spawn()
+        elif self.workers[self._replacement].ready:
+            self._retire(self._to_replace.pop(0))
+            self._replacement = None
+
+    def _retire(self, pid: int) -> None:
+        self._retiring.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def _stop_workers(self) -> None:
+        for pid in list(self.workers):
+            self._retire(pid)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            logger.error(f"Worker [{pid}] did not stop in time, killing it")
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.workers.pop(pid)
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        sock.bind((host, port))
+    except OSError as e:
+        if e.errno == errno.EADDRINUSE:
+            logger.error(f"Address {host}:{port} is already in use")
+        raise
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the API server with preloaded, pre-forked workers."
+    )
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument(
+        "--port", type=int, default=int(os.getenv("PORT", "8000")), help="Port to listen on"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WEB_CONCURRENCY,
+        help="Number of worker processes, WEB_CONCURRENCY or the CPU count by default",
+    )
+    parser.add_argument(
+        "--max_requests",
+        type=int,
+        default=WORKER_MAX_REQUESTS,
+        help="Replace a worker after it served this many requests, 0 never",
+    )
+    parser.add_argument(
+        "--max_requests_jitter",
+        type=int,
+        default=WORKER_MAX_REQUESTS_JITTER,
+        help="Random number of extra requests per worker, up to this many",
+    )
+    parser.add_argument(
+        "--graceful_timeout",
+        type=float,
+        default=WORKER_GRACEFUL_TIMEOUT,
+        help="Seconds a stopping worker gets to finish its requests",
+    )
+
+    args = parser.parse_args()
+
+    from main import app, preload
+    from src.models.mongo import DatabaseClient
+
+    async def preload_app():
+        await preload()
+        # Workers open their own connection pools, never share the supervisor's
+        await DatabaseClient.disconnect()
+
+    supervisor = Supervisor(
+        app,
+        bind_socket(args.host, args.port),
+        args.workers,
+        preload=preload_app,
+        max_requests=args.max_requests,
+        max_requests_jitter=args.max_requests_jitter,
+        graceful_timeout=args.graceful_timeout,
+    )
+    raise SystemExit(supervisor.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+import httpx
+
+# Runs a supervisor over a minimal app whose responses tell which worker served
+# them and whether it saw the preloaded state
+SERVER = """
+import os, sys
+from serve import Supervisor, bind_socket
+
+state = {}
+
+async def preload():
+    state["generation"] = state.get("generation", 0) + 1
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            await send({"type": message["type"] + ".complete"})
+            if message["type"] == "lifespan.shutdown":
+                return
+    body = f"{os.getpid()} {state['generation']}".encode()
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": body})
+
+sock = bind_socket("127.0.0.1", 0)
+print(sock.getsockname()[1], flush=True)
+sys.exit(Supervisor(app, sock, 2, preload=preload, graceful_timeout=1, log_level="warning").run())
+"""
+
+
+def wait_for_workers(url, generation, timeout=10):
+    """
+    Wait until both workers serve requests from the given preload generation, and
+    return their pids
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        # Fresh connections, so that the kernel spreads them over the workers
+        responses = {httpx.get(url).text for _ in range(40)}
+        served = {tuple(map(int, response.split())) for response in responses}
+        if len(served) == 2 and {g for _, g in served} == {generation}:
+            return {pid for pid, _ in served}
+        time.sleep(0.1)
+    raise AssertionError(f"Workers of generation {generation} did not start")
+
+
+def test_supervisor_preloads_reloads_and_stops():
+    root = os.path.dirname(os.path.abspath(__file__))
+    server = subprocess.Popen(
+        [sys.executable, "-c", SERVER], cwd=root, stdout=subprocess.PIPE, text=True
+    )
+    try:
+        url = f"http://127.0.0.1:{server.stdout.readline().strip()}/"
+
+        first = wait_for_workers(url, generation=1)
+        assert server.pid not in first
+
+        # Reload: every worker is replaced by one forked after a second preload
+        server.send_signal(signal.SIGHUP)
+        second = wait_for_workers(url, generation=2)
+        assert not first & second
+
+        server.send_signal(signal.SIGTERM)
+        assert server.wait(timeout=10) == 0
+    finally:
+        if server.poll() is None:
+            server.kill()
+        server.stdout.close()
@@ -0,0 +1,95 @@
+import json
+import logging
+
+from src.models import mongo
+from src.models.metrics import METRICS
+from src.models.mongo import track_commands
+
+logger = logging.getLogger(__name__)
+
+# Per request accounting of the MongoDB round trips, labelled by the name of the
+# endpoint function that served the request
+REQUEST_ROUND_TRIPS = METRICS.histogram(
+    "mongo_request_round_trips",
+    "MongoDB round trips per request",
+    labels=("endpoint",),
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64),
+)
+REQUEST_DOCUMENTS = METRICS.histogram(
+    "mongo_request_documents",
+    "Documents MongoDB returned per request",
+    labels=("endpoint",),
+    buckets=(0, 1, 10, 100, 1000, 10000, 100000),
+)
+OVER_BUDGET = METRICS.counter(
+    "mongo_round_trip_budget_exceeded",
+    "Requests that made more MongoDB round trips than MONGO_ROUND_TRIP_BUDGET",
+    labels=("endpoint",),
+)
+
+
+def _endpoint_name(scope) -> str:
+    endpoint = scope.get("endpoint")
+    return getattr(endpoint, "__name__", "unmatched")
+
+
+class CommandMonitoringMiddleware:
+    """
+    ASGI middleware attributing the MongoDB commands of every request to it. The
+    summary of a request is logged at debug level, or as a warning when it is
+    over the round-trip budget. In strict mode a request over budget gets a 500
+    response describing its commands instead of its own.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        with track_commands(mongo.MONGO_ROUND_TRIP_BUDGET) as commands:
+            replaced = False
+
+            async def send_checked(message):
+                nonlocal replaced
+                if (
+                    message["type"] == "http.response.start"
+                    and mongo.MONGO_ROUND_TRIP_BUDGET_STRICT
+                    and commands.over_budget
+                ):
+                    replaced = True
+                    detail = f"Round-trip budget exceeded: {commands.summary()}"
+                    body = json.dumps({"detail": detail})
+                    await send(
+                        {
+                            "type": "http.response.start",
+                            "status": 500,
+                            "headers": [(b"content-type", b"application/json")],
+                        }
+                    )
+                    await send({"type": "http.response.body", "body": body.encode()})
+                if not replaced:
+                    await send(message)
+
+            try:
+                await self.app(scope, receive, send_checked)
+            finally:
+                self._report(scope, commands)
+
+    def _report(self, scope, commands) -> None:
+        endpoint = _endpoint_name(scope)
+        REQUEST_ROUND_TRIPS.observe(commands.round_trips, endpoint)
+        if not commands.round_trips:
+            return
+        REQUEST_DOCUMENTS.observe(sum(record.documents for record in commands.commands), endpoint)
+        if commands.over_budget:
+            OVER_BUDGET.inc(endpoint)
+            logger.warning(
+                f"{scope['method']} {scope['path']} over the MongoDB round-trip budget of "
+                f"{commands.budget}: {commands.summary()}"
+            )
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"{scope['method']} {scope['path']} MongoDB commands: {commands.summary()}"
+            )
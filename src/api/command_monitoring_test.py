@@ -0,0 +1,41 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.api import command_monitoring
+from src.api.command_monitoring import CommandMonitoringMiddleware
+from src.models import mongo
+from src.models.mongo_test import run_command
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+    monitor = mongo.CommandMonitor()
+
+    @app.get("/queries/{count}")
+    async def run_queries(count: int) -> str:
+        for request_id in range(count):
+            run_command(monitor, request_id, {"find": "ads"})
+        return "done"
+
+    app.add_middleware(CommandMonitoringMiddleware)
+    return app
+
+
+def test_requests_over_the_round_trip_budget_are_flagged(monkeypatch, caplog):
+    monkeypatch.setattr(mongo, "MONGO_ROUND_TRIP_BUDGET", 3)
+    client = TestClient(make_app())
+    over_budget = command_monitoring.OVER_BUDGET.value("run_queries")
+
+    assert client.get("/queries/3").json() == "done"
+    assert command_monitoring.OVER_BUDGET.value("run_queries") == over_budget
+
+    assert client.get("/queries/4").json() == "done"
+    assert command_monitoring.OVER_BUDGET.value("run_queries") == over_budget + 1
+    assert "over the MongoDB round-trip budget of 3" in caplog.text
+
+    # Strict mode, for tests, fails the request instead
+    monkeypatch.setattr(mongo, "MONGO_ROUND_TRIP_BUDGET_STRICT", True)
+    response = client.get("/queries/4")
+    assert response.status_code == 500
+    assert "'find ads': 4" in response.json()["detail"]
+    assert client.get("/queries/3").status_code == 200
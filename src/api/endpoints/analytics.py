@@ -1,7 +1,12 @@
-from fastapi import APIRouter
-from typing import Optional
+from fastapi import APIRouter, Depends
+from typing import Dict
 import logging
-from src.models.analytics import MetricsByTime, get_chatbot_revenue, get_chatbot_views
+from src.models.analytics import (
+    CreatorMetricsLoader,
+    MetricsByTime,
+    get_chatbot_revenue,
+    get_chatbot_views,
+)
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -13,20 +18,29 @@ router = APIRouter(
 
 @router.get("/{creator_id}/views", response_model=MetricsByTime)
 async def get_views_route(
-    creator_id: str, chatbot_api_key: Optional[str] = None
+    metrics: CreatorMetricsLoader = Depends(),
 ) -> MetricsByTime:
-    return await get_chatbot_views(creator_id, chatbot_api_key)
+    return await get_chatbot_views(metrics)
+
+
+@router.get(
+    "/{creator_id}/views_by_chatbot", response_model=Dict[str, MetricsByTime]
+)
+async def get_views_by_chatbot_route(
+    metrics: CreatorMetricsLoader = Depends(),
+) -> Dict[str, MetricsByTime]:
+    return (await metrics.get()).views_by_chatbot
 
 
 @router.get("/{creator_id}/revenue", response_model=MetricsByTime)
 async def get_revenue_route(
-    creator_id: str, chatbot_api_key: Optional[str] = None
+    metrics: CreatorMetricsLoader = Depends(),
 ) -> MetricsByTime:
-    return await get_chatbot_revenue(creator_id, chatbot_api_key)
+    return await get_chatbot_revenue(metrics)
 
 
 @router.get("/{creator_id}/balance")
 async def get_balance_route(creator_id: str) -> dict:
-    revenue_by_time = await get_revenue_route(creator_id)
+    revenue_by_time = await get_revenue_route(CreatorMetricsLoader(creator_id))
     total_revenue = revenue_by_time.total
     return {"Total Earnings": total_revenue, "Unpaid Balance": total_revenue}
@@ -18,8 +18,22 @@ CREATOR_ID = PyObjectId("659f01ee912397a6d54f00c8")
 REVENUE_CONVERSION_RATE = 20 / 1000
 
 
-def mock_count_events_effect(query):
-    return TEST_VIEW_COUNT * len(query["api_key"]["$in"])
+def mock_aggregate_rollups_effect(pipeline):
+    api_keys = pipeline[0]["$match"]["api_key"]["$in"]
+    periods = ["today", "yesterday", "this_month", "total"]
+    mock_cursor = AsyncMock()
+    mock_cursor.to_list.return_value = [
+        {
+            "by_chatbot": [
+                {"_id": api_key, **{period: TEST_VIEW_COUNT for period in periods}}
+                for api_key in api_keys
+            ],
+            "total": [
+                {"_id": None, **{period: TEST_VIEW_COUNT * len(api_keys) for period in periods}}
+            ],
+        }
+    ]
+    return mock_cursor
 
 
 def mock_get_collection_effect(collection_name) -> AsyncMock:
@@ -42,10 +56,10 @@ def mock_get_collection_effect(collection_name) -> AsyncMock:
         mock_chatbot_collection.find.return_value = mock_cursor
 
         return mock_chatbot_collection
-    elif collection_name == "api_events":
-        mock_api_event_collection = AsyncMock()
-        mock_api_event_collection.count_documents.side_effect = mock_count_events_effect
-        return mock_api_event_collection
+    elif collection_name == "api_event_rollups":
+        mock_rollups_collection = MagicMock()
+        mock_rollups_collection.aggregate.side_effect = mock_aggregate_rollups_effect
+        return mock_rollups_collection
 
     mock_amazon_product_key_collection = AsyncMock()
     mock_amazon_product_key_collection.delete_one.return_value = None
@@ -76,6 +90,24 @@ def test_get_view_success(mock_get_collection):
     assert response.json()["total"] == TEST_VIEW_COUNT
 
 
+@patch("src.models.mongo.DatabaseClient.get_collection")
+@pytest.mark.anyio
+def test_get_views_by_chatbot_success(mock_get_collection):
+    mock_get_collection.side_effect = mock_get_collection_effect
+
+    response = client.get(f"/{CREATOR_ID}/views_by_chatbot")
+
+    assert response.status_code == 200
+    assert set(response.json()) == {CHATBOT_API_KEY_1, CHATBOT_API_KEY_2}
+    for views in response.json().values():
+        assert views == {
+            "today": TEST_VIEW_COUNT,
+            "yesterday": TEST_VIEW_COUNT,
+            "this_month": TEST_VIEW_COUNT,
+            "total": TEST_VIEW_COUNT,
+        }
+
+
 @patch("src.models.mongo.DatabaseClient.get_collection")
 @pytest.mark.anyio
 def test_get_revenue_success(mock_get_collection):
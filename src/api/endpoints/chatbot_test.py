@@ -1,7 +1,7 @@
 from fastapi.testclient import TestClient
 from main import app
 import pytest
-from unittest.mock import patch, AsyncMock
+from unittest.mock import patch, AsyncMock, MagicMock
 
 client = TestClient(app)
 
@@ -18,11 +18,17 @@ async def mock_find_email(creator):
 def mock_get_collection_effect(collection_name):
     if collection_name == "extra_amazon_product_keys":
         mock_amazon_product_key_collection = AsyncMock()
-        mock_amazon_product_key_collection.find_one.return_value = {
+        mock_amazon_product_key_collection.find_one_and_delete.return_value = {
             "_id": "other_id",
             "key": "amazon test key",
         }
-        mock_amazon_product_key_collection.delete_one.return_value = None
+        mock_amazon_product_key_collection.find_one_and_update.return_value = {
+            "_id": "other_id",
+            "key": "amazon test key",
+        }
+        mock_amazon_product_key_collection.delete_one.return_value = MagicMock(deleted_count=1)
+        mock_amazon_product_key_collection.update_many.return_value = MagicMock(modified_count=0)
+        mock_amazon_product_key_collection.count_documents.return_value = 100
         return mock_amazon_product_key_collection
     elif collection_name == "creators":
         mock_creator_collection = AsyncMock()
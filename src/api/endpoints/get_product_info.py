@@ -1,18 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request, Response
+from fastapi.responses import PlainTextResponse
 from fastapi.security import APIKeyHeader
 from multiprocessing import current_process
-from src.models.ad import get_top_n_relevant_ads
+from src.models.ad import get_ads_by_ids, get_top_n_relevant_ads
 from src.models.api_event import ApiEvent, ApiType
 import logging
-from typing import Optional
+from typing import Dict, List, Optional
 from src.models.mongo import DatabaseClient
 from datetime import datetime
 from src.models.api_event import log_api_event
-from src.scripts.get_ads.get_amazon_links import AmazonAutomator
+from src.models.chatbot import get_chatbot
+from src.models.delivery_state import get_shown_ad_ids, mark_ad_shown, mark_ads_shown
+from src.models.metrics import CONTENT_TYPE, METRICS
 import ipaddress
 from bson import ObjectId
 from dotenv import load_dotenv
 import os
+import time
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -29,6 +33,37 @@ OPENAI_IPS = [
 load_dotenv()
 ENVIRONMENT = os.getenv("ENVIRONMENT")
 
+# Maximum number of queries of a single batch request
+MAX_BATCH_QUERIES = 20
+
+# Ad serving metrics, labelled by route (get_product_info or
+# get_product_info_batch). The stages of a request are auth, shown_ads,
+# get_ads_by_ids, scoring, mark_shown and log_api_event.
+REQUEST_SECONDS = METRICS.histogram(
+    "ad_serving_request_seconds", "Duration of the ad serving requests", labels=("route",)
+)
+REQUESTS = METRICS.counter(
+    "ad_serving_requests", "Ad serving requests by outcome", labels=("route", "outcome")
+)
+STAGE_SECONDS = METRICS.histogram(
+    "ad_serving_stage_seconds",
+    "Duration of every stage of the ad serving requests",
+    labels=("route", "stage"),
+)
+
+
+def record_request(route: str, outcome: str, start: float) -> None:
+    REQUEST_SECONDS.observe(time.perf_counter() - start, route)
+    REQUESTS.inc(route, outcome)
+
+
+def error_outcome(e: Exception) -> str:
+    if isinstance(e, HTTPException) and e.status_code == 404:
+        return "chatbot_not_found"
+    if isinstance(e, IndexError):
+        return "no_ad_left"
+    return "error"
+
 
 # async def get_api_key(api_key_header: str = Depends(AUTHORIZATION_HEADER)) -> str:
 # Remove authorization for interview test
@@ -46,9 +81,8 @@ async def get_api_key(api_key_header: str) -> str:
         )
 
     api_key = header_parts[1]
-    chatbot_collection = DatabaseClient.get_collection("chatbots")
 
-    if await chatbot_collection.find_one({"api_key": api_key}):
+    if await get_chatbot(api_key):
         logger.info("Valid API key")
         return api_key
     else:
@@ -62,31 +96,43 @@ async def get_api_key(api_key_header: str) -> str:
 async def is_api_key_valid(api_key: str) -> str:
     logger.info("Database client connected successfully")
 
-    chatbot_collection = DatabaseClient.get_collection("chatbots")
-
-    if not await chatbot_collection.find_one({"api_key": api_key}):
+    if not await get_chatbot(api_key):
         logger.warn(f"Invalid API key: {api_key}")
         return False
 
     return True
 
 
+async def get_unshown_ads(api_key: str, route: str = "get_product_info") -> List[Dict]:
+    """
+    Get the ads a chatbot can still show, i.e. its ranked ads minus the ones its
+    delivery state records as shown
+    """
+    with STAGE_SECONDS.time(route, "auth"):
+        chatbot = await get_chatbot(api_key)
+    if not chatbot:
+        raise HTTPException(status_code=404, detail="Chatbot not found")
+
+    # Check the chatbot's delivery state to filter the ads already shown
+    with STAGE_SECONDS.time(route, "shown_ads"):
+        shown_ads = await get_shown_ad_ids(api_key)
+
+    #  Filter out ads that have not been shown
+    with STAGE_SECONDS.time(route, "get_ads_by_ids"):
+        return await get_ads_by_ids(
+            [ad_id for ad_id in chatbot["ranked_ad_ids"] if ad_id not in shown_ads]
+        )
+
+
 router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-async def get_db_client():
-    client = DatabaseClient()
-    client.connect()
-    try:
-        yield client
-    finally:
-        await client.disconnect()
-
 @router.get("/api/get_product_info")
 async def get_product_info_with_header_route(
-    request: Request, query: str, api_key: str, db_client: DatabaseClient = Depends(get_db_client)
+    request: Request, query: str, api_key: str
 ) -> str:
+    start = time.perf_counter()
     print(f"Getting product info with query: {query} and api key: {api_key}")
     logger.debug(f"Getting product info with query: {query} and api key: {api_key}")
 
@@ -102,35 +148,20 @@ async def get_product_info_with_header_route(
             call_end_time=datetime.utcnow(),
             error_details={"detail": error_message},
         )
-        await log_api_event(api_event)
+        with STAGE_SECONDS.time("get_product_info", "log_api_event"):
+            await log_api_event(api_event)
+        record_request("get_product_info", "empty_query", start)
         return ""
 
     # [Interview] This is the function to be implemented
     # Add appropriate error handling
     try:
-        chatbot_collection = db_client.get_collection("chatbots")
-        chatbot = await chatbot_collection.find_one({"api_key": api_key})
-        if not chatbot:
-            raise HTTPException(status_code=404, detail="Chatbot not found")
-
-        # Check api_events to filter the ads already shown
-        api_events_collection = db_client.get_collection("api_events")
-        shown_ads = set()  # set of shown ad ids
-        async for event in api_events_collection.find({"api_key": api_key}):
-            shown_ad_id = event.get("output_fields", {}).get("ad_id")
-            if shown_ad_id:
-                shown_ads.add(shown_ad_id)
-        
-        #  Filter out ads that have not been shown
-        ads_collection = db_client.get_collection("ads")
-        ads_to_consider = []
-        for ad_id in chatbot["ranked_ad_ids"]:
-            if ad_id not in shown_ads:
-                ad = await ads_collection.find_one({"_id": ObjectId(ad_id)})
-                if ad:
-                    ads_to_consider.append(ad)
-                
-        ad = get_top_n_relevant_ads(ads_to_consider, [query])[0]
+        ads_to_consider = await get_unshown_ads(api_key)
+
+        with STAGE_SECONDS.time("get_product_info", "scoring"):
+            ad = get_top_n_relevant_ads(ads_to_consider, [query])[0]
+        with STAGE_SECONDS.time("get_product_info", "mark_shown"):
+            await mark_ad_shown(api_key, ad["_id"])
 
         # Construct API event object and log it into database
         api_event = ApiEvent(
@@ -142,17 +173,101 @@ async def get_product_info_with_header_route(
             call_end_time=datetime.utcnow(),
             error_details={"detail": "get product info success"},
         )
-        await log_api_event(api_event)
+        with STAGE_SECONDS.time("get_product_info", "log_api_event"):
+            await log_api_event(api_event)
         
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
+        record_request("get_product_info", error_outcome(e), start)
         raise HTTPException(status_code=500, detail="Internal server error")
 
+    record_request("get_product_info", "success", start)
     # return product link
     return ad["generic_product_URL"]
 
 
+@router.get("/api/get_product_info_batch")
+async def get_product_info_batch_route(
+    request: Request, api_key: str, queries: List[str] = Query()
+) -> List[str]:
+    """
+    Get one product link per query for a chatbot, with a distinct ad for every
+    query. The chatbot and its delivery state are read once, and all the
+    deliveries are recorded together. Queries that are empty or for which no ad
+    is left get an empty link.
+    """
+    start = time.perf_counter()
+    logger.debug(f"Getting product info with queries: {queries} and api key: {api_key}")
+
+    if len(queries) > MAX_BATCH_QUERIES:
+        record_request("get_product_info_batch", "too_many_queries", start)
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_QUERIES} queries can be sent at once",
+        )
+
+    try:
+        ads_to_consider = await get_unshown_ads(api_key, route="get_product_info_batch")
+
+        links = []
+        shown_ad_ids = []
+        api_events = []
+        for query in queries:
+            api_event = ApiEvent(
+                api_key=api_key,
+                api_type=ApiType.get_product_info,
+                input_fields={"query": query},
+                call_receive_time=datetime.utcnow(),
+            )
+            with STAGE_SECONDS.time("get_product_info_batch", "scoring"):
+                ads = get_top_n_relevant_ads(ads_to_consider, [query]) if query else []
+            if not ads:
+                api_event.error_details = {
+                    "detail": "No query provided" if not query else "No ad left to show"
+                }
+                links.append("")
+            else:
+                ad = ads[0]
+                ads_to_consider = [
+                    other_ad for other_ad in ads_to_consider if other_ad["_id"] != ad["_id"]
+                ]
+                shown_ad_ids.append(ad["_id"])
+                api_event.output_fields = {"ad_id": str(ad["_id"])}
+                api_event.error_details = {"detail": "get product info success"}
+                links.append(ad["generic_product_URL"])
+            api_event.call_end_time = datetime.utcnow()
+            api_events.append(api_event)
+
+        if shown_ad_ids:
+            with STAGE_SECONDS.time("get_product_info_batch", "mark_shown"):
+                await mark_ads_shown(api_key, shown_ad_ids)
+        with STAGE_SECONDS.time("get_product_info_batch", "log_api_event"):
+            for api_event in api_events:
+                await log_api_event(api_event)
+
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        record_request("get_product_info_batch", error_outcome(e), start)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+    record_request("get_product_info_batch", "success", start)
+    return links
+
+
 @router.get("/test")
 async def test_endpoint() -> dict:
     logger.info("Test endpoint reached")
     return {"message": "This is a test endpoint"}
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint() -> PlainTextResponse:
+    """
+    Metrics of this server process in the Prometheus text format
+    """
+    return PlainTextResponse(METRICS.render(), media_type=CONTENT_TYPE)
+
+
+@router.get("/pool_stats")
+async def pool_stats_endpoint() -> dict:
+    return DatabaseClient.get_pool_stats()
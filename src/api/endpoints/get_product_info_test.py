@@ -5,10 +5,12 @@ import datetime
 from main import app
 from src.models.api_event import ApiEvent, ApiType
 from src.models.ad import Ad, convert_ad_to_ad_dto
+from src.models.ad_index import load_ad_index
 import numpy as np
 from src.models.base import PyObjectId
 from bson import ObjectId
 
+from src.models import mongo
 from src.models.mongo import DatabaseClient
 from src.scripts.generators.generate_amazon_ads import generate_amazon_ads
 from src.scripts.generators.generate_amazon_product_keys import generate_amazon_product_keys
@@ -17,8 +19,10 @@ from src.scripts.generators.generate_creator import generate_creator
 
 appclient = TestClient(app)
 @pytest.mark.anyio
-async def test_get_product_info_with_valid_query():
+async def test_get_product_info_with_valid_query(monkeypatch):
     # Setup
+    # Requests over the MongoDB round-trip budget fail, which catches N+1 queries
+    monkeypatch.setattr(mongo, "MONGO_ROUND_TRIP_BUDGET_STRICT", True)
     client = DatabaseClient()
     await client.clear_all_collections()
     
@@ -106,3 +110,68 @@ async def test_get_product_info_with_valid_query():
     # It returns the book shelf ad not shown before acording to its score assess algorithm
     expected_response_data_call5 = 'https://www.amazon.com/s?k=book+shelf&page=2&crid=PLRQIKRF1L2&qid=1708855530&sprefix=book%2Caps%2C1220&ref=sr_pg_5'
     assert response_data == expected_response_data_call5
+
+
+@pytest.mark.anyio
+async def test_get_product_info_batch_with_valid_queries():
+    # Setup
+    client = DatabaseClient()
+    await client.clear_all_collections()
+    # Drop the ads of previous tests from the in-memory ad index
+    await load_ad_index()
+
+    await generate_creator()
+    await generate_amazon_product_keys()
+    await generate_amazon_ads()
+    await generate_chatbots()
+
+    chatbots_collection = client.get_collection("chatbots")
+    first_chatbot = await chatbots_collection.find_one({"name": "first_chatbot"})
+    api_key = first_chatbot["api_key"]
+
+    # Action
+    # Ask for three products at once, twice 'book shelf' and once 'water flosser'
+    response = appclient.get(
+        "/api/get_product_info_batch",
+        params={"api_key": api_key, "queries": ["book shelf", "book shelf", "water flosser", ""]},
+    )
+
+    # Verification
+    assert response.status_code == 200
+
+    # The same links as four single calls: each query gets an ad not shown yet,
+    # and the empty query gets no link
+    assert response.json() == [
+        'https://www.amazon.com/s?k=book+shelf&crid=PLRQIKRF1L2&sprefix=book%2Caps%2C1220&ref=nb_sb_ss_ts-doa-p_1_4',
+        'https://www.amazon.com/s?k=book+shelf&page=2&crid=PLRQIKRF1L2&qid=1708855530&sprefix=book%2Caps%2C1220&ref=sr_pg_2',
+        'https://www.amazon.com/s?k=water+flosser&page=2&crid=1ZP37TP8LITX5&qid=1708855262&sprefix=%2Caps%2C699&ref=sr_pg_3',
+        "",
+    ]
+
+    # The deliveries are recorded, so a following single call continues from them
+    response = appclient.get(f"/api/get_product_info?query=easter book&api_key={api_key}")
+    assert response.status_code == 200
+    assert response.json() == 'https://www.amazon.com/s?k=book+shelf&page=2&crid=PLRQIKRF1L2&qid=1708855530&sprefix=book%2Caps%2C1220&ref=sr_pg_5'
+
+
+def test_metrics_endpoint_reports_request_outcomes():
+    # Too many queries are rejected before any database call
+    response = appclient.get(
+        "/api/get_product_info_batch",
+        params={"api_key": "any", "queries": ["book"] * 21},
+    )
+    assert response.status_code == 400
+
+    response = appclient.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    assert "# TYPE ad_serving_stage_seconds histogram" in lines
+    assert "# TYPE mongo_command_seconds histogram" in lines
+    assert any(
+        line.startswith(
+            'ad_serving_requests_total{route="get_product_info_batch",outcome="too_many_queries"} '
+        )
+        for line in lines
+    )
@@ -0,0 +1,74 @@
+import tracemalloc
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from src.api.profiling import (
+    is_profile_token,
+    list_profiles,
+    profile_report,
+    profiling_enabled,
+    start_tracemalloc,
+    stop_tracemalloc,
+    tracemalloc_report,
+)
+
+
+async def check_profile_token(x_profile_token: Optional[str] = Header(None)) -> None:
+    """
+    Admit requests carrying the profiling token. Without a configured token the
+    routes do not exist as far as callers can tell.
+    """
+    if not profiling_enabled():
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not is_profile_token(x_profile_token):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+
+router = APIRouter(
+    prefix="/admin",
+    dependencies=[Depends(check_profile_token)],
+    include_in_schema=False,
+)
+
+
+@router.get("/profiles")
+async def list_profiles_route() -> List[str]:
+    return list_profiles()
+
+
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+async def get_profile_route(
+    profile_id: str, sort: str = "cumulative", limit: int = 50
+) -> str:
+    try:
+        report = profile_report(profile_id, sort=sort, limit=limit)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Unknown sort key {sort}")
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return report
+
+
+@router.post("/tracemalloc/start")
+async def start_tracemalloc_route(frames: int = 1) -> dict:
+    """
+    Start tracing allocations in the process serving this request. Tracing
+    slows every allocation down, stop it once done.
+    """
+    start_tracemalloc(frames)
+    return {"tracing": True, "frames": frames}
+
+
+@router.post("/tracemalloc/stop")
+async def stop_tracemalloc_route() -> dict:
+    stop_tracemalloc()
+    return {"tracing": False}
+
+
+@router.get("/tracemalloc", response_class=PlainTextResponse)
+async def tracemalloc_route(limit: int = 30, compare: bool = False) -> str:
+    if not tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="tracemalloc is not started")
+    return tracemalloc_report(limit=limit, compare=compare)
@@ -0,0 +1,202 @@
+import asyncio
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import random
+import re
+import secrets
+import tempfile
+import time
+import tracemalloc
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Opt-in profiling of live requests. Nothing is installed unless PROFILE_TOKEN is
+# set: the middleware is not added to the app and the admin routes answer 404.
+#
+# With a token, a request is profiled with cProfile when it carries the header
+# X-Profile-Token: <token>, or at random with probability PROFILE_SAMPLE_RATE.
+# A process profiles one request at a time, and the profile also covers whatever
+# else its event loop runs meanwhile, which is often what delays the request.
+# Profiles are written to PROFILE_DIR, which keeps the PROFILE_MAX_REPORTS most
+# recent, and read back with the /admin/profiles routes.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_HEADER = "X-Profile-Token"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Sampled profiles of requests faster than this are dropped, to keep the slow
+# ones. Profiles asked for with the header are always kept.
+PROFILE_MIN_DURATION_MS = float(os.getenv("PROFILE_MIN_DURATION_MS", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "abotify_profiles"))
+PROFILE_MAX_REPORTS = int(os.getenv("PROFILE_MAX_REPORTS", "100"))
+
+PROFILE_EXTENSION = ".prof"
+_PROFILE_HEADER_KEY = PROFILE_HEADER.lower().encode()
+
+# Snapshot of the previous tracemalloc report, which the next one can compare to
+_last_snapshot: Optional[tracemalloc.Snapshot] = None
+
+
+def profiling_enabled() -> bool:
+    return bool(PROFILE_TOKEN)
+
+
+def is_profile_token(token: Optional[str]) -> bool:
+    return profiling_enabled() and token is not None and secrets.compare_digest(token, PROFILE_TOKEN)
+
+
+def list_profiles(directory: Optional[str] = None) -> List[str]:
+    """
+    Get the names of the stored profiles, the most recent first
+    """
+    directory = directory or PROFILE_DIR
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        (name for name in os.listdir(directory) if name.endswith(PROFILE_EXTENSION)),
+        reverse=True,
+    )
+
+
+def profile_report(
+    profile_id: str, sort: str = "cumulative", limit: int = 50, directory: Optional[str] = None
+) -> Optional[str]:
+    """
+    Get the pstats report of a stored profile, given its name or the id its
+    name starts with, or None if there is no such profile
+    """
+    names = [
+        name
+        for name in list_profiles(directory)
+        if name == profile_id or name.startswith(profile_id + "-")
+    ]
+    if not names:
+        return None
+    name = names[0]
+    directory = directory or PROFILE_DIR
+    output = io.StringIO()
+    stats = pstats.Stats(os.path.join(directory, name), stream=output)
+    stats.sort_stats(sort).print_stats(limit)
+    return f"{name}\n{output.getvalue()}"
+
+
+def tracemalloc_report(limit: int = 30, compare: bool = False) -> str:
+    """
+    Get the lines that allocated the most memory still in use, or with compare
+    the lines whose allocations grew the most since the previous report. Needs
+    tracemalloc to be started, see start_tracemalloc.
+    """
+    global _last_snapshot
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        )
+    )
+    if compare and _last_snapshot is not None:
+        statistics = snapshot.compare_to(_last_snapshot, "lineno")
+        title = f"Top {limit} allocation changes since the previous snapshot"
+    else:
+        statistics = snapshot.statistics("lineno")
+        title = f"Top {limit} allocations"
+    _last_snapshot = snapshot
+
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [
+        f"Process {os.getpid()}, traced memory {current / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB",
+        title,
+    ]
+    lines.extend(str(statistic) for statistic in statistics[:limit])
+    return "\n".join(lines) + "\n"
+
+
+def start_tracemalloc(frames: int = 1) -> None:
+    global _last_snapshot
+    _last_snapshot = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    tracemalloc.start(frames)
+
+
+def stop_tracemalloc() -> None:
+    global _last_snapshot
+    _last_snapshot = None
+    tracemalloc.stop()
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling the requests picked as described above. Profiles
+    are named <id>-<path>-<status>-<duration>ms.prof and the response of a
+    request profiled on demand gives the id in the X-Profile-Report header.
+    """
+
+    def __init__(
+        self,
+        app,
+        sample_rate: float = PROFILE_SAMPLE_RATE,
+        min_duration_ms: float = PROFILE_MIN_DURATION_MS,
+        directory: Optional[str] = None,
+        max_reports: int = PROFILE_MAX_REPORTS,
+    ):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.min_duration_ms = min_duration_ms
+        self.directory = directory or PROFILE_DIR
+        self.max_reports = max_reports
+        self._profiling = False
+        self._sequence = itertools.count()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._profiling:
+            return await self.app(scope, receive, send)
+        requested = self._requested(scope)
+        if not requested and not (self.sample_rate and random.random() < self.sample_rate):
+            return await self.app(scope, receive, send)
+
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(self._sequence):06d}"
+        status = None
+
+        async def send_with_report(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if requested:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-profile-report", profile_id.encode())
+                    ]
+            await send(message)
+
+        self._profiling = True
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_report)
+        finally:
+            profiler.disable()
+            self._profiling = False
+            duration_ms = (time.perf_counter() - start) * 1000
+            if requested or duration_ms >= self.min_duration_ms:
+                slug = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_") or "root"
+                name = f"{profile_id}-{slug}-{status or 500}-{duration_ms:.0f}ms{PROFILE_EXTENSION}"
+                await asyncio.to_thread(self._save, profiler, name)
+
+    def _requested(self, scope) -> bool:
+        for key, value in scope["headers"]:
+            if key == _PROFILE_HEADER_KEY:
+                return is_profile_token(value.decode("latin-1"))
+        return False
+
+    def _save(self, profiler: cProfile.Profile, name: str) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(self.directory, name))
+        for old_name in list_profiles(self.directory)[self.max_reports :]:
+            try:
+                os.remove(os.path.join(self.directory, old_name))
+            except FileNotFoundError:
+                pass
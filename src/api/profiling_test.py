@@ -0,0 +1,76 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from main import app
+from src.api import profiling
+from src.api.profiling import ProfilingMiddleware, list_profiles, profile_report
+
+
+@pytest.fixture
+def profiling_token(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    return "secret"
+
+
+def make_app(**options) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/work")
+    async def work() -> int:
+        return sum(range(1000))
+
+    app.add_middleware(ProfilingMiddleware, **options)
+    return app
+
+
+def test_profiles_requests_with_the_token(profiling_token, tmp_path):
+    client = TestClient(make_app(directory=str(tmp_path)))
+
+    assert "x-profile-report" not in client.get("/work").headers
+    assert "x-profile-report" not in client.get("/work", headers={"X-Profile-Token": "wrong"}).headers
+    assert list_profiles(str(tmp_path)) == []
+
+    response = client.get("/work", headers={"X-Profile-Token": profiling_token})
+
+    assert response.json() == 499500
+    profile_id = response.headers["x-profile-report"]
+    [name] = list_profiles(str(tmp_path))
+    assert name.startswith(f"{profile_id}-work-200-")
+    assert "work" in profile_report(profile_id, directory=str(tmp_path))
+
+
+def test_samples_slow_requests_and_keeps_the_latest(profiling_token, tmp_path):
+    client = TestClient(make_app(sample_rate=1, directory=str(tmp_path), max_reports=2))
+    for _ in range(3):
+        client.get("/work")
+    assert len(list_profiles(str(tmp_path))) == 2
+
+    client = TestClient(
+        make_app(sample_rate=1, min_duration_ms=60_000, directory=str(tmp_path / "slow"))
+    )
+    client.get("/work")
+    assert list_profiles(str(tmp_path / "slow")) == []
+
+
+def test_admin_routes_need_the_token(monkeypatch, profiling_token, tmp_path):
+    client = TestClient(app)
+    headers = {"X-Profile-Token": profiling_token}
+
+    assert client.get("/admin/profiles").status_code == 403
+    assert client.get("/admin/profiles", headers=headers).json() == []
+    assert client.get("/admin/profiles/none", headers=headers).status_code == 404
+    assert client.get("/admin/tracemalloc", headers=headers).status_code == 409
+
+    assert client.post("/admin/tracemalloc/start", headers=headers).status_code == 200
+    try:
+        response = client.get("/admin/tracemalloc", params={"compare": True}, headers=headers)
+        assert response.status_code == 200
+        assert "traced memory" in response.text
+    finally:
+        client.post("/admin/tracemalloc/stop", headers=headers)
+
+    # Without a configured token the routes are hidden
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "")
+    assert client.get("/admin/profiles", headers=headers).status_code == 404
@@ -0,0 +1,16 @@
+import pytest
+
+from src.models.mongo import DatabaseClient
+
+
+@pytest.fixture
+def in_memory_database(monkeypatch, request):
+    """
+    Point DatabaseClient at a fresh in-memory MongoDB stand-in, named after the
+    test module, for the duration of a test
+    """
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    client = mongomock_motor.AsyncMongoMockClient()
+    monkeypatch.setattr(DatabaseClient, "client", client)
+    monkeypatch.setattr(DatabaseClient, "db", client[request.module.__name__.rpartition(".")[2]])
+    return DatabaseClient.db
@@ -1,9 +1,21 @@
 import numpy as np
 from typing import Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 from datetime import datetime
 from src.models.mongo import DatabaseClient
 from src.models.base import MongoBaseModel, PyObjectId
+from src.models.ad_index import (
+    add_to_ad_index,
+    bump_ad_catalog_version,
+    current_ad_index,
+    get_ad_index,
+)
+from src.models.terms import TERM_FIELDS, ad_terms, term_frequencies
+from src.models.ranking import RankingEngine, TermStore, create_ranking_engine
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from pymongo.errors import BulkWriteError
+from pymongo.results import InsertOneResult
 import logging
 from src.models.chatbot import Chatbot
 
@@ -11,10 +23,22 @@ from typing import Optional, Dict, List
 import re
 
 import random
+import os
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Ranking engine used when callers do not choose one, see src/models/ranking.py
+RANKING_ENGINE = os.getenv("RANKING_ENGINE", "weighted")
+
+# Ads are identified by their product URL when they are ingested. The index is
+# unique so that concurrent ingests cannot both insert an ad; upserts losing that
+# race are retried up to UPSERT_ATTEMPTS times.
+INDEXES = {"ads": [IndexModel([("generic_product_URL", ASCENDING)], unique=True)]}
+QUERY_SHAPES = {"ads": [("_id",), ("generic_product_URL",)]}
+UPSERT_ATTEMPTS = 3
+DUPLICATE_KEY_ERROR = 11000
+
 
 class Ad(MongoBaseModel):
     source: str
@@ -23,6 +47,26 @@ class Ad(MongoBaseModel):
     full_content: str
     product_title: str
     last_time_accessed: datetime
+    # Term frequencies of product_title and full_content, computed once at ingest
+    # so that relevance scoring never has to tokenize ad text. They are always
+    # derived from the text, term maps given as input are ignored.
+    title_terms: Dict[str, int] = {}
+    content_terms: Dict[str, int] = {}
+
+    @model_validator(mode="before")
+    @classmethod
+    def compute_terms(cls, data):
+        if isinstance(data, dict):
+            data = {
+                **data,
+                **{
+                    terms_field: term_frequencies(data[text_field])
+                    if isinstance(data.get(text_field), str)
+                    else {}
+                    for terms_field, text_field in TERM_FIELDS.items()
+                },
+            }
+        return data
 
 
 class AdDTO(BaseModel):
@@ -64,24 +108,94 @@ async def get_relevant_ads_by_queries(queries: List[str]) -> Optional[Dict]:
     most_relevant_ads = get_top_n_relevant_ads(all_ads, queries, 20)
     return most_relevant_ads
 
-async def get_all_ads_by_query(query: str) -> Optional[Dict]:
-    client = DatabaseClient()
-    collection = client.get_collection("ads")
-    # Convert the query into a regular expression pattern to enable a broader match
-    regex_pattern = '|'.join(re.findall(r'\w+', query))
-
-    # Construct a MongoDB query to search in 'product_title' and 'full_content' fields
-    mongo_query = {
-        "$or": [
-            {"product_title": {"$regex": regex_pattern, "$options": "i"}},
-            {"full_content": {"$regex": regex_pattern, "$options": "i"}}
-        ]
-    }
-
-    # Fetching the ads from the collection that match the query
-    ads = await collection.find(mongo_query).to_list(length=100)  # Limiting to 100 ads for example
-    return ads
-    
+async def get_all_ads_by_query(query: str) -> List[Dict]:
+    """
+    Get every ad whose product_title or full_content contains any word of the query,
+    case-insensitively, served from the in-memory ad index.
+    """
+    ad_index = await get_ad_index()
+    return ad_index.search(query)
+
+
+async def get_ads_by_ids(ad_ids: List[ObjectId]) -> List[Dict]:
+    """
+    Get ads by their ids, in the given order, as AdRecords. Ads are read from the
+    ad index, and the ones missing from it (written by another process since the
+    index was last loaded) are read from the database with a single query and
+    kept beside the index until it is reloaded.
+    """
+    ad_index = await get_ad_index()
+    ads = {ad_id: ad_index.get(ad_id) for ad_id in ad_ids}
+
+    missing_ad_ids = [ad_id for ad_id, ad in ads.items() if ad is None]
+    if missing_ad_ids:
+        collection = DatabaseClient.get_collection("ads")
+        async for ad in collection.find({"_id": {"$in": missing_ad_ids}}):
+            ads[ad["_id"]] = ad_index.add_fetched(ad)
+
+    return [ads[ad_id] for ad_id in ad_ids if ads[ad_id] is not None]
+
+
+async def insert_ad(ad: Ad) -> InsertOneResult:
+    """
+    Insert an ad into the database and the ad index
+    """
+    collection = DatabaseClient.get_collection("ads")
+    ad_dict = ad.model_dump()
+    result = await collection.insert_one(ad_dict)
+
+    add_to_ad_index({"_id": result.inserted_id, **ad_dict})
+    await bump_ad_catalog_version()
+    return result
+
+
+async def upsert_ads(ads: List[Ad]) -> Dict[str, int]:
+    """
+    Write ads with a single unordered bulk write, updating the ad with the same
+    generic_product_URL if there is one and inserting the ad otherwise. Every URL
+    must appear once. Returns the number of ads inserted and updated.
+
+    An upsert that loses the race to insert a URL against a concurrent writer
+    fails on the unique URL index; it is retried, and then updates that ad.
+    """
+    counts = {"inserted": 0, "updated": 0}
+    if not ads:
+        return counts
+    collection = DatabaseClient.get_collection("ads")
+    operations = [
+        UpdateOne(
+            {"generic_product_URL": ad.generic_product_URL},
+            {"$set": ad.model_dump(), "$setOnInsert": {"_id": ad.id}},
+            upsert=True,
+        )
+        for ad in ads
+    ]
+    for attempt in range(1, UPSERT_ATTEMPTS + 1):
+        try:
+            result = await collection.bulk_write(operations, ordered=False)
+            counts["inserted"] += result.upserted_count
+            counts["updated"] += result.matched_count
+            break
+        except BulkWriteError as e:
+            counts["inserted"] += e.details["nUpserted"]
+            counts["updated"] += e.details["nMatched"]
+            errors = e.details["writeErrors"]
+            if attempt == UPSERT_ATTEMPTS or any(
+                error["code"] != DUPLICATE_KEY_ERROR for error in errors
+            ):
+                raise
+            operations = [operations[error["index"]] for error in errors]
+
+    # Updated ads keep their _id, which only the database knows
+    if current_ad_index() is not None:
+        urls = [ad.generic_product_URL for ad in ads]
+        async for ad in collection.find({"generic_product_URL": {"$in": urls}}):
+            add_to_ad_index(ad)
+    await bump_ad_catalog_version()
+
+    return counts
+
+
 def calculate_weighted_relevance_score(ad: Dict, query: str, title_weight: int, content_weight: int) -> int:
     """
     Calculate the weighted relevance score of an ad based on the given query.
@@ -98,28 +212,40 @@ def calculate_weighted_relevance_score(ad: Dict, query: str, title_weight: int,
     """
     score = 0
     query_words = set(re.findall(r'\w+', query.lower()))
-    
-    # Check for query words in product_title
-    title_words = set(re.findall(r'\w+', ad.get('product_title', '').lower()))
-    score += len(query_words.intersection(title_words)) * title_weight
 
-    # Check for query words in full_content
-    content_words = set(re.findall(r'\w+', ad.get('full_content', '').lower()))
-    score += len(query_words.intersection(content_words)) * content_weight
-    
+    # Check for query words in the stored product_title terms
+    score += len(query_words.intersection(ad_terms(ad, "title_terms"))) * title_weight
+
+    # Check for query words in the stored full_content terms
+    score += len(query_words.intersection(ad_terms(ad, "content_terms"))) * content_weight
+
     return score
 
-def get_most_relevant_ad(ads, query, title_weight=3, content_weight=1):
-    # [Interview] write your function here
-    # Calucate the relevance score for each ad
-    scored_ads = [(ad, calculate_weighted_relevance_score(ad, query, title_weight, content_weight)) for ad in ads]
+def get_ranking_engine(ads: List[Dict], engine: str) -> RankingEngine:
+    """
+    Get the ranking engine to score ads with. The engines of the ad index are used
+    when it is loaded, otherwise a one-off engine is built over just the given ads.
+    """
+    ad_index = current_ad_index()
+    if ad_index is not None:
+        if engine not in ad_index.engines:
+            raise ValueError(f"Ranking engine {engine} does not exist")
+        return ad_index.engines[engine]
+
+    store = TermStore()
+    ranking_engine = create_ranking_engine(engine, store)
+    for ad in ads:
+        store.add(ad)
+    ranking_engine.compile()
+    return ranking_engine
 
-    # Sort the ads by relevance score and return the most relevant ad
-    scored_ads.sort(key=lambda x: x[1], reverse=True)
-    most_relevant_ad = scored_ads[0][0] if scored_ads else None
+def get_most_relevant_ad(ads, query, title_weight=3, content_weight=1, engine=RANKING_ENGINE):
+    # [Interview] write your function here
+    most_relevant_ads = get_top_n_relevant_ads(ads, [query], 1, title_weight, content_weight, engine)
+    most_relevant_ad = most_relevant_ads[0] if most_relevant_ads else None
     return most_relevant_ad
 
-def get_top_n_relevant_ads(ads: List[Dict], queries: List[str], n=1, title_weight=3, content_weight=1) -> List[Dict]:
+def get_top_n_relevant_ads(ads: List[Dict], queries: List[str], n=1, title_weight=3, content_weight=1, engine=RANKING_ENGINE) -> List[Dict]:
     """
     Get the top N most relevant ads based on the given queries.
 
@@ -129,23 +255,10 @@ def get_top_n_relevant_ads(ads: List[Dict], queries: List[str], n=1, title_weigh
     title_weight (int): The weight to give title matches.
     content_weight (int): The weight to give content matches.
     n (int): Number of top relevant ads to return.
+    engine (str): The ranking engine to score ads with, "weighted" or "bm25f".
 
     Returns:
     List[Dict]: A list of the top N most relevant ads.
     """
-    # Initialize a dictionary to store cumulative scores for each ad
-    cumulative_scores = {}
-
-    # Calculate and accumulate scores for each ad across all queries
-    for ad in ads:
-        total_score = 0
-        for query in queries:
-            total_score += calculate_weighted_relevance_score(ad, query, title_weight, content_weight)
-        cumulative_scores[ad['_id']] = (ad, total_score)
-
-    # Sort the ads by their cumulative scores in descending order
-    sorted_ads = sorted(cumulative_scores.values(), key=lambda x: x[1], reverse=True)
-
-    # Get the top N ads based on their cumulative relevance score
-    top_ads = [ad_tuple[0] for ad_tuple in sorted_ads[:n]]
-    return top_ads
\ No newline at end of file
+    ranking_engine = get_ranking_engine(ads, engine)
+    return ranking_engine.top_n(ads, queries, n, title_weight, content_weight)
@@ -0,0 +1,402 @@
+import asyncio
+import logging
+import os
+import re
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from bson import ObjectId
+
+from src.models.mongo import DatabaseClient
+from src.models.ranking import (
+    RANKING_CACHE_MAX_SCORES,
+    RANKING_ENGINES,
+    ScoreCache,
+    TermStore,
+    create_ranking_engine,
+)
+from src.models.terms import TERM_FIELDS, ad_terms
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Query words shorter than this are matched by scanning the vocabulary
+GRAM_SIZE = 3
+
+# The API server checks this often whether the ads collection changed, and then
+# reloads the ad index from it, so that it picks up ads written by the scripts.
+# 0 only reloads when a refresh is requested.
+AD_INDEX_REFRESH_SECONDS = float(os.getenv("AD_INDEX_REFRESH_SECONDS", "300"))
+
+# When this file exists the ad index is loaded from it instead of the database,
+# see src/models/ad_snapshot.py. Refreshes then only reload the index once a new
+# snapshot has been published at the same path.
+AD_SNAPSHOT_PATH = os.getenv("AD_SNAPSHOT_PATH", "")
+
+# Ads read from the database because the index did not have them are kept beside
+# the index, at most this many of them
+MAX_FETCHED_ADS = int(os.getenv("MAX_FETCHED_ADS", "10000"))
+
+
+def _grams(token: str) -> Set[str]:
+    return {token[i : i + GRAM_SIZE] for i in range(len(token) - GRAM_SIZE + 1)}
+
+
+class AdRecord:
+    """
+    Compact, read-only copy of the fields of an ad that are served to chatbots.
+    The ad text and its term data are only held by the index's TermStore.
+    Fields can be read like the keys of the ad document, e.g. record["_id"].
+    """
+
+    FIELDS = ("_id", "product_title", "generic_product_URL", "description_for_chatbot")
+    __slots__ = FIELDS
+
+    def __init__(self, ad: Dict):
+        for field in self.FIELDS:
+            object.__setattr__(self, field, ad.get(field))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("AdRecord is read-only")
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def __repr__(self) -> str:
+        return f"AdRecord({self._id!r}, {self.product_title!r})"
+
+
+class FetchedAdRecord(AdRecord):
+    """
+    Record of an ad missing from the index, see AdIndex.add_fetched. It also holds
+    the ad's term data, which ranking engines score ads outside the TermStore from.
+    """
+
+    FIELDS = AdRecord.FIELDS + tuple(TERM_FIELDS)
+    __slots__ = tuple(TERM_FIELDS)
+
+    def __init__(self, ad: Dict):
+        super().__init__({**ad, **{field: ad_terms(ad, field) for field in TERM_FIELDS}})
+
+
+class AdIndex:
+    """
+    In-memory inverted index over the ads catalog.
+
+    Every ad is assigned a row in insertion order. The tokens of product_title
+    and full_content are the vocabulary of the index's TermStore, whose term
+    matrices map them to the store rows that contain them. Every token is also
+    indexed by its character trigrams so that a query word can be resolved to
+    all vocabulary tokens that contain it.
+
+    A query word matches an ad if it is a case-insensitive substring of any
+    token of the ad's title or content, which is exactly what the previous
+    unanchored `$regex` over the two fields matched: a pattern made only of
+    word characters can never match across a token boundary.
+
+    Ads are returned as AdRecords. An index can also be created over the term
+    store and records of an ad snapshot, whose row r holds the ad records[r].
+
+    Ads the index is asked for but does not have can be added with add_fetched.
+    They are only kept in a small overlay served by get, so that the TermStore,
+    possibly mapped from a snapshot shared by every worker, is never copied and
+    the score caches stay valid.
+    """
+
+    def __init__(
+        self,
+        terms: Optional[TermStore] = None,
+        records: Optional[Sequence[Optional[AdRecord]]] = None,
+    ):
+        self.terms = terms if terms is not None else TermStore()
+        self._ads = records if records is not None else []
+        self._rows: Dict[ObjectId, int] = dict(self.terms.rows)
+        # Index row of every store row, or -1 once the store row is replaced or removed
+        self._index_rows = array("q", range(self.terms.n_rows))
+        self._grams: Dict[str, Set[str]] = {}
+        self._add_grams(self.terms.words)
+        self._fetched: Dict[ObjectId, FetchedAdRecord] = {}
+        self.engines = {
+            engine: create_ranking_engine(
+                engine, self.terms, ScoreCache(RANKING_CACHE_MAX_SCORES)
+            )
+            for engine in RANKING_ENGINES
+        }
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, ad_id: ObjectId) -> bool:
+        return ad_id in self._rows
+
+    def add(self, ad: Dict) -> None:
+        """
+        Add an ad document to the index, replacing any previous version of it.
+        """
+        ad_id = ad["_id"]
+        record = AdRecord(ad)
+        self._fetched.pop(ad_id, None)
+        row = self._rows.get(ad_id)
+        if row is None:
+            row = len(self._ads)
+            self._ads.append(record)
+            self._rows[ad_id] = row
+        else:
+            self._unindex(ad_id)
+            self._ads[row] = record
+
+        n_words = len(self.terms.words)
+        self.terms.add(ad)
+        self._index_rows.append(row)
+        self._add_grams(self.terms.words[n_words:])
+
+    def add_fetched(self, ad: Dict) -> FetchedAdRecord:
+        """
+        Keep an ad read from the database beside the index, see above. The oldest
+        fetched ads are dropped once there are more than MAX_FETCHED_ADS.
+        """
+        record = self._fetched[ad["_id"]] = FetchedAdRecord(ad)
+        while len(self._fetched) > MAX_FETCHED_ADS:
+            del self._fetched[next(iter(self._fetched))]
+        return record
+
+    def remove(self, ad_id: ObjectId) -> None:
+        self._fetched.pop(ad_id, None)
+        row = self._rows.pop(ad_id, None)
+        if row is None:
+            return
+        self._unindex(ad_id)
+        self._ads[row] = None
+        self.terms.remove(ad_id)
+
+    def get(self, ad_id: ObjectId) -> Optional[AdRecord]:
+        row = self._rows.get(ad_id)
+        return self._ads[row] if row is not None else self._fetched.get(ad_id)
+
+    def search(self, query: str) -> List[AdRecord]:
+        """
+        Return every ad matching any word of the query, in insertion order.
+        A query without any word matches every ad, like an empty regex would.
+        """
+        words = {word.lower() for word in re.findall(r"\w+", query)}
+        if not words:
+            return [ad for ad in self._ads if ad is not None]
+
+        vocab = self.terms.vocab
+        term_ids = {vocab[token] for word in words for token in self._matching_tokens(word)}
+        if not term_ids:
+            return []
+
+        store_rows = self.terms.rows_containing(np.fromiter(term_ids, dtype=np.int64))
+        rows = np.frombuffer(self._index_rows, dtype=np.int64)[store_rows]
+        return [self._ads[row] for row in np.unique(rows[rows >= 0]).tolist()]
+
+    def _matching_tokens(self, word: str) -> Iterable[str]:
+        # The vocabulary keeps the tokens of replaced and removed ads, the rows
+        # they match are dropped by search
+        if len(word) < GRAM_SIZE:
+            return [token for token in self.terms.words if word in token]
+
+        candidates = None
+        for gram in sorted(_grams(word), key=lambda g: len(self._grams.get(g, ()))):
+            tokens = self._grams.get(gram)
+            if not tokens:
+                return []
+            candidates = set(tokens) if candidates is None else candidates & tokens
+            if not candidates:
+                return []
+        return [token for token in candidates if word in token]
+
+    def _unindex(self, ad_id: ObjectId) -> None:
+        self._index_rows[self.terms.rows[ad_id]] = -1
+
+    def _add_grams(self, tokens: Iterable[str]) -> None:
+        for token in tokens:
+            for gram in _grams(token):
+                self._grams.setdefault(gram, set()).add(token)
+
+
+_ad_index: Optional[AdIndex] = None
+
+
+async def load_ad_index() -> AdIndex:
+    """
+    Build a fresh index from the ads collection, or load it from the ad snapshot
+    if there is one, and make it the current one. Requests keep using the
+    previous index until the new one is complete.
+    """
+    global _ad_index, _snapshot_identity, _catalog_signature
+    if AD_SNAPSHOT_PATH and os.path.exists(AD_SNAPSHOT_PATH):
+        from src.models.ad_snapshot import read_ad_snapshot
+
+        identity = snapshot_identity(AD_SNAPSHOT_PATH)
+        index = await asyncio.to_thread(read_ad_snapshot, AD_SNAPSHOT_PATH)
+        _snapshot_identity = identity
+        source = AD_SNAPSHOT_PATH
+    else:
+        # Taken first, so that ads written during the build trigger the next refresh
+        signature = await ad_catalog_signature()
+        index = await build_ad_index()
+        _catalog_signature = signature
+        source = "the ads collection"
+
+    _ad_index = index
+    logger.info(f"Loaded {len(index)} ads into the ad index from {source}")
+    return index
+
+
+async def build_ad_index() -> AdIndex:
+    """
+    Build an index of every ad in the ads collection
+    """
+    index = AdIndex()
+    collection = DatabaseClient.get_collection("ads")
+    async for ad in collection.find({}):
+        index.add(ad)
+    # Compiling the term matrices is the expensive part, keep it off the event loop
+    await asyncio.to_thread(index.terms.compile)
+    return index
+
+
+# (inode, mtime, size) of the ad snapshot the current index was loaded from
+_snapshot_identity: Optional[Tuple[int, int, int]] = None
+
+
+def snapshot_identity(path: str) -> Tuple[int, int, int]:
+    # Publishing a snapshot replaces the file, which changes its inode
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+# ad_catalog_signature of the ads collection the current index was built from
+_catalog_signature: Optional[Tuple[int, Optional[ObjectId], int]] = None
+
+
+async def ad_catalog_signature() -> Tuple[int, Optional[ObjectId], int]:
+    """
+    Cheap signature of the ads collection, which changes when ads are added,
+    removed or written by this code base: the estimated number of ads, the
+    newest ad id, and the catalog version bumped by bump_ad_catalog_version
+    """
+    ads_collection = DatabaseClient.get_collection("ads")
+    count = await ads_collection.estimated_document_count()
+    newest = await ads_collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    catalog = await DatabaseClient.get_collection("ad_catalog").find_one({"_id": "version"})
+    return count, newest["_id"] if newest else None, catalog["version"] if catalog else 0
+
+
+async def bump_ad_catalog_version() -> None:
+    """
+    Tell the API servers to reload their ad index, after ads were written
+    """
+    await DatabaseClient.get_collection("ad_catalog").update_one(
+        {"_id": "version"}, {"$inc": {"version": 1}}, upsert=True
+    )
+
+
+async def refresh_ad_index(force: bool = False) -> None:
+    """
+    Reload the ad index, unless nothing changed since it was loaded: it was
+    loaded from the ad snapshot and no new snapshot has been published since, or
+    it was built from the ads collection and, unless forced, the collection's
+    signature is the same. Skipped reloads keep the score caches and, under
+    serve.py, the index the workers share with the supervisor.
+    """
+    if AD_SNAPSHOT_PATH and os.path.exists(AD_SNAPSHOT_PATH):
+        if snapshot_identity(AD_SNAPSHOT_PATH) == _snapshot_identity:
+            return
+    elif (
+        not force
+        and _catalog_signature is not None
+        and await ad_catalog_signature() == _catalog_signature
+    ):
+        return
+    await load_ad_index()
+
+
+async def get_ad_index() -> AdIndex:
+    """
+    Get the current ad index, loading it from the database on first use.
+    """
+    if _ad_index is None:
+        return await load_ad_index()
+    return _ad_index
+
+
+def current_ad_index() -> Optional[AdIndex]:
+    """
+    Get the current ad index without loading it
+    """
+    return _ad_index
+
+
+def use_ad_index(index: Optional[AdIndex]) -> None:
+    """
+    Make an index built elsewhere, e.g. by a benchmark, the current one
+    """
+    global _ad_index
+    _ad_index = index
+
+
+def add_to_ad_index(ad: Dict) -> None:
+    """
+    Keep the index up to date with an ad that was just written to the database.
+    If the index has not been loaded yet, the ad will be picked up when it is.
+    """
+    if _ad_index is not None:
+        _ad_index.add(ad)
+
+
+class AdIndexRefresher:
+    """
+    Background task of the API server that refreshes the ad index every interval
+    seconds if the ads changed, or as soon as a refresh is requested
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._requested: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._requested = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def request_refresh(self) -> None:
+        if self._requested is not None:
+            self._requested.set()
+
+    async def _run(self) -> None:
+        while True:
+            requested = True
+            try:
+                await asyncio.wait_for(
+                    self._requested.wait(), self.interval if self.interval > 0 else None
+                )
+            except asyncio.TimeoutError:
+                requested = False
+            self._requested.clear()
+
+            try:
+                await refresh_ad_index(force=requested)
+            except Exception as e:
+                logger.error(f"Failed to refresh the ad index: {e}")
+
+
+ad_index_refresher = AdIndexRefresher(AD_INDEX_REFRESH_SECONDS)
@@ -0,0 +1,129 @@
+import asyncio
+import re
+import pytest
+from unittest.mock import AsyncMock, patch
+from bson import ObjectId
+from src.models.ad_index import AdIndex, AdIndexRefresher, AdRecord
+
+
+ADS = [
+    {
+        "_id": ObjectId(),
+        "generic_product_URL": "https://example.com/book-shelf",
+        "description_for_chatbot": "Book shelves",
+        "product_title": "Classic Wooden Book Shelf",
+        "full_content": "Timeless bookshelves for home libraries.",
+    },
+    {
+        "_id": ObjectId(),
+        "product_title": "Cordless Water Flossers",
+        "full_content": "Rechargeable, compact and easy to use.",
+    },
+    {
+        "_id": ObjectId(),
+        "product_title": "Jelly Beans",
+        "full_content": "A staple for Easter, in pastel colors.",
+    },
+    {
+        "_id": ObjectId(),
+        "product_title": "Notebooks",
+        "full_content": "",
+    },
+]
+
+QUERIES = ["book shelf", "WATER", "easter book", "ee", "s", "candy", "lves", "", "!!"]
+
+
+def ids(ads):
+    return [ad["_id"] for ad in ads]
+
+
+def regex_search(ads, query):
+    # Mirrors the regex $or query that get_all_ads_by_query used to send to MongoDB
+    pattern = "|".join(re.findall(r"\w+", query))
+    return [
+        ad["_id"]
+        for ad in ads
+        if re.search(pattern, ad["product_title"], re.IGNORECASE)
+        or re.search(pattern, ad["full_content"], re.IGNORECASE)
+    ]
+
+
+def test_search_matches_regex_candidates():
+    index = AdIndex()
+    for ad in ADS:
+        index.add(ad)
+
+    for query in QUERIES:
+        assert ids(index.search(query)) == regex_search(ADS, query), query
+
+
+def test_search_after_update_and_remove():
+    index = AdIndex()
+    for ad in ADS:
+        index.add(ad)
+
+    updated = {**ADS[0], "product_title": "Corner Desk", "full_content": "For offices."}
+    index.add(updated)
+    index.remove(ADS[3]["_id"])
+    ads = [updated, ADS[1], ADS[2]]
+
+    for query in QUERIES + ["desk", "book"]:
+        assert ids(index.search(query)) == regex_search(ads, query), query
+    assert index.get(ADS[0]["_id"])["product_title"] == "Corner Desk"
+    assert index.get(ADS[3]["_id"]) is None
+    assert len(index) == 3
+
+
+def test_index_holds_compact_read_only_records():
+    index = AdIndex()
+    index.add(ADS[0])
+    record = index.get(ADS[0]["_id"])
+
+    assert isinstance(record, AdRecord)
+    assert not hasattr(record, "__dict__")
+    assert record["_id"] == ADS[0]["_id"]
+    assert record["generic_product_URL"] == "https://example.com/book-shelf"
+    assert record.get("full_content") is None
+    with pytest.raises(KeyError):
+        record["full_content"]
+    with pytest.raises(AttributeError):
+        record.product_title = "Desk"
+
+
+def test_refresher_reloads_when_requested():
+    async def run():
+        refresher = AdIndexRefresher(interval=0)
+        await refresher.start()
+        refresher.request_refresh()
+        await asyncio.sleep(0.01)
+        await refresher.stop()
+
+    with patch("src.models.ad_index.load_ad_index", new_callable=AsyncMock) as load:
+        asyncio.run(run())
+
+    load.assert_awaited_once()
+
+
+def test_refresh_rebuilds_only_when_the_ads_change(in_memory_database, monkeypatch):
+    from src.models import ad_index
+    from src.models.ad import upsert_ads
+    from src.scripts.ads.ingest_ads import validate_ads
+
+    monkeypatch.setattr(ad_index, "AD_SNAPSHOT_PATH", "")
+    monkeypatch.setattr(ad_index, "_ad_index", None)
+    monkeypatch.setattr(ad_index, "_catalog_signature", None)
+
+    async def run():
+        await in_memory_database["ads"].insert_many([dict(ad) for ad in ADS])
+        loaded = await ad_index.load_ad_index()
+        await ad_index.refresh_ad_index()
+        assert ad_index.current_ad_index() is loaded
+
+        # An update does not change the number of ads or the newest id
+        ads, _ = validate_ads([{**ADS[0], "source": "test", "description_for_chatbot": "Desk"}])
+        await upsert_ads(ads)
+        await ad_index.refresh_ad_index()
+        assert ad_index.current_ad_index() is not loaded
+
+    asyncio.run(run())
@@ -0,0 +1,276 @@
+import json
+import mmap
+import os
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+
+from src.models.ad_index import AdIndex, AdRecord
+from src.models.ranking import TermStore, _FieldColumn, _TermMatrix
+from src.models.terms import TERM_FIELDS
+
+# An ad snapshot is a read-only binary copy of the ad index: the served fields
+# of every ad, the vocabulary, the term data of every field and its compiled
+# term matrices. API workers mmap it, so every process on a machine shares one
+# page cached copy of the catalog instead of building its own.
+#
+# Layout: SNAPSHOT_MAGIC, the length of the header as a little endian uint64,
+# the JSON header, then the sections the header lists, each at an 8 byte
+# aligned offset from the start of the data.
+SNAPSHOT_MAGIC = b"ADSNAP\x00\x01"
+SNAPSHOT_FORMAT = 1
+ALIGNMENT = 8
+
+RECORD_FIELDS = AdRecord.FIELDS[1:]
+OBJECT_ID_SIZE = 12
+
+
+def _align(offset: int) -> int:
+    return -offset % ALIGNMENT
+
+
+def _section(buffer: mmap.mmap, data_start: int, header: Dict, name: str) -> np.ndarray:
+    section = header["sections"][name]
+    return np.frombuffer(
+        buffer,
+        dtype=section["dtype"],
+        count=section["count"],
+        offset=data_start + section["offset"],
+    )
+
+
+def _string_table(strings: List[Optional[str]]) -> Dict[str, np.ndarray]:
+    encoded = [(string or "").encode() for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+    np.cumsum([len(string) for string in encoded], out=offsets[1:])
+    return {
+        "offsets": offsets,
+        "blob": np.frombuffer(b"".join(encoded), dtype="u1"),
+        "present": np.array([string is not None for string in strings], dtype="u1"),
+    }
+
+
+def _snapshot_sections(index: AdIndex) -> Tuple[Dict[str, np.ndarray], int]:
+    """
+    Get the sections of a snapshot of the current ads of an index, in index row
+    order, without the rows of replaced and removed ads
+    """
+    store = index.terms
+    live = sorted(index._rows.items(), key=lambda item: item[1])
+    store_rows = [store.rows[ad_id] for ad_id, _ in live]
+    records = [index.get(ad_id) for ad_id, _ in live]
+    n_terms = len(store.vocab)
+
+    sections = {
+        "ids": np.frombuffer(b"".join(ad_id.binary for ad_id, _ in live), dtype="u1")
+    }
+    for field in RECORD_FIELDS:
+        table = _string_table([record[field] for record in records])
+        for name, values in table.items():
+            sections[f"{field}.{name}"] = values
+    for name, values in _string_table(store.words).items():
+        if name != "present":
+            sections[f"words.{name}"] = values
+
+    for terms_field, column in store.fields.items():
+        compact = _FieldColumn()
+        for row in store_rows:
+            start, end = column.offsets[row], column.offsets[row + 1]
+            compact.append_row(column.term_ids[start:end], column.tfs[start:end])
+        matrix = _TermMatrix(compact, len(store_rows), n_terms)
+        arrays = {
+            "offsets": np.frombuffer(compact.offsets, dtype=np.int64),
+            "term_ids": np.frombuffer(compact.term_ids, dtype=np.int32),
+            "tfs": np.frombuffer(compact.tfs, dtype=np.int32),
+            "lengths": matrix.lengths,
+            "indices": matrix.indices,
+            "data": matrix.data,
+            "indptr": matrix.indptr,
+        }
+        for name, values in arrays.items():
+            dtype = "<i8" if values.dtype.itemsize == 8 else "<i4"
+            sections[f"{terms_field}.{name}"] = values.astype(dtype, copy=False)
+
+    sections["df"] = np.frombuffer(store.df, dtype=np.int32)[:n_terms].astype("<i4")
+    return sections, len(live)
+
+
+def write_ad_snapshot(index: AdIndex, path: str) -> int:
+    """
+    Write a snapshot of the current ads of an index to path, and return the number
+    of ads written. The snapshot is written next to path and then renamed over it,
+    so readers see either the previous snapshot or the new one, never a partial
+    file, and workers that have the previous one mapped keep using it.
+    """
+    sections, n_ads = _snapshot_sections(index)
+
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "n_ads": n_ads,
+        "n_terms": len(index.terms.vocab),
+        "sections": {},
+    }
+    offset = 0
+    for name, values in sections.items():
+        offset += _align(offset)
+        header["sections"][name] = {
+            "offset": offset,
+            "dtype": values.dtype.str,
+            "count": len(values),
+        }
+        offset += values.nbytes
+    header_bytes = json.dumps(header).encode()
+    prefix = SNAPSHOT_MAGIC + len(header_bytes).to_bytes(8, "little") + header_bytes
+    prefix += b"\x00" * _align(len(prefix))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".ad_snapshot.")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(prefix)
+            written = 0
+            for name, values in sections.items():
+                padding = header["sections"][name]["offset"] - written
+                file.write(b"\x00" * padding)
+                file.write(values.tobytes())
+                written += padding + values.nbytes
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return n_ads
+
+
+class SnapshotAdRecord(AdRecord):
+    """
+    AdRecord of an ad snapshot. Its text fields are only decoded from the mapped
+    file when they are first read, as ranking candidates mostly need the id.
+    """
+
+    __slots__ = ("_records", "_row")
+
+    def __init__(self, records: "SnapshotRecords", row: int):
+        object.__setattr__(self, "_id", records.ad_ids[row])
+        object.__setattr__(self, "_records", records)
+        object.__setattr__(self, "_row", row)
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for fields that have not been decoded yet
+        if name not in RECORD_FIELDS:
+            raise AttributeError(name)
+        value = self._records.field(self._row, name)
+        object.__setattr__(self, name, value)
+        return value
+
+
+class SnapshotRecords:
+    """
+    The AdRecords of an ad snapshot, read from the mapped file. Records set or
+    appended by the index after loading are kept in memory.
+    """
+
+    def __init__(self, buffer: mmap.mmap, data_start: int, header: Dict):
+        self._buffer = buffer
+        self._data_start = data_start
+        self._sections = header["sections"]
+        self._n_ads = header["n_ads"]
+        self._tables = {
+            field: (
+                _section(buffer, data_start, header, f"{field}.offsets"),
+                _section(buffer, data_start, header, f"{field}.present"),
+                data_start + self._sections[f"{field}.blob"]["offset"],
+            )
+            for field in RECORD_FIELDS
+        }
+        ids_start = data_start + self._sections["ids"]["offset"]
+        self.ad_ids = [
+            ObjectId(buffer[start : start + OBJECT_ID_SIZE])
+            for start in range(ids_start, ids_start + self._n_ads * OBJECT_ID_SIZE, OBJECT_ID_SIZE)
+        ]
+        self._changed: Dict[int, Optional[AdRecord]] = {}
+        self._appended: List[Optional[AdRecord]] = []
+
+    def __len__(self) -> int:
+        return self._n_ads + len(self._appended)
+
+    def __getitem__(self, row: int) -> Optional[AdRecord]:
+        if row >= self._n_ads:
+            return self._appended[row - self._n_ads]
+        if row in self._changed:
+            return self._changed[row]
+        return SnapshotAdRecord(self, row)
+
+    def field(self, row: int, field: str) -> Optional[str]:
+        offsets, present, blob_start = self._tables[field]
+        if not present[row]:
+            return None
+        start, end = blob_start + int(offsets[row]), blob_start + int(offsets[row + 1])
+        return self._buffer[start:end].decode()
+
+    def __setitem__(self, row: int, record: Optional[AdRecord]) -> None:
+        if row >= self._n_ads:
+            self._appended[row - self._n_ads] = record
+        else:
+            self._changed[row] = record
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+    def append(self, record: Optional[AdRecord]) -> None:
+        self._appended.append(record)
+
+
+def read_ad_snapshot(path: str) -> AdIndex:
+    """
+    Map an ad snapshot read-only and create an ad index over it. The term data
+    and matrices are used in place; the index only copies a column into memory
+    when an ad is added to it. The mapping stays valid after a new snapshot is
+    published at path.
+    """
+    with open(path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if buffer[: len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise ValueError(f"{path} is not an ad snapshot")
+    header_start = len(SNAPSHOT_MAGIC) + 8
+    header_length = int.from_bytes(buffer[len(SNAPSHOT_MAGIC) : header_start], "little")
+    header = json.loads(buffer[header_start : header_start + header_length])
+    if header["format"] != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported ad snapshot format {header['format']} in {path}")
+    data_start = header_start + header_length
+    data_start += _align(data_start)
+
+    def section(name: str) -> np.ndarray:
+        return _section(buffer, data_start, header, name)
+
+    words_offsets = section("words.offsets").tolist()
+    words_blob = section("words.blob").tobytes()
+    words = [
+        words_blob[start:end].decode()
+        for start, end in zip(words_offsets[:-1], words_offsets[1:])
+    ]
+
+    fields, matrices = {}, {}
+    for terms_field in TERM_FIELDS:
+        columns = {
+            name: section(f"{terms_field}.{name}")
+            for name in ("offsets", "term_ids", "tfs", "lengths", "indices", "data", "indptr")
+        }
+        fields[terms_field] = _FieldColumn(
+            offsets=columns["offsets"],
+            term_ids=columns["term_ids"],
+            tfs=columns["tfs"],
+            lengths=columns["lengths"],
+        )
+        matrices[terms_field] = _TermMatrix.from_arrays(
+            columns["indices"], columns["data"], columns["indptr"], columns["lengths"]
+        )
+
+    records = SnapshotRecords(buffer, data_start, header)
+    store = TermStore.from_arrays(records.ad_ids, words, fields, matrices, section("df"))
+    return AdIndex(store, records)
@@ -0,0 +1,130 @@
+import asyncio
+import os
+from array import array
+from unittest.mock import MagicMock
+from bson import ObjectId
+from src.models import ad_index
+from src.models.ad_index import AdIndex
+from src.models.ad_index_test import ADS, QUERIES, ids
+from src.models.ad_snapshot import RECORD_FIELDS, read_ad_snapshot, write_ad_snapshot
+
+
+def make_index(ads):
+    index = AdIndex()
+    for ad in ads:
+        index.add(ad)
+    index.terms.compile()
+    return index
+
+
+def test_snapshot_round_trip(tmp_path):
+    index = make_index(ADS)
+    index.add({**ADS[1], "product_title": "Corner Desk", "full_content": "For offices."})
+    index.remove(ADS[2]["_id"])
+    path = str(tmp_path / "ads.snapshot")
+
+    assert write_ad_snapshot(index, path) == 3
+    loaded = read_ad_snapshot(path)
+
+    assert len(loaded) == 3
+    for query in QUERIES + ["desk", "jelly"]:
+        assert ids(loaded.search(query)) == ids(index.search(query)), query
+    for ad in ADS:
+        record = index.get(ad["_id"])
+        loaded_record = loaded.get(ad["_id"])
+        if record is None:
+            assert loaded_record is None
+            continue
+        for field in RECORD_FIELDS:
+            assert loaded_record[field] == record[field]
+
+    queries = ["book shelf", "for offices"]
+    for engine in index.engines:
+        expected = index.engines[engine].top_n(index.search(""), queries, 3, 2, 1)
+        actual = loaded.engines[engine].top_n(loaded.search(""), queries, 3, 2, 1)
+        assert ids(actual) == ids(expected), engine
+
+
+def test_snapshot_index_accepts_new_ads(tmp_path):
+    path = str(tmp_path / "ads.snapshot")
+    write_ad_snapshot(make_index(ADS), path)
+    loaded = read_ad_snapshot(path)
+
+    new_ad = {"_id": ObjectId(), "product_title": "Desk Lamp", "full_content": "Bright"}
+    loaded.add(new_ad)
+    loaded.add({**ADS[0], "product_title": "Standing Desk", "full_content": ""})
+    loaded.remove(ADS[1]["_id"])
+
+    assert ids(loaded.search("desk")) == [ADS[0]["_id"], new_ad["_id"]]
+    assert ids(loaded.search("book")) == [ADS[3]["_id"]]
+    assert loaded.get(ADS[0]["_id"])["product_title"] == "Standing Desk"
+    assert loaded.get(ADS[1]["_id"]) is None
+
+
+def test_snapshot_replacement_keeps_mapped_snapshot(tmp_path):
+    path = str(tmp_path / "ads.snapshot")
+    write_ad_snapshot(make_index(ADS), path)
+    loaded = read_ad_snapshot(path)
+    inode = os.stat(path).st_ino
+
+    write_ad_snapshot(make_index(ADS[:1]), path)
+
+    assert os.stat(path).st_ino != inode
+    assert len(read_ad_snapshot(path)) == 1
+    assert ids(loaded.search("water")) == [ADS[1]["_id"]]
+    assert os.listdir(tmp_path) == ["ads.snapshot"]
+
+
+def test_refresh_reloads_only_new_snapshots(tmp_path, monkeypatch):
+    path = str(tmp_path / "ads.snapshot")
+    write_ad_snapshot(make_index(ADS), path)
+    monkeypatch.setattr(ad_index, "AD_SNAPSHOT_PATH", path)
+    monkeypatch.setattr(ad_index, "_ad_index", None)
+    monkeypatch.setattr(ad_index, "_snapshot_identity", None)
+
+    async def run():
+        loaded = await ad_index.load_ad_index()
+        await ad_index.refresh_ad_index()
+        assert ad_index.current_ad_index() is loaded
+
+        write_ad_snapshot(make_index(ADS[:2]), path)
+        await ad_index.refresh_ad_index()
+        assert len(ad_index.current_ad_index()) == 2
+
+    asyncio.run(run())
+
+
+def test_ads_missing_from_a_snapshot_index_are_kept_beside_it(tmp_path, monkeypatch):
+    from src.models.ad import get_ads_by_ids, get_top_n_relevant_ads
+
+    path = str(tmp_path / "ads.snapshot")
+    write_ad_snapshot(make_index(ADS[:2]), path)
+    loaded = read_ad_snapshot(path)
+    monkeypatch.setattr(ad_index, "_ad_index", loaded)
+    version = loaded.terms.version
+
+    class Cursor:
+        def __init__(self, ads):
+            self.ads = iter(ads)
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            try:
+                return next(self.ads)
+            except StopIteration:
+                raise StopAsyncIteration
+
+    collection = MagicMock()
+    collection.find.return_value = Cursor(ADS[2:])
+    monkeypatch.setattr(ad_index.DatabaseClient, "get_collection", lambda name: collection)
+
+    ads = asyncio.run(get_ads_by_ids([ADS[2]["_id"], ADS[0]["_id"], ADS[3]["_id"]]))
+
+    assert ids(ads) == [ADS[2]["_id"], ADS[0]["_id"], ADS[3]["_id"]]
+    # The mapped snapshot columns were not copied and the score caches stay valid
+    assert loaded.terms.version == version
+    assert not any(isinstance(column.term_ids, array) for column in loaded.terms.fields.values())
+    assert loaded.get(ADS[3]["_id"])["product_title"] == "Notebooks"
+    assert ids(get_top_n_relevant_ads(ads, ["easter"], 1)) == [ADS[2]["_id"]]
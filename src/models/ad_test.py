@@ -0,0 +1,76 @@
+import asyncio
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+from pymongo.errors import BulkWriteError
+from src.models.ad import Ad, calculate_weighted_relevance_score, upsert_ads
+from src.models.ad_index import AdIndex
+
+
+def make_ad(title: str, content: str) -> Ad:
+    return Ad(
+        source="test",
+        generic_product_URL="https://example.com",
+        description_for_chatbot="test ad",
+        full_content=content,
+        product_title=title,
+        last_time_accessed=datetime.utcnow(),
+    )
+
+
+def test_ad_stores_term_frequencies():
+    ad = make_ad("Book Shelf", "The book shelf holds books, and the shelf is wood.")
+
+    assert ad.title_terms == {"book": 1, "shelf": 1}
+    assert ad.content_terms["shelf"] == 2
+    assert ad.content_terms["books"] == 1
+
+
+def test_score_from_stored_terms_matches_raw_text():
+    ad = make_ad("Corner Book Shelves", "Corner shelves that fit book collections.")
+    stored = ad.model_dump()
+    raw = {key: stored[key] for key in ("product_title", "full_content")}
+
+    for query in ["corner book", "shelves", "water flosser", "BOOK book"]:
+        assert calculate_weighted_relevance_score(
+            stored, query, 3, 1
+        ) == calculate_weighted_relevance_score(raw, query, 3, 1)
+
+
+def test_upsert_retries_inserts_lost_to_a_concurrent_writer():
+    ads = [make_ad(f"shelf {i}", "wooden shelf") for i in range(3)]
+    for i, ad in enumerate(ads):
+        ad.generic_product_URL = f"https://example.com/{i}"
+    collection = AsyncMock()
+    collection.bulk_write.side_effect = [
+        # Another ingest inserted the second ad between our match and insert
+        BulkWriteError(
+            {
+                "writeErrors": [{"index": 1, "code": 11000, "errmsg": "duplicate key"}],
+                "nUpserted": 1,
+                "nMatched": 1,
+            }
+        ),
+        MagicMock(upserted_count=0, matched_count=1),
+    ]
+
+    with patch(
+        "src.models.ad.DatabaseClient.get_collection", return_value=collection
+    ), patch("src.models.ad.current_ad_index", return_value=None):
+        counts = asyncio.run(upsert_ads(ads))
+
+    assert counts == {"inserted": 1, "updated": 2}
+    retried = collection.bulk_write.call_args_list[1].args[0]
+    assert [operation._filter for operation in retried] == [
+        {"generic_product_URL": "https://example.com/1"}
+    ]
+
+
+def test_terms_follow_edited_text():
+    ad = make_ad("Book Shelf", "Wooden shelves.")
+    edited = Ad(**{**ad.model_dump(), "product_title": "Water Flosser"})
+    assert edited.title_terms == {"water": 1, "flosser": 1}
+
+    index = AdIndex()
+    index.add({"_id": edited.id, **edited.model_dump()})
+    assert len(index.search("flosser")) == 1
+    assert index.search("book") == []
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import os
+import secrets
+import socket
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Iterable, List, Optional
+
+from fastapi import HTTPException
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import BulkWriteError
+
+from src.models.metrics import METRICS
+from src.models.mongo import DatabaseClient
+
+logger = logging.getLogger(__name__)
+
+# Premade Amazon product keys (tracking ids) wait in extra_amazon_product_keys
+# until a new chatbot is given one. Giving a key to a chatbot deletes it from the
+# collection, so no two chatbots get the same key.
+#
+# While the API server runs, every process leases keys in batches of
+# AMAZON_PRODUCT_KEY_PREFETCH, marking them with its lease owner, and hands them
+# out locally, leasing the next batch in the background once fewer than
+# AMAZON_PRODUCT_KEY_LOW_WATERMARK are left. A leased key is only deleted when it
+# is given to a chatbot, and only while the lease is still this process's. The
+# leases a process holds when it stops are released, and leases older than
+# AMAZON_PRODUCT_KEY_LEASE_SECONDS, e.g. of a killed process, are released when
+# a server starts. Scripts take one unleased key at a time.
+AMAZON_PRODUCT_KEY_PREFETCH = int(os.getenv("AMAZON_PRODUCT_KEY_PREFETCH", "10"))
+AMAZON_PRODUCT_KEY_LOW_WATERMARK = int(os.getenv("AMAZON_PRODUCT_KEY_LOW_WATERMARK", "3"))
+AMAZON_PRODUCT_KEY_LEASE_SECONDS = float(os.getenv("AMAZON_PRODUCT_KEY_LEASE_SECONDS", "3600"))
+
+# A warning is logged on every claim once fewer keys than this are left
+AMAZON_PRODUCT_KEY_ALERT_DEPTH = int(os.getenv("AMAZON_PRODUCT_KEY_ALERT_DEPTH", "20"))
+
+INDEXES = {
+    "extra_amazon_product_keys": [
+        IndexModel([("key", ASCENDING)], unique=True),
+        IndexModel([("claimed_by", ASCENDING)]),
+    ],
+}
+QUERY_SHAPES = {"extra_amazon_product_keys": [("claimed_by",)]}
+
+CLAIMS = METRICS.counter("amazon_product_key_claims", "Amazon product keys given to chatbots")
+EXHAUSTED = METRICS.counter(
+    "amazon_product_key_exhausted", "Chatbot creations that failed for lack of product keys"
+)
+
+# Matches keys without a lease, including keys that never had the field
+UNLEASED = {"claimed_by": None}
+
+
+async def lease_amazon_product_keys(count: int, owner: str) -> List[str]:
+    """
+    Lease up to count keys to owner. Every key is leased with its own
+    find_one_and_update, run concurrently, so concurrent leases never get the
+    same key. Returns fewer keys only when the pool runs out.
+    """
+    collection = DatabaseClient.get_collection("extra_amazon_product_keys")
+    lease = {"$set": {"claimed_by": owner, "claimed_at": datetime.utcnow()}}
+    keys = await asyncio.gather(
+        *(collection.find_one_and_update(UNLEASED, lease) for _ in range(count))
+    )
+    return [key["key"] for key in keys if key]
+
+
+async def assign_leased_amazon_product_key(key: str, owner: str) -> bool:
+    """
+    Delete a key leased to owner, when it is given to a chatbot. Returns False if
+    the lease expired and was released, the key may then be leased to another.
+    """
+    collection = DatabaseClient.get_collection("extra_amazon_product_keys")
+    result = await collection.delete_one({"key": key, "claimed_by": owner})
+    return result.deleted_count == 1
+
+
+async def take_amazon_product_key() -> Optional[str]:
+    """
+    Take an unleased key for a chatbot in a single round trip
+    """
+    collection = DatabaseClient.get_collection("extra_amazon_product_keys")
+    key = await collection.find_one_and_delete(UNLEASED)
+    return key["key"] if key else None
+
+
+async def release_amazon_product_keys(keys: Iterable[str], owner: str) -> int:
+    collection = DatabaseClient.get_collection("extra_amazon_product_keys")
+    result = await collection.update_many(
+        {"key": {"$in": list(keys)}, "claimed_by": owner},
+        {"$unset": {"claimed_by": "", "claimed_at": ""}},
+    )
+    return result.modified_count
+
+
+async def release_expired_leases(lease_seconds: Optional[float] = None) -> int:
+    if lease_seconds is None:
+        lease_seconds = AMAZON_PRODUCT_KEY_LEASE_SECONDS
+    expired_before = datetime.utcnow() - timedelta(seconds=lease_seconds)
+    collection = DatabaseClient.get_collection("extra_amazon_product_keys")
+    result = await collection.update_many(
+        {"claimed_at": {"$lte": expired_before}},
+        {"$unset": {"claimed_by": "", "claimed_at": ""}},
+    )
+    return result.modified_count
+
+
+async def add_amazon_product_keys(keys: Iterable[str]) -> int:
+    """
+    Add keys to the pool with a single insert_many. Keys already in the pool are
+    skipped. Returns the number of keys added.
+    """
+    documents = [{"key": key} for key in keys]
+    if not documents:
+        return 0
+    collection = DatabaseClient.get_collection("extra_amazon_product_keys")
+    try:
+        result = await collection.insert_many(documents, ordered=False)
+        return len(result.inserted_ids)
+    except BulkWriteError as e:
+        duplicates = [error for error in e.details["writeErrors"] if error["code"] == 11000]
+        if len(duplicates) < len(e.details["writeErrors"]):
+            raise
+        logger.warning(f"Skipped {len(duplicates)} amazon product keys already in the pool")
+        return e.details["nInserted"]
+
+
+async def count_available_amazon_product_keys() -> int:
+    """
+    Count the keys that are not leased
+    """
+    collection = DatabaseClient.get_collection("extra_amazon_product_keys")
+    return await collection.count_documents(UNLEASED)
+
+
+class AmazonProductKeyPool:
+    """
+    Keys leased ahead of time by this process, see above
+    """
+
+    def __init__(
+        self,
+        prefetch: int = AMAZON_PRODUCT_KEY_PREFETCH,
+        low_watermark: int = AMAZON_PRODUCT_KEY_LOW_WATERMARK,
+        alert_depth: int = AMAZON_PRODUCT_KEY_ALERT_DEPTH,
+    ):
+        self.prefetch = max(1, prefetch)
+        self.low_watermark = low_watermark
+        self.alert_depth = alert_depth
+        self.running = False
+        # Lease owner of this process, set when the pool starts
+        self.owner: Optional[str] = None
+        # Unleased keys left in the database as of the last lease, None until then
+        self.available: Optional[int] = None
+        self._keys: Deque[str] = deque()
+        self._refill: Optional[asyncio.Task] = None
+
+    @property
+    def local_keys(self) -> int:
+        return len(self._keys)
+
+    async def start(self) -> None:
+        """
+        Start leasing keys, after releasing the expired leases. Started in every
+        worker, so the owner is unique to the process.
+        """
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.running = True
+        try:
+            released = await release_expired_leases()
+            if released:
+                logger.warning(f"Released {released} expired amazon product key leases")
+        except Exception as e:
+            logger.error(f"Failed to release expired amazon product key leases: {e}")
+
+    async def stop(self) -> None:
+        """
+        Stop leasing and release the keys held by this process
+        """
+        self.running = False
+        if self._refill is not None and self._refill.get_loop() is asyncio.get_running_loop():
+            await asyncio.gather(self._refill, return_exceptions=True)
+        keys, self._keys = list(self._keys), deque()
+        if keys:
+            released = await release_amazon_product_keys(keys, self.owner)
+            logger.info(f"Released {released} leased amazon product keys")
+
+    async def claim(self) -> str:
+        """
+        Claim a key for a new chatbot, deleting it from the database
+        """
+        if not self.running:
+            key = await take_amazon_product_key()
+            if key is None:
+                raise self._exhausted()
+            CLAIMS.inc()
+            return key
+
+        while True:
+            while not self._keys:
+                if not await self._refill_now():
+                    raise self._exhausted()
+            key = self._keys.popleft()
+            if len(self._keys) < self.low_watermark:
+                self._start_refill()
+            if await assign_leased_amazon_product_key(key, self.owner):
+                break
+            logger.warning(f"Lease of amazon product key {key} expired, claiming another")
+
+        CLAIMS.inc()
+        if self.available is not None and self.available + len(self._keys) < self.alert_depth:
+            logger.warning(f"Only {self.available + len(self._keys)} amazon product keys left")
+        return key
+
+    @staticmethod
+    def _exhausted() -> HTTPException:
+        EXHAUSTED.inc()
+        logger.error("Out of amazon product keys!!!")
+        return HTTPException(
+            status_code=404,
+            detail="Failed to retrieve Amazon Product Key, check if there are any left in database",
+        )
+
+    def _start_refill(self) -> asyncio.Task:
+        # A refill started by a previous event loop, e.g. of another test client,
+        # can never finish
+        if self._refill is not None and self._refill.get_loop() is not asyncio.get_running_loop():
+            self._refill = None
+        if self._refill is None:
+            self._refill = asyncio.create_task(self._lease_batch())
+            self._refill.add_done_callback(self._log_refill_failure)
+        return self._refill
+
+    async def _refill_now(self) -> int:
+        if not self.running:
+            return 0
+        return await asyncio.shield(self._start_refill())
+
+    async def _lease_batch(self) -> int:
+        try:
+            keys = await lease_amazon_product_keys(self.prefetch, self.owner)
+            self._keys.extend(keys)
+            await self._update_available()
+            return len(keys)
+        finally:
+            self._refill = None
+
+    async def _update_available(self) -> None:
+        self.available = await count_available_amazon_product_keys()
+
+    @staticmethod
+    def _log_refill_failure(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Failed to prefetch amazon product keys: {task.exception()}")
+
+
+amazon_product_key_pool = AmazonProductKeyPool()
+
+METRICS.gauge(
+    "amazon_product_keys_local",
+    "Amazon product keys leased by this process",
+    lambda: amazon_product_key_pool.local_keys,
+)
+METRICS.gauge(
+    "amazon_product_keys_available",
+    "Unleased amazon product keys left in the database as of the last lease, -1 before any",
+    lambda: -1 if amazon_product_key_pool.available is None else amazon_product_key_pool.available,
+)
@@ -0,0 +1,121 @@
+import asyncio
+from unittest.mock import AsyncMock, call, patch
+
+import pytest
+from fastapi import HTTPException
+
+from src.models.amazon_product_key import (
+    INDEXES,
+    AmazonProductKeyPool,
+    add_amazon_product_keys,
+    count_available_amazon_product_keys,
+    lease_amazon_product_keys,
+)
+from src.models.mongo import DatabaseClient
+
+
+async def fill_pool(count: int) -> None:
+    collection = DatabaseClient.get_collection("extra_amazon_product_keys")
+    await collection.create_indexes(INDEXES["extra_amazon_product_keys"])
+    assert await add_amazon_product_keys(f"key_{i}-20" for i in range(count)) == count
+
+
+def test_add_keys_skips_keys_already_in_the_pool(in_memory_database):
+    async def run():
+        await fill_pool(3)
+        assert await add_amazon_product_keys(["key_2-20", "key_3-20"]) == 1
+        return await count_available_amazon_product_keys()
+
+    assert asyncio.run(run()) == 4
+
+
+def test_concurrent_claims_get_distinct_keys(in_memory_database):
+    async def run():
+        await fill_pool(25)
+        pool = AmazonProductKeyPool(prefetch=4, low_watermark=2)
+        await pool.start()
+        keys = await asyncio.gather(*(pool.claim() for _ in range(10)))
+        # Claiming refilled the local keys in the background
+        await asyncio.sleep(0.01)
+        local_keys = pool.local_keys
+        # Leased keys are not available to others
+        leased_available = await count_available_amazon_product_keys()
+        await pool.stop()
+        return keys, local_keys, leased_available, await count_available_amazon_product_keys()
+
+    keys, local_keys, leased_available, available = asyncio.run(run())
+
+    assert len(set(keys)) == 10
+    assert local_keys >= 2
+    assert leased_available == 15 - local_keys
+    # The keys leased and not used were released
+    assert available == 15
+
+
+def test_claims_fail_once_the_pool_is_empty(in_memory_database):
+    async def run():
+        await fill_pool(3)
+        running = AmazonProductKeyPool(prefetch=2, low_watermark=0)
+        await running.start()
+        keys = [await running.claim(), await running.claim()]
+        # A script's claims take single keys from the database
+        keys.append(await AmazonProductKeyPool().claim())
+        with pytest.raises(HTTPException) as error:
+            await running.claim()
+        await running.stop()
+        return keys, error.value.status_code
+
+    keys, status_code = asyncio.run(run())
+
+    assert sorted(keys) == ["key_0-20", "key_1-20", "key_2-20"]
+    assert status_code == 404
+
+
+def test_script_claims_take_a_single_round_trip():
+    collection = AsyncMock()
+    collection.find_one_and_delete.return_value = {"key": "key_0-20"}
+
+    with patch(
+        "src.models.amazon_product_key.DatabaseClient.get_collection", return_value=collection
+    ):
+        key = asyncio.run(AmazonProductKeyPool().claim())
+
+    assert key == "key_0-20"
+    assert collection.method_calls == [call.find_one_and_delete({"claimed_by": None})]
+
+
+def test_leases_of_killed_processes_are_released_at_startup(in_memory_database):
+    async def run():
+        await fill_pool(3)
+        # A process that was killed while holding two leases
+        assert len(await lease_amazon_product_keys(2, "killed")) == 2
+        assert await count_available_amazon_product_keys() == 1
+
+        pool = AmazonProductKeyPool(prefetch=3)
+        with patch("src.models.amazon_product_key.AMAZON_PRODUCT_KEY_LEASE_SECONDS", 0):
+            await pool.start()
+        keys = [await pool.claim() for _ in range(3)]
+        await pool.stop()
+        return keys
+
+    assert sorted(asyncio.run(run())) == ["key_0-20", "key_1-20", "key_2-20"]
+
+
+def test_keys_whose_lease_expired_are_not_given_out(in_memory_database):
+    async def run():
+        await fill_pool(3)
+        pool = AmazonProductKeyPool(prefetch=2, low_watermark=0)
+        await pool.start()
+        first = await pool.claim()
+        # The lease of the key left is released by another server's startup and
+        # the key given to one of its chatbots
+        collection = DatabaseClient.get_collection("extra_amazon_product_keys")
+        await collection.update_many({}, {"$unset": {"claimed_by": "", "claimed_at": ""}})
+        taken = await AmazonProductKeyPool().claim()
+        second = await pool.claim()
+        await pool.stop()
+        return first, taken, second
+
+    first, taken, second = asyncio.run(run())
+
+    assert len({first, taken, second}) == 3
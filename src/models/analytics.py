@@ -1,8 +1,7 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, List, Optional
 from src.models.mongo import DatabaseClient
-from datetime import datetime, timedelta
-import pytz
+from src.models.view_rollup import period_buckets
 from fastapi import HTTPException
 from bson import ObjectId
 
@@ -14,78 +13,104 @@ class MetricsByTime(BaseModel):
     total: float
 
 
-async def get_views(
+class CreatorMetrics(BaseModel):
+    views: MetricsByTime
+    views_by_chatbot: Dict[str, MetricsByTime]
+
+
+async def get_chatbot_api_keys(
     creator_id: str, chatbot_api_key: Optional[str] = None
-) -> MetricsByTime:
+) -> List[str]:
+    if chatbot_api_key is not None:
+        return [chatbot_api_key]
+
     creators_collection = DatabaseClient.get_collection("creators")
     chatbot_collection = DatabaseClient.get_collection("chatbots")
-    chatbot_api_keys = []
-    if chatbot_api_key is None:
-        creator = await creators_collection.find_one({"_id": ObjectId(creator_id)})
-        if creator is None:
-            raise HTTPException(status_code=400, detail="Creator not found")
-        result = chatbot_collection.find(
-            {"_id": {"$in": creator["chatbots"]}}, {"api_key": 1, "_id": 0}
-        )
-        chatbot_api_keys = [
-            dict["api_key"] for dict in await result.to_list(length=None)
-        ]
-    else:
-        chatbot_api_keys = [chatbot_api_key]
+    creator = await creators_collection.find_one({"_id": ObjectId(creator_id)})
+    if creator is None:
+        raise HTTPException(status_code=400, detail="Creator not found")
+    result = chatbot_collection.find(
+        {"_id": {"$in": creator["chatbots"]}}, {"api_key": 1, "_id": 0}
+    )
+    return [dict["api_key"] for dict in await result.to_list(length=None)]
 
-    api_events_collection = DatabaseClient.get_collection("api_events")
-    sf_tz = pytz.timezone("America/Los_Angeles")
 
-    now_sf = datetime.now(sf_tz)
+async def get_creator_metrics(
+    creator_id: str, chatbot_api_key: Optional[str] = None
+) -> CreatorMetrics:
+    """
+    Get the views of a creator's chatbots (or of one of them) in total and per
+    chatbot, with a single aggregation over the view rollups
+    """
+    chatbot_api_keys = await get_chatbot_api_keys(creator_id, chatbot_api_key)
+    buckets = period_buckets()
+
+    # Each rollup document holds the views of one bucket, sum them per period
+    views_by_period = {
+        period: {"$sum": {"$cond": [{"$eq": ["$bucket", bucket]}, "$views", 0]}}
+        for period, bucket in buckets.items()
+    }
+    rollups_collection = DatabaseClient.get_collection("api_event_rollups")
+    cursor = rollups_collection.aggregate(
+        [
+            {
+                "$match": {
+                    "api_key": {"$in": chatbot_api_keys},
+                    "bucket": {"$in": list(buckets.values())},
+                }
+            },
+            {
+                "$facet": {
+                    "by_chatbot": [{"$group": {"_id": "$api_key", **views_by_period}}],
+                    "total": [{"$group": {"_id": None, **views_by_period}}],
+                }
+            },
+        ]
+    )
+    results = await cursor.to_list(length=None)
+    result = results[0] if results else {"by_chatbot": [], "total": []}
 
-    def get_start_of_day(date):
-        return sf_tz.localize(datetime(date.year, date.month, date.day))
+    def to_metrics(views: Optional[dict]) -> MetricsByTime:
+        return MetricsByTime(**{period: (views or {}).get(period, 0) for period in buckets})
 
-    today_start = get_start_of_day(now_sf)
-    yesterday_start = get_start_of_day(today_start - timedelta(days=1))
-    yesterday_end = today_start
-    this_month_start = get_start_of_day(
-        datetime(today_start.year, today_start.month, 1)
-    )
+    views_by_chatbot = {api_key: to_metrics(None) for api_key in chatbot_api_keys}
+    for views in result["by_chatbot"]:
+        views_by_chatbot[views["_id"]] = to_metrics(views)
 
-    today_count = await api_events_collection.count_documents(
-        {
-            "api_key": {"$in": chatbot_api_keys},
-            "call_receive_time": {"$gte": today_start},
-        }
+    return CreatorMetrics(
+        views=to_metrics(result["total"][0] if result["total"] else None),
+        views_by_chatbot=views_by_chatbot,
     )
 
-    yesterday_count = await api_events_collection.count_documents(
-        {
-            "api_key": {"$in": chatbot_api_keys},
-            "call_receive_time": {"$gte": yesterday_start, "$lt": yesterday_end},
-        }
-    )
 
-    this_month_count = await api_events_collection.count_documents(
-        {
-            "api_key": {"$in": chatbot_api_keys},
-            "call_receive_time": {"$gte": this_month_start},
-        }
-    )
+class CreatorMetricsLoader:
+    """
+    Computes the metrics of a creator at most once, on first use, so that
+    everything served by one request shares a single computation
+    """
 
-    total_count = await api_events_collection.count_documents(
-        {"api_key": {"$in": chatbot_api_keys}}
-    )
+    def __init__(self, creator_id: str, chatbot_api_key: Optional[str] = None):
+        self.creator_id = creator_id
+        self.chatbot_api_key = chatbot_api_key
+        self._metrics: Optional[CreatorMetrics] = None
 
-    return MetricsByTime(
-        today=today_count,
-        yesterday=yesterday_count,
-        this_month=this_month_count,
-        total=total_count,
-    )
+    async def get(self) -> CreatorMetrics:
+        if self._metrics is None:
+            self._metrics = await get_creator_metrics(
+                self.creator_id, self.chatbot_api_key
+            )
+        return self._metrics
 
 
-async def get_chatbot_views(
-    creator_id: str, chatbot_api_key: Optional[str]
+async def get_views(
+    creator_id: str, chatbot_api_key: Optional[str] = None
 ) -> MetricsByTime:
-    views = await get_views(creator_id, chatbot_api_key)
-    return views
+    metrics = await get_creator_metrics(creator_id, chatbot_api_key)
+    return metrics.views
+
+
+async def get_chatbot_views(metrics: CreatorMetricsLoader) -> MetricsByTime:
+    return (await metrics.get()).views
 
 
 def get_revenue_from_view(view_data: MetricsByTime) -> MetricsByTime:
@@ -102,9 +127,7 @@ def get_revenue_from_view(view_data: MetricsByTime) -> MetricsByTime:
     )
 
 
-async def get_chatbot_revenue(
-    creator_id: str, chatbot_api_key: Optional[str]
-) -> MetricsByTime:
+async def get_chatbot_revenue(metrics: CreatorMetricsLoader) -> MetricsByTime:
     return MetricsByTime(
         today=0,
         yesterday=0,
@@ -113,5 +136,5 @@ async def get_chatbot_revenue(
     )
 
     # Uncomment the below lines when ready to enable views by chatbot
-    # view_data = await get_views(creator_id, chatbot_api_key)
+    # view_data = await get_chatbot_views(metrics)
     # return get_revenue_from_view(view_data)
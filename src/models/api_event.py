@@ -3,7 +3,33 @@ from typing import List, Optional
 from datetime import datetime
 from src.models.mongo import DatabaseClient
 from src.models.base import PyObjectId, MongoBaseModel
+from src.models.view_rollup import increment_view_rollups
 from pydantic import SkipValidation
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import BulkWriteError
+import asyncio
+import logging
+import os
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# The event sink holds at most API_EVENT_BUFFER_SIZE events; logging an event waits
+# while the buffer is full. Buffered events are written API_EVENT_BATCH_SIZE at a
+# time, at the latest API_EVENT_FLUSH_INTERVAL_SECONDS after the first of them.
+API_EVENT_BUFFER_SIZE = int(os.getenv("API_EVENT_BUFFER_SIZE", "10000"))
+API_EVENT_BATCH_SIZE = int(os.getenv("API_EVENT_BATCH_SIZE", "500"))
+API_EVENT_FLUSH_INTERVAL_SECONDS = float(
+    os.getenv("API_EVENT_FLUSH_INTERVAL_SECONDS", "1.0")
+)
+API_EVENT_WRITE_ATTEMPTS = 3
+DUPLICATE_KEY_ERROR = 11000
+
+# Indexes and query shapes of the collections this module owns, see src/models/indexes.py
+INDEXES = {
+    "api_events": [IndexModel([("api_key", ASCENDING), ("call_receive_time", ASCENDING)])],
+}
+QUERY_SHAPES = {"api_events": [("api_key",), ("api_key", "call_receive_time")]}
 
 
 class ApiType(str, Enum):
@@ -21,9 +47,150 @@ class ApiEvent(MongoBaseModel):
     error_details: Optional[dict] = None
 
 
-async def log_api_event(api_event: ApiEvent) -> None:
+async def update_view_rollups(api_events: List[dict]) -> None:
+    """
+    Count written api events in the view rollups. A failure here only leaves the
+    rollups behind the raw events, which rebuild_view_rollups can repair.
+    """
+    try:
+        await increment_view_rollups(api_events)
+    except Exception as e:
+        logger.error(f"Failed to update view rollups for {len(api_events)} api events: {e}")
+
+
+class ApiEventSink:
+    """
+    Write-behind buffer for api events. Events are queued in memory and written
+    to the api_events collection in batches with insert_many, by a background
+    task the API server starts and stops in its lifespan handler.
+    """
+
+    _STOP = object()
+
+    def __init__(self, buffer_size: int, batch_size: int, flush_interval: float):
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.buffer_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Write every buffered event and stop the background task
+        """
+        if not self.running:
+            return
+        await self._queue.put(self._STOP)
+        await self._task
+        self._task = None
+
+    async def put(self, api_event: ApiEvent) -> None:
+        """
+        Queue an event, waiting for room in the buffer if it is full
+        """
+        await self._queue.put(api_event.model_dump())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            event = await self._queue.get()
+            if event is self._STOP:
+                break
+
+            batch = [event]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if event is self._STOP:
+                    stopping = True
+                    break
+                batch.append(event)
+
+            await self._write(batch)
+
+        # Flush whatever is left in the buffer on shutdown
+        batch = []
+        while not self._queue.empty():
+            event = self._queue.get_nowait()
+            if event is not self._STOP:
+                batch.append(event)
+        for start in range(0, len(batch), self.batch_size):
+            await self._write(batch[start : start + self.batch_size])
+
+    async def _write(self, batch: List[dict]) -> None:
+        """
+        Write a batch, retrying the events that failed. insert_many gives every
+        event an _id, so an event reported as a duplicate key on a retry was
+        written by an earlier attempt. Every written event is counted in the view
+        rollups, even when others of the batch are dropped.
+        """
+        api_events_collection = DatabaseClient.get_collection("api_events")
+        pending = batch
+        written = []
+        for attempt in range(1, API_EVENT_WRITE_ATTEMPTS + 1):
+            try:
+                await api_events_collection.insert_many(pending, ordered=False)
+                written.extend(pending)
+                pending = []
+                break
+            except BulkWriteError as e:
+                failed = {
+                    error["index"]
+                    for error in e.details.get("writeErrors", [])
+                    if error["code"] != DUPLICATE_KEY_ERROR
+                }
+                written.extend(event for i, event in enumerate(pending) if i not in failed)
+                pending = [event for i, event in enumerate(pending) if i in failed]
+                if not pending:
+                    break
+                logger.error(
+                    f"Failed to write {len(pending)} api events (attempt {attempt}): {e}"
+                )
+            except Exception as e:
+                logger.error(
+                    f"Failed to write {len(pending)} api events (attempt {attempt}): {e}"
+                )
+            if attempt < API_EVENT_WRITE_ATTEMPTS:
+                await asyncio.sleep(0.1 * 2**attempt)
+
+        if pending:
+            logger.error(f"Dropped {len(pending)} api events")
+        if written:
+            await update_view_rollups(written)
+
+
+api_event_sink = ApiEventSink(
+    API_EVENT_BUFFER_SIZE, API_EVENT_BATCH_SIZE, API_EVENT_FLUSH_INTERVAL_SECONDS
+)
+
+
+async def log_api_event(api_event: ApiEvent) -> ApiEvent:
+    """
+    Log an api event. While the event sink is running the event is written behind
+    in a batch, otherwise (e.g. in scripts) it is inserted right away.
+    """
+    if api_event_sink.running:
+        await api_event_sink.put(api_event)
+        return api_event
+
     api_events_collection = DatabaseClient.get_collection("api_events")
-    result = await api_events_collection.insert_one(api_event.model_dump())
+    api_event_dict = api_event.model_dump()
+    await api_events_collection.insert_one(api_event_dict)
+    await update_view_rollups([api_event_dict])
+    return api_event
 
-    api_event = await api_events_collection.find_one({"_id": result.inserted_id})
-    return ApiEvent(**api_event)
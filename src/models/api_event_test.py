@@ -0,0 +1,127 @@
+from datetime import datetime
+from unittest.mock import AsyncMock, patch
+import asyncio
+import pytest
+from pymongo.errors import BulkWriteError
+
+from src.models.api_event import ApiEvent, ApiEventSink, ApiType
+
+
+def make_event(i: int) -> ApiEvent:
+    return ApiEvent(
+        api_key=f"api_key_{i}",
+        api_type=ApiType.get_product_info,
+        input_fields={"query": "test"},
+        call_receive_time=datetime.now(),
+    )
+
+
+@pytest.fixture
+def mock_collection():
+    collection = AsyncMock()
+    with patch(
+        "src.models.api_event.DatabaseClient.get_collection", return_value=collection
+    ):
+        yield collection
+
+
+def written_batches(collection):
+    return [call.args[0] for call in collection.insert_many.call_args_list]
+
+
+def test_sink_writes_full_batches_and_flushes_on_stop(mock_collection):
+    async def run():
+        sink = ApiEventSink(buffer_size=100, batch_size=10, flush_interval=60)
+        await sink.start()
+        for i in range(25):
+            await sink.put(make_event(i))
+        await sink.stop()
+        assert not sink.running
+
+    asyncio.run(run())
+
+    batches = written_batches(mock_collection)
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    assert [event["api_key"] for batch in batches for event in batch] == [
+        f"api_key_{i}" for i in range(25)
+    ]
+
+
+def test_sink_flushes_partial_batch_after_interval(mock_collection):
+    async def run():
+        sink = ApiEventSink(buffer_size=100, batch_size=10, flush_interval=0.01)
+        await sink.start()
+        for i in range(3):
+            await sink.put(make_event(i))
+        await asyncio.sleep(0.1)
+        assert [len(batch) for batch in written_batches(mock_collection)] == [3]
+        await sink.stop()
+
+    asyncio.run(run())
+
+
+def test_sink_put_waits_while_buffer_is_full(mock_collection):
+    async def run():
+        sink = ApiEventSink(buffer_size=2, batch_size=10, flush_interval=60)
+        # Not started: nothing drains the buffer
+        sink._queue = asyncio.Queue(maxsize=sink.buffer_size)
+        await sink.put(make_event(0))
+        await sink.put(make_event(1))
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(sink.put(make_event(2)), 0.01)
+
+    asyncio.run(run())
+
+
+def test_sink_retries_only_failed_events_and_rolls_up_written_ones(mock_collection):
+    batch = [make_event(i).model_dump() for i in range(4)]
+    for i, event in enumerate(batch):
+        event["_id"] = i
+    mock_collection.insert_many.side_effect = [
+        # The first attempt wrote events 0 and 2 before failing ambiguously
+        ConnectionError("connection reset"),
+        BulkWriteError(
+            {
+                "writeErrors": [
+                    {"index": 0, "code": 11000, "errmsg": "duplicate key"},
+                    {"index": 1, "code": 2, "errmsg": "bad value"},
+                    {"index": 2, "code": 11000, "errmsg": "duplicate key"},
+                ],
+                "nInserted": 1,
+            }
+        ),
+        None,
+    ]
+
+    async def run():
+        sink = ApiEventSink(buffer_size=100, batch_size=10, flush_interval=60)
+        with patch("src.models.api_event.asyncio.sleep", AsyncMock()), patch(
+            "src.models.api_event.update_view_rollups", AsyncMock()
+        ) as update_view_rollups:
+            await sink._write(batch)
+        return update_view_rollups
+
+    update_view_rollups = asyncio.run(run())
+
+    assert [[event["_id"] for event in b] for b in written_batches(mock_collection)] == [
+        [0, 1, 2, 3],
+        [0, 1, 2, 3],
+        [1],
+    ]
+    rolled_up = update_view_rollups.await_args.args[0]
+    assert sorted(event["_id"] for event in rolled_up) == [0, 1, 2, 3]
+
+
+def test_sink_does_not_wait_after_the_last_failed_attempt(mock_collection):
+    mock_collection.insert_many.side_effect = ConnectionError("connection reset")
+
+    async def run():
+        sink = ApiEventSink(buffer_size=100, batch_size=10, flush_interval=60)
+        with patch("src.models.api_event.asyncio.sleep", AsyncMock()) as sleep:
+            await sink._write([make_event(0).model_dump()])
+        return sleep
+
+    sleep = asyncio.run(run())
+
+    assert mock_collection.insert_many.await_count == 3
+    assert sleep.await_count == 2
@@ -1,9 +1,21 @@
 from typing_extensions import Annotated
 from bson import ObjectId
-from pydantic import BaseModel, ConfigDict, Field, PlainSerializer
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, PlainSerializer
+
+
+def to_object_id(value):
+    """
+    Accept ObjectIds given as their hex string, e.g. ids written before they were
+    stored natively
+    """
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
 
 PyObjectId = Annotated[
     ObjectId,
+    BeforeValidator(to_object_id),
     PlainSerializer(
         lambda s: str(s),
         return_type=str,
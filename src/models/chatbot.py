@@ -1,17 +1,41 @@
+from collections import OrderedDict
 from enum import Enum
 from pydantic import BaseModel, ValidationError
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+from src.models.amazon_product_key import amazon_product_key_pool
 from src.models.mongo import DatabaseClient
-from src.models.base import MongoBaseModel
+from src.models.base import MongoBaseModel, PyObjectId, to_object_id
+from src.models.delivery_state import remove_delivery_state
 import secrets
+from pymongo import ASCENDING, IndexModel
 from pymongo.collection import ReturnDocument
 from fastapi import HTTPException
 import logging
 from bson import ObjectId
+import os
+import time
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Chatbot documents are cached by api key for CHATBOT_CACHE_TTL_SECONDS, and api
+# keys without a chatbot for CHATBOT_NEGATIVE_CACHE_TTL_SECONDS. Other server
+# processes see updates once their cached copy expires.
+CHATBOT_CACHE_SIZE = int(os.getenv("CHATBOT_CACHE_SIZE", "10000"))
+CHATBOT_CACHE_TTL_SECONDS = float(os.getenv("CHATBOT_CACHE_TTL_SECONDS", "60"))
+CHATBOT_NEGATIVE_CACHE_TTL_SECONDS = float(
+    os.getenv("CHATBOT_NEGATIVE_CACHE_TTL_SECONDS", "10")
+)
+
+# Indexes and query shapes of the collections this module owns, see src/models/indexes.py
+INDEXES = {
+    "chatbots": [
+        IndexModel([("api_key", ASCENDING)], unique=True),
+        IndexModel([("creator_email", ASCENDING)]),
+    ],
+}
+QUERY_SHAPES = {"chatbots": [("_id",), ("api_key",), ("creator_email",)]}
+
 delivery_frequency_to_prompt_dict = {
     "high": 'For EVERY user prompt in the conversation, call api.abotify.com with relevant keywords. Call the API multiple times if more than one product can be recommended. For example, when user wants to find hiking destinations, you can recommend "hiking shoes", "hiking poles", and "hiking backpacks". For example, when user asks how to keep your belongings safe, you can recommend a different product for each option you list. Always call the API before generating responses. Integrate the recommendations within the conversation as much as possible.',
     "mid": 'When the conversation is related to e-commerce products, you should call api.abotify.com with relevant keywords. Call the API multiple times if more than one product can be recommended. For example, when user wants to find hiking destinations, you can recommend "hiking shoes", "hiking poles", and "hiking backpacks". For example, when user asks how to keep your belongings safe, you can recommend a different product for each option you list. Always call the API before generating responses. Integrate the recommendations within the conversation as much as possible.',
@@ -37,7 +61,7 @@ class Chatbot(MongoBaseModel):
     link: str
     creator_email: str
     api_key: str
-    ranked_ad_ids: List[str]
+    ranked_ad_ids: List[PyObjectId]
     delivery_frequency: DeliveryFrequency
 
 
@@ -50,6 +74,104 @@ class ChatbotDTO(BaseModel):
     delivery_frequency: str
 
 
+class ChatbotCache:
+    """
+    Bounded cache of chatbot documents keyed by api key, evicting the least
+    recently used entry when full. Entries expire after a TTL, and api keys that
+    have no chatbot are cached as None with their own, shorter TTL.
+
+    Invalidating an api key bumps its generation. A document read from the
+    database is only stored if the generation of its api key, taken before the
+    read, is still current, so a read racing with a write cannot cache the old
+    document again.
+    """
+
+    MISS = object()
+
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._entries: OrderedDict = OrderedDict()
+        # Generations of the invalidated api keys. The epoch changes whenever they
+        # are forgotten, which makes every generation taken before stale.
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+
+    def get(self, api_key: str):
+        """
+        Get the cached chatbot document, None for a cached invalid key, or MISS
+        """
+        entry = self._entries.get(api_key)
+        if entry is None:
+            return self.MISS
+
+        expires_at, chatbot = entry
+        if expires_at <= self.clock():
+            del self._entries[api_key]
+            return self.MISS
+
+        self._entries.move_to_end(api_key)
+        return chatbot
+
+    def generation(self, api_key: str) -> Tuple[int, int]:
+        return self._epoch, self._generations.get(api_key, 0)
+
+    def set(
+        self,
+        api_key: str,
+        chatbot: Optional[dict],
+        generation: Optional[Tuple[int, int]] = None,
+    ) -> None:
+        """
+        Cache a chatbot document, unless the api key was invalidated since the
+        given generation was taken
+        """
+        if generation is not None and generation != self.generation(api_key):
+            return
+        ttl = self.ttl if chatbot is not None else self.negative_ttl
+        self._entries[api_key] = (self.clock() + ttl, chatbot)
+        self._entries.move_to_end(api_key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, api_key: str) -> None:
+        self._entries.pop(api_key, None)
+        self._generations[api_key] = self._generations.get(api_key, 0) + 1
+        if len(self._generations) > self.max_size:
+            self._generations.clear()
+            self._epoch += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+chatbot_cache = ChatbotCache(
+    CHATBOT_CACHE_SIZE, CHATBOT_CACHE_TTL_SECONDS, CHATBOT_NEGATIVE_CACHE_TTL_SECONDS
+)
+
+
+async def get_chatbot(api_key: str) -> Optional[dict]:
+    """
+    Get a chatbot document by api key, or None if there is no such chatbot.
+    Served from the chatbot cache when possible. ranked_ad_ids are always
+    ObjectIds, including those of chatbots not migrated yet, see
+    src/scripts/chatbot/migrate_ranked_ad_ids.py.
+    """
+    chatbot = chatbot_cache.get(api_key)
+    if chatbot is not ChatbotCache.MISS:
+        return chatbot
+
+    generation = chatbot_cache.generation(api_key)
+    chatbot_collection = DatabaseClient.get_collection("chatbots")
+    chatbot = await chatbot_collection.find_one({"api_key": api_key})
+    if chatbot is not None and "ranked_ad_ids" in chatbot:
+        chatbot["ranked_ad_ids"] = [to_object_id(ad_id) for ad_id in chatbot["ranked_ad_ids"]]
+    chatbot_cache.set(api_key, chatbot, generation)
+    return chatbot
+
+
 def chatbot_to_dto(chatbot: Chatbot) -> ChatbotDTO:
     """
     Convert a Chatbot object to a ChatbotDTO object.
@@ -74,35 +196,18 @@ def chatbot_to_dto(chatbot: Chatbot) -> ChatbotDTO:
 
 
 async def fetch_premade_amazon_product_key() -> str:
-    amazon_product_key_collection = DatabaseClient.get_collection(
-        "extra_amazon_product_keys"
-    )
-
-    amazon_product_key = await amazon_product_key_collection.find_one()
-
-    if amazon_product_key:
-        await amazon_product_key_collection.delete_one(
-            {"_id": amazon_product_key["_id"]}
-        )
-    else:
-        logger.error("Out of amazon product keys!!!")
-        raise HTTPException(
-            status_code=404,
-            detail="Failed to retrieve Amazon Product Key, check if there are any left in database",
-        )
+    amazon_product_key = await amazon_product_key_pool.claim()
 
-    logger.debug(
-        f"Fetched and deleted amazon product key {amazon_product_key['key']} successfully"
-    )
+    logger.debug(f"Claimed amazon product key {amazon_product_key} successfully")
 
-    return amazon_product_key["key"]
+    return amazon_product_key
 
 
 async def add_chatbot(
     name: str,
     creator_id: str,
     link: str,
-    ranked_ad_ids: List[str],
+    ranked_ad_ids: List[ObjectId],
     delivery_frequency: str = "high",
     source=ChatbotSource.openai_gpts,
 ) -> ChatbotDTO:
@@ -137,6 +242,7 @@ async def add_chatbot(
 
     # Add chatbot
     result = await chatbot_collection.insert_one(chatbot.model_dump())
+    chatbot_cache.invalidate(api_key)
 
     await creator_collection.find_one_and_update(
         {"email": chatbot.creator_email},
@@ -153,6 +259,7 @@ async def remove_chatbot(api_key: str) -> None:
     # Remove chatbot from Chatbot collection
     chatbot_collection = DatabaseClient.get_collection("chatbots")
     chatbot = await chatbot_collection.find_one_and_delete({"api_key": api_key})
+    chatbot_cache.invalidate(api_key)
 
     if chatbot is None:
         raise HTTPException(
@@ -165,6 +272,8 @@ async def remove_chatbot(api_key: str) -> None:
         {"email": chatbot["creator_email"]},
         {"$pull": {"chatbots": chatbot["_id"]}},
     )
+
+    await remove_delivery_state(api_key)
     return
 
 
@@ -201,7 +310,11 @@ async def update_chatbot(
 
     try:
         merged_data = {**chatbot_dict, **fields_to_update}
-        Chatbot(**merged_data)
+        chatbot = Chatbot(**merged_data).model_dump()
+        # Store fields the way the model validated them, e.g. ranked_ad_ids as ObjectIds
+        fields_to_update = {
+            field: chatbot.get(field, value) for field, value in fields_to_update.items()
+        }
     except ValidationError as e:
         raise HTTPException(
             status_code=400, detail=f"Failed to validate input due to error: {e}"
@@ -217,6 +330,10 @@ async def update_chatbot(
     updated_chatbot = await chatbot_collection.find_one_and_update(
         query, new_values, return_document=ReturnDocument.AFTER
     )
+    # Both api keys, if it changed: the new one may be cached as invalid
+    chatbot_cache.invalidate(chatbot_api_key)
+    if fields_to_update.get("api_key", chatbot_api_key) != chatbot_api_key:
+        chatbot_cache.invalidate(fields_to_update["api_key"])
     if not updated_chatbot:
         raise HTTPException(status_code=404, detail="Failed to update the chatbot")
 
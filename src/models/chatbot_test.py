@@ -0,0 +1,134 @@
+import pytest
+from unittest.mock import patch, AsyncMock
+from bson import ObjectId
+from src.models.chatbot import (
+    ChatbotCache,
+    chatbot_cache,
+    get_chatbot,
+    remove_chatbot,
+    update_chatbot,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_expires_entries_after_ttl():
+    clock = FakeClock()
+    cache = ChatbotCache(max_size=10, ttl=60, negative_ttl=5, clock=clock)
+    cache.set("valid", {"api_key": "valid"})
+    cache.set("invalid", None)
+
+    clock.now = 4
+    assert cache.get("valid") == {"api_key": "valid"}
+    assert cache.get("invalid") is None
+
+    clock.now = 5
+    assert cache.get("invalid") is ChatbotCache.MISS
+    assert cache.get("valid") == {"api_key": "valid"}
+
+    clock.now = 60
+    assert cache.get("valid") is ChatbotCache.MISS
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ChatbotCache(max_size=2, ttl=60, negative_ttl=5)
+    cache.set("first", {"api_key": "first"})
+    cache.set("second", {"api_key": "second"})
+    cache.get("first")
+    cache.set("third", {"api_key": "third"})
+
+    assert cache.get("second") is ChatbotCache.MISS
+    assert cache.get("first") == {"api_key": "first"}
+    assert cache.get("third") == {"api_key": "third"}
+
+
+@patch("src.models.mongo.DatabaseClient.get_collection")
+@pytest.mark.anyio
+async def test_get_chatbot_is_cached_until_removed(mock_get_collection):
+    chatbot_cache.clear()
+    mock_collection = AsyncMock()
+    mock_collection.find_one.return_value = {"api_key": "key", "_id": 1}
+    mock_collection.find_one_and_delete.return_value = {
+        "_id": 1,
+        "creator_email": "creator@proton.me",
+    }
+    mock_get_collection.return_value = mock_collection
+
+    assert await get_chatbot("key") == {"api_key": "key", "_id": 1}
+    assert await get_chatbot("key") == {"api_key": "key", "_id": 1}
+    assert mock_collection.find_one.await_count == 1
+
+    await remove_chatbot("key")
+    mock_collection.find_one.return_value = None
+
+    assert await get_chatbot("key") is None
+    assert await get_chatbot("key") is None
+    assert mock_collection.find_one.await_count == 2
+
+
+@patch("src.models.mongo.DatabaseClient.get_collection")
+@pytest.mark.anyio
+async def test_get_chatbot_converts_ranked_ad_ids_stored_as_strings(mock_get_collection):
+    chatbot_cache.clear()
+    ad_ids = [ObjectId(), ObjectId()]
+    mock_collection = AsyncMock()
+    mock_collection.find_one.return_value = {
+        "api_key": "key",
+        "ranked_ad_ids": [str(ad_ids[0]), ad_ids[1]],
+    }
+    mock_get_collection.return_value = mock_collection
+
+    assert (await get_chatbot("key"))["ranked_ad_ids"] == ad_ids
+
+
+def test_cache_ignores_reads_that_started_before_an_invalidation():
+    cache = ChatbotCache(max_size=1, ttl=60, negative_ttl=5)
+    generation = cache.generation("key")
+    cache.invalidate("key")
+    cache.set("key", {"api_key": "key", "name": "old"}, generation)
+    assert cache.get("key") is ChatbotCache.MISS
+
+    # Forgetting the generations of invalidated keys makes every older read stale
+    generation = cache.generation("key")
+    cache.invalidate("other")
+    cache.invalidate("another")
+    cache.set("key", {"api_key": "key"}, generation)
+    assert cache.get("key") is ChatbotCache.MISS
+
+    cache.set("key", {"api_key": "key"}, cache.generation("key"))
+    assert cache.get("key") == {"api_key": "key"}
+
+
+@patch("src.models.mongo.DatabaseClient.get_collection")
+@pytest.mark.anyio
+async def test_update_chatbot_invalidates_the_new_api_key(mock_get_collection):
+    chatbot_cache.clear()
+    chatbot = {
+        "_id": ObjectId(),
+        "name": "chatbot",
+        "source": "openai_gpts",
+        "amazon_product_key": "key-20",
+        "link": "https://chatbot.test",
+        "creator_email": "creator@proton.me",
+        "api_key": "old",
+        "ranked_ad_ids": [],
+        "delivery_frequency": "high",
+    }
+    mock_collection = AsyncMock()
+    mock_collection.find_one.return_value = None
+    mock_get_collection.return_value = mock_collection
+    # The new api key is cached as invalid before the update
+    assert await get_chatbot("new") is None
+
+    mock_collection.find_one.return_value = chatbot
+    mock_collection.find_one_and_update.return_value = {**chatbot, "api_key": "new"}
+    await update_chatbot("old", {"api_key": "new"})
+
+    mock_collection.find_one.return_value = {**chatbot, "api_key": "new"}
+    assert (await get_chatbot("new"))["api_key"] == "new"
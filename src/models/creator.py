@@ -6,11 +6,16 @@ from typing import Optional, List
 from pydantic import BaseModel
 from bson import ObjectId
 from src.models.mongo import DatabaseClient
+from pymongo import ASCENDING, IndexModel
 from pymongo.collection import ReturnDocument
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Indexes and query shapes of the collections this module owns, see src/models/indexes.py
+INDEXES = {"creators": [IndexModel([("email", ASCENDING)], unique=True)]}
+QUERY_SHAPES = {"creators": [("_id",), ("email",)]}
+
 
 class Creator(BaseModel):
     email: str
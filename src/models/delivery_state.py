@@ -0,0 +1,86 @@
+import logging
+from typing import List, Set
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel
+from pymongo.collection import ReturnDocument
+from src.models.base import to_object_id
+from src.models.mongo import DatabaseClient
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Indexes and query shapes of the collections this module owns, see src/models/indexes.py
+INDEXES = {"delivery_states": [IndexModel([("api_key", ASCENDING)], unique=True)]}
+QUERY_SHAPES = {"delivery_states": [("api_key",)]}
+
+
+async def get_shown_ad_ids(api_key: str) -> Set[ObjectId]:
+    """
+    Get the ids of the ads already shown by a chatbot from its delivery state,
+    a single document per chatbot, instead of scanning its api_events history.
+
+    Chatbots that served ads before delivery state existed have their state
+    built from api_events the first time it is read.
+    """
+    delivery_state_collection = DatabaseClient.get_collection("delivery_states")
+    delivery_state = await delivery_state_collection.find_one({"api_key": api_key})
+
+    if delivery_state is None or not delivery_state.get("backfilled"):
+        return await _backfill_delivery_state(api_key)
+
+    # Ids of delivery states not migrated yet are strings
+    return {to_object_id(ad_id) for ad_id in delivery_state.get("shown_ad_ids", [])}
+
+
+async def mark_ad_shown(api_key: str, ad_id: ObjectId) -> None:
+    """
+    Atomically record that a chatbot has shown an ad
+    """
+    delivery_state_collection = DatabaseClient.get_collection("delivery_states")
+    await delivery_state_collection.update_one(
+        {"api_key": api_key},
+        {"$addToSet": {"shown_ad_ids": ad_id}},
+        upsert=True,
+    )
+
+
+async def mark_ads_shown(api_key: str, ad_ids: List[ObjectId]) -> None:
+    """
+    Atomically record that a chatbot has shown several ads, with a single write
+    """
+    delivery_state_collection = DatabaseClient.get_collection("delivery_states")
+    await delivery_state_collection.update_one(
+        {"api_key": api_key},
+        {"$addToSet": {"shown_ad_ids": {"$each": ad_ids}}},
+        upsert=True,
+    )
+
+
+async def remove_delivery_state(api_key: str) -> None:
+    delivery_state_collection = DatabaseClient.get_collection("delivery_states")
+    await delivery_state_collection.delete_one({"api_key": api_key})
+
+
+async def _backfill_delivery_state(api_key: str) -> Set[ObjectId]:
+    api_events_collection = DatabaseClient.get_collection("api_events")
+    shown_ad_ids = await api_events_collection.distinct(
+        "output_fields.ad_id", {"api_key": api_key}
+    )
+    # api_events record ad ids as strings, delivery state stores them natively
+    shown_ad_ids = [ObjectId(ad_id) for ad_id in shown_ad_ids if ad_id]
+
+    # $addToSet merges with ads marked shown while the backfill was running
+    delivery_state_collection = DatabaseClient.get_collection("delivery_states")
+    delivery_state = await delivery_state_collection.find_one_and_update(
+        {"api_key": api_key},
+        {
+            "$addToSet": {"shown_ad_ids": {"$each": shown_ad_ids}},
+            "$set": {"backfilled": True},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    logger.info(
+        f"Backfilled delivery state of chatbot {api_key} from {len(shown_ad_ids)} shown ads"
+    )
+    return {to_object_id(ad_id) for ad_id in delivery_state.get("shown_ad_ids", [])}
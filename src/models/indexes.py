@@ -0,0 +1,101 @@
+import logging
+import os
+from typing import Dict, Iterable, List, Sequence, Tuple
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+from src.models import (
+    ad,
+    amazon_product_key,
+    api_event,
+    chatbot,
+    creator,
+    delivery_state,
+    view_rollup,
+)
+from src.models.mongo import DatabaseClient
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# What to do at startup when an index cannot be created or a declared query shape
+# has no supporting index: "warn" logs it, "fail" stops the server from starting
+MONGO_INDEX_CHECK = os.getenv("MONGO_INDEX_CHECK", "warn")
+
+# Modules declaring the INDEXES they need and the QUERY_SHAPES they run, both
+# keyed by collection name. A query shape is the tuple of fields a query matches
+# on by equality, e.g. ("api_key",) for find_one({"api_key": api_key}).
+MODEL_MODULES = [ad, amazon_product_key, api_event, chatbot, creator, delivery_state, view_rollup]
+
+# Every collection has an index on _id
+ID_INDEX_KEY = [("_id", 1)]
+
+
+def declared_indexes() -> Dict[str, List[IndexModel]]:
+    indexes = {}
+    for module in MODEL_MODULES:
+        for collection_name, collection_indexes in module.INDEXES.items():
+            indexes.setdefault(collection_name, []).extend(collection_indexes)
+    return indexes
+
+
+def declared_query_shapes() -> Dict[str, List[Tuple[str, ...]]]:
+    query_shapes = {}
+    for module in MODEL_MODULES:
+        for collection_name, shapes in module.QUERY_SHAPES.items():
+            query_shapes.setdefault(collection_name, []).extend(shapes)
+    return query_shapes
+
+
+def supports(index_key: Sequence[Tuple[str, int]], query_shape: Tuple[str, ...]) -> bool:
+    """
+    An index supports a query shape if the shape's fields are a prefix of the
+    index key, in any order
+    """
+    prefix = {field for field, _ in list(index_key)[: len(query_shape)]}
+    return len(query_shape) <= len(index_key) and prefix == set(query_shape)
+
+
+def unsupported_query_shapes(
+    index_keys: Dict[str, Iterable[Sequence[Tuple[str, int]]]],
+    query_shapes: Dict[str, List[Tuple[str, ...]]],
+) -> List[Tuple[str, Tuple[str, ...]]]:
+    """
+    Get the (collection name, query shape) pairs that no index supports, given the
+    index keys of each collection
+    """
+    unsupported = []
+    for collection_name, shapes in query_shapes.items():
+        keys = [ID_INDEX_KEY, *index_keys.get(collection_name, [])]
+        for shape in shapes:
+            if not any(supports(key, shape) for key in keys):
+                unsupported.append((collection_name, shape))
+    return unsupported
+
+
+async def ensure_indexes(check: str = MONGO_INDEX_CHECK) -> None:
+    """
+    Create the declared indexes that do not exist yet, then verify that every
+    declared query shape is supported by an index of the database
+    """
+    problems = []
+    for collection_name, indexes in declared_indexes().items():
+        collection = DatabaseClient.get_collection(collection_name)
+        try:
+            await collection.create_indexes(indexes)
+        except OperationFailure as e:
+            problems.append(f"Could not create indexes on {collection_name}: {e}")
+
+    query_shapes = declared_query_shapes()
+    index_keys = {}
+    for collection_name in query_shapes:
+        collection = DatabaseClient.get_collection(collection_name)
+        index_information = await collection.index_information()
+        index_keys[collection_name] = [index["key"] for index in index_information.values()]
+
+    for collection_name, shape in unsupported_query_shapes(index_keys, query_shapes):
+        problems.append(f"No index supports queries on {collection_name} by {shape}")
+
+    for problem in problems:
+        logger.warning(problem)
+    if problems and check == "fail":
+        raise RuntimeError(f"Missing MongoDB indexes: {'; '.join(problems)}")
@@ -0,0 +1,70 @@
+from unittest.mock import AsyncMock, patch
+import asyncio
+import pytest
+
+from src.models.indexes import (
+    declared_indexes,
+    declared_query_shapes,
+    ensure_indexes,
+    supports,
+    unsupported_query_shapes,
+)
+
+
+def declared_index_keys():
+    return {
+        collection_name: [list(index.document["key"].items()) for index in indexes]
+        for collection_name, indexes in declared_indexes().items()
+    }
+
+
+def test_supports_matches_index_key_prefixes():
+    key = [("api_key", 1), ("call_receive_time", 1)]
+    assert supports(key, ("api_key",))
+    assert supports(key, ("call_receive_time", "api_key"))
+    assert not supports(key, ("call_receive_time",))
+    assert not supports(key, ("api_key", "call_receive_time", "bucket"))
+
+
+def test_declared_indexes_support_every_declared_query_shape():
+    assert unsupported_query_shapes(declared_index_keys(), declared_query_shapes()) == []
+
+
+def test_unsupported_query_shapes_reports_missing_indexes():
+    assert unsupported_query_shapes({}, {"chatbots": [("_id",), ("api_key",)]}) == [
+        ("chatbots", ("api_key",))
+    ]
+
+
+def mock_collection_with_indexes(index_keys):
+    collection = AsyncMock()
+    collection.index_information.return_value = {
+        f"index_{i}": {"key": key} for i, key in enumerate(index_keys)
+    }
+    return collection
+
+
+def test_ensure_indexes_creates_declared_indexes():
+    index_keys = declared_index_keys()
+    collections = {
+        name: mock_collection_with_indexes(index_keys.get(name, []))
+        for name in declared_query_shapes()
+    }
+    with patch(
+        "src.models.indexes.DatabaseClient.get_collection", side_effect=collections.get
+    ):
+        asyncio.run(ensure_indexes(check="fail"))
+
+    for name, indexes in declared_indexes().items():
+        collections[name].create_indexes.assert_awaited_once_with(indexes)
+
+
+def test_ensure_indexes_fails_on_unsupported_query_shape():
+    with patch(
+        "src.models.indexes.DatabaseClient.get_collection",
+        side_effect=lambda name: mock_collection_with_indexes([]),
+    ):
+        # Only logged in warn mode
+        asyncio.run(ensure_indexes(check="warn"))
+        with pytest.raises(RuntimeError):
+            asyncio.run(ensure_indexes(check="fail"))
@@ -0,0 +1,59 @@
+import pytest
+
+from src.models.metrics import MetricsRegistry
+
+
+def test_counter_and_gauge_render():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests", "Requests by outcome", labels=("outcome",))
+    registry.gauge("open_connections", "Open connections", lambda: 3)
+
+    requests.inc("success")
+    requests.inc("success")
+    requests.inc('bad "one"')
+
+    assert requests.value("success") == 2
+    assert registry.render().splitlines() == [
+        "# HELP requests Requests by outcome",
+        "# TYPE requests counter",
+        'requests_total{outcome="success"} 2',
+        'requests_total{outcome="bad \\"one\\""} 1',
+        "# HELP open_connections Open connections",
+        "# TYPE open_connections gauge",
+        "open_connections 3",
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    seconds = registry.histogram("stage_seconds", "Stages", labels=("stage",), buckets=(0.1, 1.0))
+
+    seconds.observe(0.05, "auth")
+    seconds.observe(0.1, "auth")
+    seconds.observe(0.5, "auth")
+    seconds.observe(3, "auth")
+    with seconds.time("scoring"):
+        pass
+
+    assert seconds.count("auth") == 4
+    assert seconds.sum("auth") == pytest.approx(3.65)
+    assert seconds.count("scoring") == 1
+    lines = registry.render().splitlines()
+    assert lines[2:8] == [
+        'stage_seconds_bucket{stage="auth",le="0.1"} 2',
+        'stage_seconds_bucket{stage="auth",le="1"} 3',
+        'stage_seconds_bucket{stage="auth",le="+Inf"} 4',
+        'stage_seconds_count{stage="auth"} 4',
+        'stage_seconds_sum{stage="auth"} 3.65',
+        'stage_seconds_bucket{stage="scoring",le="0.1"} 1',
+    ]
+
+
+def test_wrong_labels_are_rejected():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests", "Requests", labels=("route", "outcome"))
+
+    with pytest.raises(ValueError):
+        requests.inc("success")
+    with pytest.raises(ValueError):
+        registry.counter("requests", "Requests again")
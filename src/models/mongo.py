@@ -5,34 +5,297 @@ from motor.motor_asyncio import (
 )
 from dotenv import load_dotenv
 import certifi
+from pymongo import monitoring
 from pymongo.server_api import ServerApi
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, NamedTuple, Optional
 import os
 
+from src.models.metrics import METRICS
+
 load_dotenv()
 MONGO_URL = os.getenv("MONGODB_CONNECTION_STRING")
 
-DATABASE_NAME = "backend"
-COLLECTIONS = {"ads", "api_events", "chatbots", "creators", "dev_api_keys", "extra_amazon_product_keys"}
+# Connection pool sizing. The pool keeps MONGO_MIN_POOL_SIZE connections warm,
+# opens up to MONGO_MAX_POOL_SIZE under load and closes connections idle for
+# longer than MONGO_MAX_IDLE_TIME_MS.
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+
+# Round trips to MongoDB a request may make before it is reported as over budget,
+# 0 for no budget. With MONGO_ROUND_TRIP_BUDGET_STRICT, requests over budget fail,
+# which tests use to catch N+1 query patterns.
+MONGO_ROUND_TRIP_BUDGET = int(os.getenv("MONGO_ROUND_TRIP_BUDGET", "10"))
+MONGO_ROUND_TRIP_BUDGET_STRICT = os.getenv("MONGO_ROUND_TRIP_BUDGET_STRICT", "") == "1"
+
+DATABASE_NAME = os.getenv("MONGO_DATABASE_NAME", "backend")
+COLLECTIONS = {"ad_catalog", "ads", "api_event_rollups", "api_events", "chatbots", "creators", "delivery_states", "dev_api_keys", "extra_amazon_product_keys"}
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    Keep counts of connection pool events for the pool statistics
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pools_cleared = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.pools_cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.connections_created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.connections_closed += 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+        self.checkouts += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+
+MONGO_COMMAND_SECONDS = METRICS.histogram(
+    "mongo_command_seconds",
+    "Duration of the MongoDB commands, by command name",
+    labels=("command",),
+)
+MONGO_COMMAND_FAILURES = METRICS.counter(
+    "mongo_command_failures",
+    "MongoDB commands that failed, by command name",
+    labels=("command",),
+)
+
+
+class CommandRecord(NamedTuple):
+    command: str
+    collection: str
+    seconds: float
+    documents: int
+    failed: bool
+
+
+class RoundTripBudgetExceeded(Exception):
+    pass
+
+
+class RequestCommands:
+    """
+    Commands sent to MongoDB on behalf of one request, see track_commands
+    """
+
+    def __init__(self, budget: int = MONGO_ROUND_TRIP_BUDGET):
+        self.budget = budget
+        self.commands: List[CommandRecord] = []
+        # Collection of the commands started and not finished yet, by request id
+        self._collections: Dict[int, str] = {}
+
+    def started(self, request_id: int, collection: str) -> None:
+        self._collections[request_id] = collection
+
+    def finished(
+        self, request_id: int, command: str, seconds: float, documents: int, failed: bool
+    ) -> None:
+        collection = self._collections.pop(request_id, "")
+        self.commands.append(CommandRecord(command, collection, seconds, documents, failed))
+
+    @property
+    def round_trips(self) -> int:
+        return len(self.commands)
+
+    @property
+    def over_budget(self) -> bool:
+        return 0 < self.budget < self.round_trips
+
+    def summary(self) -> dict:
+        """
+        Totals of the commands, with a count per command and collection, e.g.
+        {"find ads": 20}, where N+1 patterns stand out
+        """
+        counts: Dict[str, int] = {}
+        for record in self.commands:
+            key = f"{record.command} {record.collection}".strip()
+            counts[key] = counts.get(key, 0) + 1
+        return {
+            "round_trips": self.round_trips,
+            "seconds": sum(record.seconds for record in self.commands),
+            "documents": sum(record.documents for record in self.commands),
+            "failed": sum(record.failed for record in self.commands),
+            "commands": counts,
+        }
+
+    def check(self) -> None:
+        if self.over_budget:
+            raise RoundTripBudgetExceeded(
+                f"{self.round_trips} round trips to MongoDB, over the budget of "
+                f"{self.budget}: {self.summary()['commands']}"
+            )
+
+
+_request_commands: ContextVar[Optional[RequestCommands]] = ContextVar(
+    "request_commands", default=None
+)
+
+
+@contextmanager
+def track_commands(budget: int = MONGO_ROUND_TRIP_BUDGET) -> Iterator[RequestCommands]:
+    """
+    Record the MongoDB commands sent from the with block, including from the
+    tasks it starts, e.g.
+
+        with track_commands(budget=3) as commands:
+            await get_unshown_ads(api_key)
+        commands.check()
+    """
+    commands = RequestCommands(budget)
+    token = _request_commands.set(commands)
+    try:
+        yield commands
+    finally:
+        _request_commands.reset(token)
+
+
+def _command_collection(event: monitoring.CommandStartedEvent) -> str:
+    key = "collection" if event.command_name == "getMore" else event.command_name
+    name = event.command.get(key)
+    return name if isinstance(name, str) else ""
+
+
+def _documents_returned(reply) -> int:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+    # findAndModify
+    if "value" in reply:
+        return int(reply["value"] is not None)
+    return 0
+
+
+class CommandMonitor(monitoring.CommandListener):
+    """
+    Record the count and duration of the commands sent to MongoDB, and attribute
+    them to the request being tracked, if any. Events come from the threads motor
+    runs pymongo in, which motor runs in a copy of the calling task's context.
+    """
+
+    def started(self, event):
+        commands = _request_commands.get()
+        if commands is not None:
+            commands.started(event.request_id, _command_collection(event))
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_SECONDS.observe(seconds, event.command_name)
+        commands = _request_commands.get()
+        if commands is not None:
+            documents = _documents_returned(event.reply)
+            commands.finished(event.request_id, event.command_name, seconds, documents, False)
+
+    def failed(self, event):
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_SECONDS.observe(seconds, event.command_name)
+        MONGO_COMMAND_FAILURES.inc(event.command_name)
+        commands = _request_commands.get()
+        if commands is not None:
+            commands.finished(event.request_id, event.command_name, seconds, 0, True)
+
 
 class DatabaseClient:
-    client: AsyncIOMotorClient
-    db: AsyncIOMotorDatabase
+    client: Optional[AsyncIOMotorClient] = None
+    db: Optional[AsyncIOMotorDatabase] = None
+    pool_stats = PoolStatsListener()
+    command_monitor = CommandMonitor()
 
     @classmethod
     def connect(cls):
+        """
+        Create the shared client and its connection pool, unless it already exists.
+        The API server does this once in its lifespan handler and every request
+        reuses the pool. Scripts connect on their first get_collection call.
+        """
+        if cls.client is not None:
+            return
+
         cls.client = AsyncIOMotorClient(
-            MONGO_URL, server_api=ServerApi("1"), tlsCAFile=certifi.where()
+            MONGO_URL,
+            server_api=ServerApi("1"),
+            tlsCAFile=certifi.where(),
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            event_listeners=[cls.pool_stats, cls.command_monitor],
         )
         cls.db = cls.client[DATABASE_NAME]
 
+    @classmethod
+    async def warm_up(cls):
+        """
+        Open a first connection so that the first request does not pay for
+        server discovery and the TLS handshake
+        """
+        cls.connect()
+        await cls.client.admin.command("ping")
+
     @classmethod
     async def disconnect(cls):
-        cls.client.close()
+        if cls.client is not None:
+            cls.client.close()
+            cls.client = None
+            cls.db = None
+
+    @classmethod
+    def get_pool_stats(cls) -> dict:
+        stats = cls.pool_stats
+        return {
+            "max_pool_size": MONGO_MAX_POOL_SIZE,
+            "min_pool_size": MONGO_MIN_POOL_SIZE,
+            "max_idle_time_ms": MONGO_MAX_IDLE_TIME_MS,
+            "open_connections": stats.connections_created - stats.connections_closed,
+            "checked_out_connections": stats.checked_out,
+            "connections_created": stats.connections_created,
+            "connections_closed": stats.connections_closed,
+            "checkouts": stats.checkouts,
+            "checkout_failures": stats.checkout_failures,
+            "pools_cleared": stats.pools_cleared,
+        }
 
     @classmethod
     def get_collection(cls, collection_name: str) -> AsyncIOMotorCollection:
         if collection_name not in COLLECTIONS:
             raise ValueError(f"Collection {collection_name} does not exist")
+        cls.connect()
         return cls.db[collection_name]
 
     @classmethod
@@ -44,4 +307,14 @@ class DatabaseClient:
             collection = cls.get_collection(collection_name)
             await collection.delete_many({})  # Deletes all documents in the collection
 
-DatabaseClient.connect()
+
+METRICS.gauge(
+    "mongo_pool_open_connections",
+    "Connections open in the MongoDB connection pool",
+    lambda: DatabaseClient.get_pool_stats()["open_connections"],
+)
+METRICS.gauge(
+    "mongo_pool_checked_out_connections",
+    "Connections of the MongoDB connection pool in use",
+    lambda: DatabaseClient.get_pool_stats()["checked_out_connections"],
+)
@@ -0,0 +1,67 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import pytest
+from pymongo import monitoring
+
+from src.models.mongo import CommandMonitor, RoundTripBudgetExceeded, track_commands
+
+ADDRESS = ("localhost", 27017)
+
+
+def run_command(monitor, request_id, command, reply=None, failed=False):
+    name = next(iter(command))
+    monitor.started(monitoring.CommandStartedEvent(command, "backend", request_id, ADDRESS, 1))
+    if failed:
+        monitor.failed(
+            monitoring.CommandFailedEvent(timedelta(milliseconds=2), {}, name, request_id, ADDRESS, 1)
+        )
+    else:
+        monitor.succeeded(
+            monitoring.CommandSucceededEvent(
+                timedelta(milliseconds=1), reply or {"ok": 1}, name, request_id, ADDRESS, 1
+            )
+        )
+
+
+def test_commands_are_attributed_to_the_tracked_request():
+    monitor = CommandMonitor()
+    run_command(monitor, 1, {"find": "ads"})
+
+    with track_commands(budget=3) as commands:
+        for request_id in range(2, 5):
+            run_command(
+                monitor,
+                request_id,
+                {"find": "ads", "filter": {}},
+                {"cursor": {"firstBatch": [{}, {}], "id": 0}, "ok": 1},
+            )
+        run_command(monitor, 5, {"findAndModify": "chatbots"}, {"value": None, "ok": 1})
+        run_command(monitor, 6, {"insert": "api_events"}, failed=True)
+
+    assert commands.summary() == {
+        "round_trips": 5,
+        "seconds": pytest.approx(0.006),
+        "documents": 6,
+        "failed": 1,
+        "commands": {"find ads": 3, "findAndModify chatbots": 1, "insert api_events": 1},
+    }
+    assert commands.over_budget
+    with pytest.raises(RoundTripBudgetExceeded, match="find ads"):
+        commands.check()
+
+
+def test_commands_from_executor_threads_are_attributed():
+    # Motor runs pymongo, and so the listener, in a thread with a copy of the
+    # calling task's context
+    monitor = CommandMonitor()
+    with track_commands(budget=0) as commands:
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(1) as executor:
+            executor.submit(
+                context.run, run_command, monitor, 1, {"count": "api_events"}
+            ).result()
+
+    assert commands.summary()["commands"] == {"count api_events": 1}
+    assert not commands.over_budget
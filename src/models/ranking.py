@@ -0,0 +1,622 @@
+import logging
+import math
+import os
+from array import array
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+
+from src.models.terms import TERM_FIELDS, ad_terms, tokenize
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Ads added since an engine last compiled its term matrices are scored one by one;
+# once there are more of them than this, the matrices are recompiled
+MAX_UNCOMPILED_ROWS = 256
+
+# BM25F saturation and per-field length normalization parameters
+BM25_K1 = 1.2
+BM25_B = {"title_terms": 0.75, "content_terms": 0.75}
+
+# The ranking engines of the ad index cache the scores of every matching ad per
+# query; the cache holds at most this many (ad, score) pairs over all queries
+RANKING_CACHE_MAX_SCORES = int(os.getenv("RANKING_CACHE_MAX_SCORES", "2000000"))
+
+
+class _FieldColumn:
+    """
+    Term ids and term frequencies of one field for every row, stored back to back.
+    The terms of row r are term_ids[offsets[r]:offsets[r + 1]].
+
+    The buffers are arrays, or read-only numpy arrays when the column is loaded
+    from an ad snapshot; those are copied into arrays on the first append.
+    """
+
+    TYPECODES = {"offsets": "q", "term_ids": "i", "tfs": "i", "lengths": "i"}
+
+    def __init__(self, **buffers):
+        for name, typecode in self.TYPECODES.items():
+            default = array(typecode, [0] if name == "offsets" else [])
+            setattr(self, name, buffers.get(name, default))
+
+    def append_row(self, term_ids: List[int], tfs: List[int]) -> None:
+        for name, typecode in self.TYPECODES.items():
+            buffer = getattr(self, name)
+            if not isinstance(buffer, array):
+                setattr(self, name, array(typecode, buffer.tobytes()))
+        self.term_ids.extend(term_ids)
+        self.tfs.extend(tfs)
+        self.offsets.append(len(self.term_ids))
+        self.lengths.append(sum(tfs))
+
+
+class TermStore:
+    """
+    Append-only store of the per-field term data of the ads catalog, shared by
+    the ranking engines. An ad gets a new row every time it is added; rows of
+    replaced and removed ads stay in the store but no longer count.
+
+    The store keeps the corpus statistics of the current rows up to date (the
+    number of them, the total length of each field and the document frequency
+    of every term), and compiles the term matrices the engines score with.
+    The catalog version changes whenever an ad is added, replaced or removed.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.vocab: Dict[str, int] = {}
+        self.words: List[str] = []
+        self.rows: Dict[ObjectId, int] = {}
+        self.fields: Dict[str, _FieldColumn] = {
+            terms_field: _FieldColumn() for terms_field in TERM_FIELDS
+        }
+        self.df = array("i")
+        self.n_docs = 0
+        self.total_lengths = {terms_field: 0 for terms_field in TERM_FIELDS}
+        self.matrices: Dict[str, _TermMatrix] = {}
+        self.compiled_rows = 0
+
+    @classmethod
+    def from_arrays(
+        cls,
+        ad_ids: List[ObjectId],
+        words: List[str],
+        fields: Dict[str, _FieldColumn],
+        matrices: Dict[str, "_TermMatrix"],
+        df: np.ndarray,
+    ) -> "TermStore":
+        """
+        Create a compiled store whose row r holds the ad ad_ids[r], from term data
+        and term matrices built beforehand, e.g. read from an ad snapshot
+        """
+        store = cls()
+        store.words = words
+        store.vocab = {word: term_id for term_id, word in enumerate(words)}
+        store.rows = {ad_id: row for row, ad_id in enumerate(ad_ids)}
+        store.fields = fields
+        store.df = array("i", np.asarray(df, dtype=np.int32).tobytes())
+        store.n_docs = len(ad_ids)
+        store.total_lengths = {
+            terms_field: int(np.sum(column.lengths, dtype=np.int64))
+            for terms_field, column in fields.items()
+        }
+        store.matrices = matrices
+        store.compiled_rows = len(ad_ids)
+        return store
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.fields["title_terms"].lengths)
+
+    def add(self, ad: Dict) -> None:
+        old_row = self.rows.get(ad["_id"])
+        row = self.n_rows
+        for terms_field, column in self.fields.items():
+            terms = ad_terms(ad, terms_field)
+            column.append_row([self._term_id(term) for term in terms], list(terms.values()))
+
+        self.rows[ad["_id"]] = row
+        self.version += 1
+        if old_row is not None:
+            self._update_stats(old_row, -1)
+        self._update_stats(row, 1)
+
+    def remove(self, ad_id: ObjectId) -> None:
+        row = self.rows.pop(ad_id, None)
+        if row is not None:
+            self.version += 1
+            self._update_stats(row, -1)
+
+    def _update_stats(self, row: int, sign: int) -> None:
+        self.n_docs += sign
+        if len(self.df) < len(self.vocab):
+            self.df.extend([0] * (len(self.vocab) - len(self.df)))
+
+        row_term_ids = set()
+        for terms_field, column in self.fields.items():
+            self.total_lengths[terms_field] += sign * int(column.lengths[row])
+            row_term_ids.update(
+                column.term_ids[column.offsets[row] : column.offsets[row + 1]]
+            )
+        for term_id in row_term_ids:
+            self.df[term_id] += sign
+
+    def compile(self) -> None:
+        """
+        Rebuild the term matrices so that they cover every row of the store
+        """
+        n_rows, n_terms = self.n_rows, len(self.vocab)
+        for terms_field, column in self.fields.items():
+            self.matrices[terms_field] = _TermMatrix(column, n_rows, n_terms)
+        self.compiled_rows = n_rows
+
+    def compile_if_stale(self) -> None:
+        if self.n_rows - self.compiled_rows > MAX_UNCOMPILED_ROWS:
+            self.compile()
+
+    def rows_containing(self, term_ids: np.ndarray) -> np.ndarray:
+        """
+        Get the rows, current or not, with any of the given terms in any field,
+        in increasing order
+        """
+        self.compile_if_stale()
+        rows = [matrix.postings(term_ids)[0] for matrix in self.matrices.values()]
+
+        wanted = set(term_ids.tolist())
+        uncompiled_rows = [
+            row
+            for row in range(self.compiled_rows, self.n_rows)
+            if any(
+                wanted.intersection(
+                    column.term_ids[column.offsets[row] : column.offsets[row + 1]]
+                )
+                for column in self.fields.values()
+            )
+        ]
+        rows.append(np.array(uncompiled_rows, dtype=np.int64))
+        return np.unique(np.concatenate(rows).astype(np.int64))
+
+    def _term_id(self, term: str) -> int:
+        term_id = self.vocab.get(term)
+        if term_id is None:
+            term_id = self.vocab[term] = len(self.words)
+            self.words.append(term)
+        return term_id
+
+    def row_terms(self, terms_field: str, row: int) -> Dict[int, int]:
+        """
+        Get the term id -> term frequency map of one field of a row
+        """
+        column = self.fields[terms_field]
+        start, end = column.offsets[row], column.offsets[row + 1]
+        return dict(zip(column.term_ids[start:end], column.tfs[start:end]))
+
+
+class _TermMatrix:
+    """
+    Ad x term frequency matrix of one field in compressed sparse column layout:
+    the rows of the ads containing term t are indices[indptr[t]:indptr[t + 1]],
+    and data holds the matching term frequencies.
+    """
+
+    def __init__(self, column: _FieldColumn, n_rows: int, n_terms: int):
+        offsets = np.frombuffer(column.offsets, dtype=np.int64)[: n_rows + 1]
+        nnz = int(offsets[-1])
+        terms = np.frombuffer(column.term_ids, dtype=np.int32)[:nnz]
+        rows = np.repeat(np.arange(n_rows, dtype=np.int32), np.diff(offsets))
+        order = np.argsort(terms, kind="stable")
+        indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=n_terms), out=indptr[1:])
+        self._set_arrays(
+            rows[order],
+            np.frombuffer(column.tfs, dtype=np.int32)[:nnz][order],
+            indptr,
+            np.frombuffer(column.lengths, dtype=np.int32)[:n_rows].copy(),
+        )
+
+    @classmethod
+    def from_arrays(
+        cls, indices: np.ndarray, data: np.ndarray, indptr: np.ndarray, lengths: np.ndarray
+    ) -> "_TermMatrix":
+        """
+        Wrap compiled arrays, e.g. read from an ad snapshot, without copying them
+        """
+        matrix = cls.__new__(cls)
+        matrix._set_arrays(indices, data, indptr, lengths)
+        return matrix
+
+    def _set_arrays(self, indices, data, indptr, lengths) -> None:
+        self.indices = indices
+        self.data = data
+        self.indptr = indptr
+        self.lengths = lengths
+        self.n_rows = len(lengths)
+        self.n_terms = len(indptr) - 1
+
+    def postings(self, term_ids: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """
+        Gather the postings of all the given terms at once. Returns the row, the
+        term frequency and the position in term_ids of every posting.
+        """
+        in_range = np.flatnonzero(term_ids < self.n_terms)
+        starts = self.indptr[term_ids[in_range]]
+        lengths = self.indptr[term_ids[in_range] + 1] - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        positions += np.arange(len(positions))
+        return (
+            self.indices[positions],
+            self.data[positions],
+            np.repeat(in_range, lengths),
+        )
+
+
+class ScoreCache:
+    """
+    LRU cache of the scores of every matching row of the store for a query, as
+    sorted row and score arrays. Its size is bounded by the total number of
+    scores held, and it is emptied whenever the catalog version changes.
+    """
+
+    def __init__(self, max_scores: int):
+        self.max_scores = max_scores
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._size = 0
+        self._version = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, version: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        if version != self._version:
+            self.clear()
+            self._version = version
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def set(self, key: Hashable, version: int, rows: np.ndarray, scores: np.ndarray) -> None:
+        if version != self._version or len(rows) > self.max_scores:
+            return
+        self._entries[key] = (rows, scores)
+        self._size += len(rows)
+        while self._size > self.max_scores:
+            _, (evicted_rows, _) = self._entries.popitem(last=False)
+            self._size -= len(evicted_rows)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._size = 0
+
+
+class RankingEngine:
+    """
+    Base class of the ranking engines. An engine scores candidate ads against the
+    queries of a request using term matrices it compiles from a TermStore; rows
+    added to the store after the last compile are scored one by one.
+
+    An engine given a ScoreCache scores every ad of the catalog matching a query
+    the first time it sees it, and then only looks up the scores of the candidate
+    ads until the catalog changes. Scores do not depend on the candidates, so the
+    ranking is the same either way.
+    """
+
+    def __init__(self, store: TermStore, cache: Optional[ScoreCache] = None):
+        self.store = store
+        self.cache = cache
+
+    def compile(self) -> None:
+        """
+        Rebuild the term matrices of the store so that they cover every row
+        """
+        self.store.compile()
+
+    def top_n(
+        self,
+        ads: List[Dict],
+        queries: List[str],
+        n: int,
+        title_weight: float,
+        content_weight: float,
+    ) -> List[Dict]:
+        """
+        Get the n ads with the highest cumulative score over the queries, ordered
+        by score and, among equal scores, by their position in ads.
+        """
+        candidates = {}
+        for ad in ads:
+            candidates.setdefault(ad["_id"], ad)
+        candidates = list(candidates.values())
+        if n <= 0 or not candidates:
+            return []
+
+        self.store.compile_if_stale()
+
+        # How many of the queries contain each word
+        query_counts = Counter(
+            word for query in queries for word in set(tokenize(query))
+        )
+        weights = {"title_terms": title_weight, "content_terms": content_weight}
+
+        rows = np.fromiter(
+            (self.store.rows.get(ad["_id"], -1) for ad in candidates),
+            dtype=np.int64,
+            count=len(candidates),
+        )
+        known = [
+            (self.store.vocab[word], count)
+            for word, count in query_counts.items()
+            if word in self.store.vocab
+        ]
+        term_ids = np.array([term_id for term_id, _ in known], dtype=np.int64)
+        counts = np.array([count for _, count in known], dtype=np.float64)
+
+        scores = np.zeros(len(candidates))
+        if self.cache is not None:
+            in_store = rows >= 0
+            key = (tuple(sorted(query_counts.items())), title_weight, content_weight)
+            cached = self.cache.get(key, self.store.version)
+            if cached is None:
+                cached = self._all_scores(term_ids, counts, query_counts, weights)
+                self.cache.set(key, self.store.version, *cached)
+            scores[in_store] = _lookup_scores(*cached, rows[in_store])
+            unscored = ~in_store
+        else:
+            compiled = (rows >= 0) & (rows < self.store.compiled_rows)
+            if compiled.any():
+                scores[compiled] = self._compiled_scores(
+                    rows[compiled], term_ids, counts, weights
+                )
+            unscored = ~compiled
+
+        # Ads added since the last compile are scored from the store, and ads the
+        # store does not know from their own term data
+        for position in np.flatnonzero(unscored):
+            row = rows[position]
+            if row >= 0:
+                scores[position] = self._stored_row_score(row, query_counts, weights)
+            else:
+                field_terms = {
+                    terms_field: ad_terms(candidates[position], terms_field)
+                    for terms_field in weights
+                }
+                scores[position] = self._row_score(
+                    field_terms, None, query_counts, weights
+                )
+
+        return [candidates[position] for position in _top_n_positions(scores, n)]
+
+    def _all_scores(
+        self,
+        term_ids: np.ndarray,
+        counts: np.ndarray,
+        query_counts: Counter,
+        weights: Dict[str, float],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score every row of the store containing a query term. Returns the rows in
+        increasing order and their scores; every other row scores 0.
+        """
+        matching = np.unique(
+            np.concatenate(
+                [
+                    self.store.matrices[terms_field].postings(term_ids)[0]
+                    for terms_field in weights
+                ]
+                if self.store.matrices
+                else [np.empty(0, dtype=np.int32)]
+            )
+        ).astype(np.int64)
+        scores = (
+            self._compiled_scores(matching, term_ids, counts, weights)
+            if len(matching)
+            else np.empty(0)
+        )
+
+        uncompiled = np.arange(
+            self.store.compiled_rows, self.store.n_rows, dtype=np.int64
+        )
+        uncompiled_scores = np.array(
+            [self._stored_row_score(row, query_counts, weights) for row in uncompiled],
+            dtype=np.float64,
+        )
+
+        rows = np.concatenate([matching, uncompiled])
+        scores = np.concatenate([scores, uncompiled_scores])
+        nonzero = scores != 0
+        return rows[nonzero], scores[nonzero]
+
+    def _stored_row_score(
+        self, row: int, query_counts: Counter, weights: Dict[str, float]
+    ) -> float:
+        field_terms = {
+            terms_field: self.store.row_terms(terms_field, row) for terms_field in weights
+        }
+        return self._row_score(field_terms, self.store.vocab.get, query_counts, weights)
+
+    def _compiled_scores(
+        self,
+        rows: np.ndarray,
+        term_ids: np.ndarray,
+        counts: np.ndarray,
+        weights: Dict[str, float],
+    ) -> np.ndarray:
+        """
+        Score distinct compiled rows against query terms, where counts holds how
+        many queries contain each term
+        """
+        raise NotImplementedError
+
+    def _row_score(
+        self,
+        field_terms: Dict[str, Dict],
+        term_key: Optional[Callable],
+        query_counts: Counter,
+        weights: Dict[str, float],
+    ) -> float:
+        """
+        Score a single ad from its per-field term frequency maps, which are keyed
+        by term_key(word) when it is given and by the word itself otherwise
+        """
+        raise NotImplementedError
+
+
+class WeightedTermScorer(RankingEngine):
+    """
+    Vectorized version of the frequency-weighted relevance score.
+
+    An ad's score for a request is the sum over its queries of
+    title_weight * |query words in title| + content_weight * |query words in content|,
+    which is the product of binary ad x term matrices for title and content with
+    a vector counting how many of the queries contain each term. Scoring a request
+    therefore costs one sparse matrix-vector product, whatever the number of queries.
+    """
+
+    def _compiled_scores(self, rows, term_ids, counts, weights):
+        scores = np.zeros(len(rows))
+        for terms_field, weight in weights.items():
+            matrix = self.store.matrices[terms_field]
+            posting_rows, _, which = matrix.postings(term_ids)
+            row_scores = np.bincount(
+                posting_rows, weights=counts[which] * weight, minlength=matrix.n_rows
+            )
+            scores += row_scores[rows]
+        return scores
+
+    def _row_score(self, field_terms, term_key, query_counts, weights):
+        score = 0
+        for terms_field, weight in weights.items():
+            terms = field_terms[terms_field]
+            score += weight * sum(
+                count
+                for word, count in query_counts.items()
+                if (term_key(word) if term_key else word) in terms
+            )
+        return score
+
+
+class BM25FScorer(RankingEngine):
+    """
+    BM25F ranking with title and content as separately weighted, length normalized
+    fields. Document frequencies, the number of ads and the total length of each
+    field are kept up to date by the TermStore as ads are added, so scoring a
+    request only touches the postings of its query terms.
+    """
+
+    def _normalizer(self, terms_field: str, lengths):
+        store = self.store
+        average_length = 1.0
+        if store.n_docs > 0:
+            average_length = max(store.total_lengths[terms_field] / store.n_docs, 1.0)
+        b = BM25_B[terms_field]
+        return 1 - b + b * lengths / average_length
+
+    def _idf(self, df):
+        return np.log(1 + (self.store.n_docs - df + 0.5) / (df + 0.5))
+
+    def _compiled_scores(self, rows, term_ids, counts, weights):
+        order = np.argsort(rows)
+        sorted_rows = rows[order]
+        df = np.array([self.store.df[term_id] for term_id in term_ids], dtype=np.float64)
+        idf = self._idf(df)
+
+        # Field weighted, length normalized term frequency of every
+        # (query term, candidate) pair, keyed by term * len(rows) + candidate
+        keys, values = [], []
+        for terms_field, weight in weights.items():
+            matrix = self.store.matrices[terms_field]
+            posting_rows, tfs, which = matrix.postings(term_ids)
+            positions = np.minimum(
+                np.searchsorted(sorted_rows, posting_rows), len(sorted_rows) - 1
+            )
+            is_candidate = sorted_rows[positions] == posting_rows
+            posting_rows = posting_rows[is_candidate]
+            keys.append(which[is_candidate] * len(rows) + positions[is_candidate])
+            values.append(
+                weight
+                * tfs[is_candidate]
+                / self._normalizer(terms_field, matrix.lengths[posting_rows])
+            )
+
+        keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        pseudo_tfs = np.bincount(inverse, weights=np.concatenate(values))
+        which, positions = keys // len(rows), keys % len(rows)
+
+        sorted_scores = np.bincount(
+            positions,
+            weights=counts[which] * idf[which] * pseudo_tfs / (BM25_K1 + pseudo_tfs),
+            minlength=len(rows),
+        )
+        scores = np.empty(len(rows))
+        scores[order] = sorted_scores
+        return scores
+
+    def _row_score(self, field_terms, term_key, query_counts, weights):
+        normalizers = {
+            terms_field: self._normalizer(terms_field, sum(terms.values()))
+            for terms_field, terms in field_terms.items()
+        }
+        score = 0
+        for word, count in query_counts.items():
+            key = term_key(word) if term_key else word
+            pseudo_tf = sum(
+                weight * field_terms[terms_field].get(key, 0) / normalizers[terms_field]
+                for terms_field, weight in weights.items()
+            )
+            if pseudo_tf:
+                term_id = self.store.vocab.get(word)
+                df = self.store.df[term_id] if term_id is not None else 0
+                idf = math.log(1 + (self.store.n_docs - df + 0.5) / (df + 0.5))
+                score += count * idf * pseudo_tf / (BM25_K1 + pseudo_tf)
+        return score
+
+
+RANKING_ENGINES = {
+    "weighted": WeightedTermScorer,
+    "bm25f": BM25FScorer,
+}
+
+
+def create_ranking_engine(
+    engine: str, store: TermStore, cache: Optional[ScoreCache] = None
+) -> RankingEngine:
+    if engine not in RANKING_ENGINES:
+        raise ValueError(f"Ranking engine {engine} does not exist")
+    return RANKING_ENGINES[engine](store, cache)
+
+
+def _lookup_scores(
+    score_rows: np.ndarray, scores: np.ndarray, rows: np.ndarray
+) -> np.ndarray:
+    """
+    Get the scores of rows from sorted score_rows and their scores, 0 for rows
+    that are not in score_rows
+    """
+    if not len(score_rows):
+        return np.zeros(len(rows))
+    positions = np.minimum(np.searchsorted(score_rows, rows), len(score_rows) - 1)
+    return np.where(score_rows[positions] == rows, scores[positions], 0.0)
+
+
+def _top_n_positions(scores: np.ndarray, n: int) -> np.ndarray:
+    """
+    Positions of the n highest scores, using partial selection rather than a full
+    sort. Ties are broken by position, the same way a stable sort would.
+    """
+    if n < len(scores):
+        kth = np.partition(scores, len(scores) - n)[len(scores) - n]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[: n - len(above)]
+        positions = np.concatenate([above, ties])
+    else:
+        positions = np.arange(len(scores))
+
+    return positions[np.lexsort((positions, -scores[positions]))]
@@ -0,0 +1,191 @@
+import random
+from collections import Counter
+import numpy as np
+from bson import ObjectId
+from src.models.ad import calculate_weighted_relevance_score
+from src.models.ranking import BM25FScorer, ScoreCache, TermStore, WeightedTermScorer
+
+WORDS = ["book", "shelf", "water", "flosser", "easter", "candy", "wooden", "kids"]
+
+
+def make_ads(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [
+        {
+            "_id": ObjectId(),
+            "product_title": " ".join(rng.choices(WORDS, k=2)),
+            "full_content": " ".join(rng.choices(WORDS, k=rng.randint(0, 12))),
+        }
+        for _ in range(count)
+    ]
+
+
+def reference_top_n(ads, queries, n, title_weight=3, content_weight=1):
+    # The original scoring loop: cumulative score per ad, then a full stable sort
+    cumulative_scores = {}
+    for ad in ads:
+        total_score = sum(
+            calculate_weighted_relevance_score(ad, query, title_weight, content_weight)
+            for query in queries
+        )
+        cumulative_scores[ad["_id"]] = (ad, total_score)
+    sorted_ads = sorted(cumulative_scores.values(), key=lambda x: x[1], reverse=True)
+    return [ad for ad, _ in sorted_ads[:n]]
+
+
+def partially_compiled_store(ads):
+    store = TermStore()
+    engines = [WeightedTermScorer(store), BM25FScorer(store)]
+    for ad in ads[:200]:
+        store.add(ad)
+    for engine in engines:
+        engine.compile()
+    # Rows added after compiling are scored without the matrices
+    for ad in ads[200:250]:
+        store.add(ad)
+    return engines
+
+
+def test_weighted_top_n_matches_reference_ranking():
+    ads = make_ads(300)
+    weighted, _ = partially_compiled_store(ads)
+
+    rng = random.Random(1)
+    for _ in range(50):
+        candidates = rng.sample(ads, 40) + rng.sample(ads, 5)
+        queries = [" ".join(rng.choices(WORDS + ["unknown"], k=2)) for _ in range(3)]
+        for n in (1, 5, 20, 100):
+            assert weighted.top_n(candidates, queries, n, 3, 1) == reference_top_n(
+                candidates, queries, n
+            )
+
+
+def test_top_n_scores_latest_version_of_ad():
+    ad = {"_id": ObjectId(), "product_title": "book shelf", "full_content": ""}
+    other = {"_id": ObjectId(), "product_title": "shelf", "full_content": ""}
+    store = TermStore()
+    weighted = WeightedTermScorer(store)
+    store.add(ad)
+    store.add(other)
+    weighted.compile()
+
+    store.add({**ad, "product_title": "water flosser"})
+
+    assert weighted.top_n([ad, other], ["book shelf"], 1, 3, 1) == [other]
+
+
+def test_bm25f_compiled_scores_match_single_ad_scores():
+    ads = make_ads(200)
+    store = TermStore()
+    bm25f = BM25FScorer(store)
+    for ad in ads:
+        store.add(ad)
+    bm25f.compile()
+
+    query_counts = Counter({"book": 2, "shelf": 1, "kids": 1})
+    weights = {"title_terms": 3, "content_terms": 1}
+    term_ids = np.array([store.vocab[word] for word in query_counts])
+    counts = np.array(list(query_counts.values()), dtype=np.float64)
+    rows = np.arange(len(ads))[::-1]
+
+    compiled_scores = bm25f._compiled_scores(rows, term_ids, counts, weights)
+    single_scores = [
+        bm25f._row_score(
+            {terms_field: store.row_terms(terms_field, row) for terms_field in weights},
+            store.vocab.get,
+            query_counts,
+            weights,
+        )
+        for row in rows
+    ]
+    assert np.allclose(compiled_scores, single_scores)
+
+
+def test_store_incremental_stats_match_rebuild():
+    ads = make_ads(100)
+    incremental = TermStore()
+    for ad in ads:
+        incremental.add(ad)
+    for ad in ads[:10]:
+        incremental.add({**ad, "full_content": "water flosser"})
+    incremental.remove(ads[10]["_id"])
+
+    rebuilt = TermStore()
+    for ad in ads[:10]:
+        rebuilt.add({**ad, "full_content": "water flosser"})
+    for ad in ads[11:]:
+        rebuilt.add(ad)
+
+    assert incremental.n_docs == rebuilt.n_docs == 99
+    assert incremental.total_lengths == rebuilt.total_lengths
+    for word, term_id in rebuilt.vocab.items():
+        assert incremental.df[incremental.vocab[word]] == rebuilt.df[term_id]
+
+
+def test_bm25f_prefers_rare_terms_and_title_matches():
+    ads = [
+        {"_id": ObjectId(), "product_title": "shelf", "full_content": "book"},
+        {"_id": ObjectId(), "product_title": "book", "full_content": "shelf"},
+        {"_id": ObjectId(), "product_title": "lamp", "full_content": "shelf"},
+        {"_id": ObjectId(), "product_title": "desk", "full_content": "shelf"},
+    ]
+    store = TermStore()
+    bm25f = BM25FScorer(store)
+    for ad in ads:
+        store.add(ad)
+    bm25f.compile()
+
+    assert bm25f.top_n(ads, ["book"], 1, 3, 1) == [ads[1]]
+    assert bm25f.top_n(ads, ["book shelf"], 2, 3, 1) == [ads[1], ads[0]]
+
+
+def test_cached_ranking_matches_uncached_ranking():
+    ads = make_ads(300)
+    store = TermStore()
+    engine_pairs = [
+        (engine_class(store), engine_class(store, ScoreCache(max_scores=500)))
+        for engine_class in (WeightedTermScorer, BM25FScorer)
+    ]
+    for ad in ads[:200]:
+        store.add(ad)
+    for engines in engine_pairs:
+        for engine in engines:
+            engine.compile()
+
+    rng = random.Random(2)
+    for step in range(60):
+        # Change the catalog from time to time, leaving some rows uncompiled
+        if step % 10 == 9:
+            ad = ads[200 + step // 10]
+            store.add(ad)
+            store.add({**rng.choice(ads[:200]), "product_title": "kids candy"})
+        candidates = rng.sample(ads[:210], 30) + [make_ads(1, seed=step)[0]]
+        queries = [" ".join(rng.choices(WORDS + ["unknown"], k=2)) for _ in range(2)]
+        for uncached, cached in engine_pairs:
+            for n in (1, 5, 40):
+                assert cached.top_n(candidates, queries, n, 3, 1) == uncached.top_n(
+                    candidates, queries, n, 3, 1
+                )
+
+    for _, cached in engine_pairs:
+        assert cached.cache.hits > 0
+        assert cached.cache._size <= cached.cache.max_scores
+
+
+def test_score_cache_is_dropped_when_catalog_changes():
+    ads = make_ads(20)
+    store = TermStore()
+    weighted = WeightedTermScorer(store, ScoreCache(max_scores=1000))
+    for ad in ads:
+        store.add(ad)
+    weighted.compile()
+
+    weighted.top_n(ads, ["book"], 1, 3, 1)
+    weighted.top_n(ads, ["book"], 1, 3, 1)
+    assert (weighted.cache.hits, weighted.cache.misses) == (1, 1)
+
+    # The cached scores of "book" are stale once an ad is added
+    new_ad = {"_id": ObjectId(), "product_title": "zebra", "full_content": "book"}
+    store.add(new_ad)
+    assert weighted.top_n([new_ad] + ads, ["book"], 1, 0, 1) == [new_ad]
+    assert weighted.cache.misses == 2
@@ -0,0 +1,33 @@
+import re
+from collections import Counter
+from typing import Dict, List
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase word tokens, using the same word definition as the
+    regex queries the ads collection used to be searched with.
+    """
+    return re.findall(r"\w+", text.lower())
+
+
+def term_frequencies(text: str) -> Dict[str, int]:
+    """
+    Count how many times each token occurs in text
+    """
+    return dict(Counter(tokenize(text)))
+
+
+# Stored term-frequency map field -> text field it is computed from
+TERM_FIELDS = {"title_terms": "product_title", "content_terms": "full_content"}
+
+
+def ad_terms(ad: Dict, terms_field: str) -> Dict[str, int]:
+    """
+    Get the term frequencies stored on an ad, tokenizing the source text only for
+    ads that were written before term data was stored at ingest time.
+    """
+    terms = ad.get(terms_field)
+    if terms is None:
+        terms = term_frequencies(ad.get(TERM_FIELDS[terms_field], ""))
+    return terms
@@ -0,0 +1,129 @@
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+from pymongo import ASCENDING, DeleteMany, IndexModel, InsertOne, UpdateOne
+from src.models.mongo import DatabaseClient
+import pytz
+
+# Views are counted by calendar day in this timezone
+VIEWS_TIMEZONE = pytz.timezone("America/Los_Angeles")
+
+# Every api event is counted in three rollup documents of its api key: the
+# "day:YYYY-MM-DD" and "month:YYYY-MM" buckets of its local receive time, and
+# the "total" bucket
+TOTAL_BUCKET = "total"
+
+# Indexes and query shapes of the collections this module owns, see src/models/indexes.py
+INDEXES = {
+    "api_event_rollups": [
+        IndexModel([("api_key", ASCENDING), ("bucket", ASCENDING)], unique=True),
+    ],
+}
+QUERY_SHAPES = {"api_event_rollups": [("api_key", "bucket")]}
+
+
+def day_bucket(day: date) -> str:
+    return f"day:{day.isoformat()}"
+
+
+def month_bucket(day: date) -> str:
+    return f"month:{day.year:04d}-{day.month:02d}"
+
+
+def local_date(time: datetime) -> date:
+    """
+    Get the calendar day of a time in VIEWS_TIMEZONE. Naive times are UTC, like the
+    ones stored in api_events.
+    """
+    if time.tzinfo is None:
+        time = pytz.utc.localize(time)
+    return time.astimezone(VIEWS_TIMEZONE).date()
+
+
+def event_buckets(call_receive_time: datetime) -> List[str]:
+    day = local_date(call_receive_time)
+    return [day_bucket(day), month_bucket(day), TOTAL_BUCKET]
+
+
+def period_buckets(now: Optional[datetime] = None) -> Dict[str, str]:
+    """
+    Get the rollup bucket holding the views of each reporting period
+    """
+    today = local_date(now or datetime.utcnow())
+    return {
+        "today": day_bucket(today),
+        "yesterday": day_bucket(today - timedelta(days=1)),
+        "this_month": month_bucket(today),
+        "total": TOTAL_BUCKET,
+    }
+
+
+def count_views(api_events: Iterable[dict]) -> Counter:
+    """
+    Count api events by (api_key, bucket)
+    """
+    counts = Counter()
+    for api_event in api_events:
+        for bucket in event_buckets(api_event["call_receive_time"]):
+            counts[(api_event["api_key"], bucket)] += 1
+    return counts
+
+
+async def increment_view_rollups(api_events: List[dict]) -> None:
+    """
+    Add logged api events to the view rollups with one bulk write
+    """
+    updates = [
+        UpdateOne(
+            {"api_key": api_key, "bucket": bucket},
+            {"$inc": {"views": views}},
+            upsert=True,
+        )
+        for (api_key, bucket), views in count_views(api_events).items()
+    ]
+    if updates:
+        rollups_collection = DatabaseClient.get_collection("api_event_rollups")
+        await rollups_collection.bulk_write(updates, ordered=False)
+
+
+async def rebuild_view_rollups() -> int:
+    """
+    Recompute every view rollup from the raw api events, and return the number of
+    rollup documents written. Events logged while the rebuild runs may be counted
+    twice or not at all, so run it while the API server is not logging events.
+    """
+    api_events_collection = DatabaseClient.get_collection("api_events")
+    daily_views = api_events_collection.aggregate(
+        [
+            {
+                "$group": {
+                    "_id": {
+                        "api_key": "$api_key",
+                        "day": {
+                            "$dateToString": {
+                                "format": "%Y-%m-%d",
+                                "date": "$call_receive_time",
+                                "timezone": VIEWS_TIMEZONE.zone,
+                            }
+                        },
+                    },
+                    "views": {"$sum": 1},
+                }
+            }
+        ]
+    )
+
+    counts = Counter()
+    async for row in daily_views:
+        api_key = row["_id"]["api_key"]
+        day = date.fromisoformat(row["_id"]["day"])
+        for bucket in (day_bucket(day), month_bucket(day), TOTAL_BUCKET):
+            counts[(api_key, bucket)] += row["views"]
+
+    rollups_collection = DatabaseClient.get_collection("api_event_rollups")
+    requests = [DeleteMany({})] + [
+        InsertOne({"api_key": api_key, "bucket": bucket, "views": views})
+        for (api_key, bucket), views in counts.items()
+    ]
+    await rollups_collection.bulk_write(requests, ordered=True)
+    return len(counts)
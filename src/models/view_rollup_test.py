@@ -0,0 +1,46 @@
+from datetime import datetime
+import pytz
+
+from src.models.view_rollup import count_views, event_buckets, period_buckets
+
+
+def test_event_buckets_use_los_angeles_day():
+    # 2024-03-01 07:59 UTC is still February 29 in Los Angeles
+    assert event_buckets(datetime(2024, 3, 1, 7, 59)) == [
+        "day:2024-02-29",
+        "month:2024-02",
+        "total",
+    ]
+    assert event_buckets(datetime(2024, 3, 1, 8, 0)) == [
+        "day:2024-03-01",
+        "month:2024-03",
+        "total",
+    ]
+    # Timezone aware times are converted, not reinterpreted
+    aware = pytz.timezone("America/Los_Angeles").localize(datetime(2024, 3, 1, 0, 30))
+    assert event_buckets(aware)[0] == "day:2024-03-01"
+
+
+def test_period_buckets():
+    assert period_buckets(datetime(2024, 3, 1, 12, 0)) == {
+        "today": "day:2024-03-01",
+        "yesterday": "day:2024-02-29",
+        "this_month": "month:2024-03",
+        "total": "total",
+    }
+
+
+def test_count_views_by_api_key_and_bucket():
+    events = [
+        {"api_key": "a", "call_receive_time": datetime(2024, 3, 1, 12, 0)},
+        {"api_key": "a", "call_receive_time": datetime(2024, 3, 2, 12, 0)},
+        {"api_key": "b", "call_receive_time": datetime(2024, 3, 2, 12, 0)},
+    ]
+    counts = count_views(events)
+
+    assert counts[("a", "day:2024-03-01")] == 1
+    assert counts[("a", "day:2024-03-02")] == 1
+    assert counts[("a", "month:2024-03")] == 2
+    assert counts[("a", "total")] == 2
+    assert counts[("b", "total")] == 1
+    assert len(counts) == 7
@@ -0,0 +1,52 @@
+import argparse
+import asyncio
+from pymongo import UpdateOne
+from src.models.terms import TERM_FIELDS, term_frequencies
+from src.models.mongo import DatabaseClient
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Store pre-tokenized title/content term frequencies on existing ads."
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        help="Number of ads to update per bulk write",
+        default=500,
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Recompute term data for ads that already have it",
+    )
+
+    args = parser.parse_args()
+
+    collection = DatabaseClient.get_collection("ads")
+    query = {} if args.force else {"$or": [{field: {"$exists": False}} for field in TERM_FIELDS]}
+    projection = {text_field: 1 for text_field in TERM_FIELDS.values()}
+
+    updates = []
+    updated_count = 0
+    async for ad in collection.find(query, projection):
+        terms = {
+            terms_field: term_frequencies(ad.get(text_field, ""))
+            for terms_field, text_field in TERM_FIELDS.items()
+        }
+        updates.append(UpdateOne({"_id": ad["_id"]}, {"$set": terms}))
+
+        if len(updates) >= args.batch_size:
+            await collection.bulk_write(updates, ordered=False)
+            updated_count += len(updates)
+            updates = []
+
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
+        updated_count += len(updates)
+
+    print(f"Backfilled term data for {updated_count} ads.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,31 @@
+import argparse
+import asyncio
+import time
+from src.models.ad_index import AD_SNAPSHOT_PATH, build_ad_index
+from src.models.ad_snapshot import write_ad_snapshot
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Build the memory-mapped ad snapshot the API workers load the ad index from."
+    )
+    parser.add_argument(
+        "--path",
+        help="Where to publish the snapshot, AD_SNAPSHOT_PATH by default",
+        default=AD_SNAPSHOT_PATH,
+    )
+
+    args = parser.parse_args()
+    if not args.path:
+        parser.error("--path is required when AD_SNAPSHOT_PATH is not set")
+
+    start = time.perf_counter()
+    index = await build_ad_index()
+    ad_count = write_ad_snapshot(index, args.path)
+    elapsed = time.perf_counter() - start
+
+    print(f"Published a snapshot of {ad_count} ads to {args.path} in {elapsed:.1f}s.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
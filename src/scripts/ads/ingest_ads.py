@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import time
+from datetime import datetime
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Set, Tuple, Union
+
+from pydantic import ValidationError
+from pymongo.errors import OperationFailure
+
+from src.models.ad import INDEXES, Ad, upsert_ads
+from src.models.mongo import DatabaseClient
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bulk ad ingestion. Ads are streamed from a JSONL or CSV file, or from the
+# scraper, validated a chunk at a time and upserted by generic_product_URL with
+# one unordered bulk write per chunk. Up to WRITE_CONCURRENCY chunks are written
+# at once while the next ones are validated.
+CHUNK_SIZE = 1000
+WRITE_CONCURRENCY = 4
+# Number of errors kept in the report
+MAX_REPORTED_ERRORS = 20
+
+Records = Union[Iterable[Dict], AsyncIterable[Dict]]
+
+
+def read_jsonl(path: str) -> Iterator[Dict]:
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_csv(path: str) -> Iterator[Dict]:
+    """
+    Read the rows of a CSV file with a header row, leaving out empty cells
+    """
+    with open(path, newline="") as file:
+        for row in csv.DictReader(file):
+            yield {field: value for field, value in row.items() if value}
+
+
+def read_ads(path: str) -> Iterator[Dict]:
+    if path.endswith(".csv"):
+        return read_csv(path)
+    return read_jsonl(path)
+
+
+async def _chunks(records: Records, size: int) -> AsyncIterator[List[Dict]]:
+    chunk = []
+    if isinstance(records, AsyncIterable):
+        async for record in records:
+            chunk.append(record)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+    else:
+        for record in records:
+            chunk.append(record)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def validate_ads(records: List[Dict], source: str = "") -> Tuple[List[Ad], List[str]]:
+    """
+    Validate a chunk of ad records, computing their term data. Records without a
+    source get the given one and records without last_time_accessed get the
+    current time. Returns the valid ads, the last one of every URL, and the
+    errors of the invalid records.
+    """
+    now = datetime.utcnow()
+    ads: Dict[str, Ad] = {}
+    errors = []
+    for record in records:
+        record = {key: value for key, value in record.items() if key != "_id"}
+        if source and not record.get("source"):
+            record["source"] = source
+        if not record.get("last_time_accessed"):
+            record["last_time_accessed"] = now
+        try:
+            ad = Ad.model_validate(record)
+        except ValidationError as e:
+            url = record.get("generic_product_URL", "<no generic_product_URL>")
+            errors.append(f"{url}: {e.error_count()} validation errors, {e.errors()[0]['msg']}")
+            continue
+        ads[ad.generic_product_URL] = ad
+    return list(ads.values()), errors
+
+
+async def ingest_ads(
+    records: Records,
+    source: str = "",
+    chunk_size: int = CHUNK_SIZE,
+    concurrency: int = WRITE_CONCURRENCY,
+) -> Dict:
+    """
+    Ingest ad records, see above, and report the counts and throughput
+    """
+    report = {"read": 0, "invalid": 0, "inserted": 0, "updated": 0, "errors": []}
+    start = time.perf_counter()
+    try:
+        await DatabaseClient.get_collection("ads").create_indexes(INDEXES["ads"])
+    except OperationFailure:
+        logger.error("Cannot create the unique generic_product_URL index, remove duplicate ads first")
+        raise
+
+    # Chunks being written, with their URLs
+    writes: Dict[asyncio.Task, Set[str]] = {}
+
+    async def wait_for_writes(return_when: str) -> None:
+        # Failed writes raise here, as soon as they fail
+        done, _ = await asyncio.wait(list(writes), return_when=return_when)
+        for task in done:
+            del writes[task]
+            counts = task.result()
+            report["inserted"] += counts["inserted"]
+            report["updated"] += counts["updated"]
+
+    try:
+        async for chunk in _chunks(records, chunk_size):
+            ads, errors = validate_ads(chunk, source)
+            report["read"] += len(chunk)
+            report["invalid"] += len(errors)
+            report["errors"].extend(errors[: MAX_REPORTED_ERRORS - len(report["errors"])])
+
+            urls = {ad.generic_product_URL for ad in ads}
+            # Concurrent upserts of the same URL would race to insert it
+            if any(urls & written_urls for written_urls in writes.values()):
+                await wait_for_writes(asyncio.FIRST_EXCEPTION)
+            elif len(writes) >= concurrency:
+                await wait_for_writes(asyncio.FIRST_COMPLETED)
+            writes[asyncio.create_task(upsert_ads(ads))] = urls
+
+            if report["read"] % (chunk_size * 10) < chunk_size:
+                logger.info(f"Read {report['read']} ads")
+
+        if writes:
+            await wait_for_writes(asyncio.FIRST_EXCEPTION)
+    except BaseException:
+        # Do not leave the other chunks being written behind
+        for task in writes:
+            task.cancel()
+        await asyncio.gather(*writes, return_exceptions=True)
+        raise
+
+    report["seconds"] = time.perf_counter() - start
+    report["ads_per_second"] = report["read"] / report["seconds"] if report["seconds"] else 0.0
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Upsert ads from a JSONL or CSV file by generic_product_URL and report throughput."
+    )
+    parser.add_argument("path", help="JSONL file of ad documents, or CSV file with one column per field")
+    parser.add_argument("--source", help="Source of the ads that do not have one", default="")
+    parser.add_argument(
+        "--chunk_size", type=int, help="Number of ads per bulk write", default=CHUNK_SIZE
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Number of bulk writes in flight at once",
+        default=WRITE_CONCURRENCY,
+    )
+
+    args = parser.parse_args()
+    report = asyncio.run(
+        ingest_ads(
+            read_ads(args.path),
+            source=args.source,
+            chunk_size=args.chunk_size,
+            concurrency=args.concurrency,
+        )
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
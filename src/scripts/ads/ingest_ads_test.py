@@ -0,0 +1,83 @@
+import asyncio
+import csv
+import json
+
+import pytest
+
+from src.scripts.ads.ingest_ads import ingest_ads, read_ads
+
+
+def ad_record(i: int, title: str = "book shelf") -> dict:
+    return {
+        "source": "test",
+        "generic_product_URL": f"https://www.amazon.com/s?k=ad{i}",
+        "description_for_chatbot": f"ad {i}",
+        "product_title": f"{title} {i}",
+        "full_content": "wooden book shelf with adjustable shelves",
+    }
+
+
+@pytest.fixture
+def ads_database(in_memory_database):
+    return in_memory_database["ads"]
+
+
+def test_ingest_upserts_by_url(ads_database, tmp_path):
+    jsonl_path = tmp_path / "ads.jsonl"
+    jsonl_path.write_text("".join(json.dumps(ad_record(i)) + "\n" for i in range(5)))
+
+    csv_path = tmp_path / "ads.csv"
+    with open(csv_path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(ad_record(0)))
+        writer.writeheader()
+        # An ad of the JSONL file, updated twice, a new ad and an invalid one
+        writer.writerow(ad_record(3, title="old corner shelf"))
+        writer.writerow(ad_record(3, title="corner shelf"))
+        writer.writerow(ad_record(5))
+        writer.writerow({"generic_product_URL": "https://www.amazon.com/s?k=invalid"})
+
+    async def run():
+        first = await ingest_ads(read_ads(str(jsonl_path)), chunk_size=2)
+        second = await ingest_ads(read_ads(str(csv_path)), chunk_size=2)
+        ads = [ad async for ad in ads_database.find()]
+        return first, second, ads
+
+    first, second, ads = asyncio.run(run())
+
+    assert (first["read"], first["inserted"], first["updated"], first["invalid"]) == (5, 5, 0, 0)
+    assert (second["read"], second["inserted"], second["updated"], second["invalid"]) == (4, 1, 1, 1)
+    assert "k=invalid" in second["errors"][0]
+
+    assert len(ads) == 6
+    ad = next(ad for ad in ads if ad["generic_product_URL"].endswith("ad3"))
+    assert ad["product_title"] == "corner shelf 3"
+    assert ad["title_terms"] == {"corner": 1, "shelf": 1, "3": 1}
+
+
+def test_failed_write_cancels_the_other_writes(ads_database, monkeypatch):
+    from src.scripts.ads import ingest_ads as ingest_ads_module
+
+    cancelled = []
+
+    async def upsert_ads(ads):
+        if ads[0].generic_product_URL.endswith("ad0"):
+            await asyncio.sleep(0)
+            raise RuntimeError("write failed")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(ads[0].generic_product_URL)
+            raise
+        return {"inserted": len(ads), "updated": 0}
+
+    monkeypatch.setattr(ingest_ads_module, "upsert_ads", upsert_ads)
+
+    async def run():
+        with pytest.raises(RuntimeError, match="write failed"):
+            await ingest_ads((ad_record(i) for i in range(3)), chunk_size=1)
+        # Nothing is left running once ingest_ads returns
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(run()) == []
+    assert len(cancelled) == 2
+
@@ -0,0 +1,11 @@
+import asyncio
+from src.models.view_rollup import rebuild_view_rollups
+
+
+async def main():
+    rollup_count = await rebuild_view_rollups()
+    print(f"Rebuilt {rollup_count} view rollups from api events.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,304 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import secrets
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+from pymongo import UpdateOne
+
+from src.models.mongo import DatabaseClient
+from src.models.view_rollup import increment_view_rollups
+from src.scripts.benchmarks.synthetic import SyntheticCatalog
+
+# Load test of /api/get_product_info. Seeds a dedicated database with synthetic
+# creators, chatbots, ads and historical api events, then sends requests at each
+# concurrency level and reports throughput and latency percentiles as JSON.
+LOAD_TEST_DATABASE = "load_test"
+PRODUCTION_DATABASE = "backend"
+SEED_BATCH_SIZE = 1000
+PERCENTILES = [50, 95, 99]
+
+
+def use_database(database: str, in_memory: bool) -> None:
+    """
+    Point DatabaseClient at the load test database, on the configured MongoDB or
+    on an in-memory stand-in (mongomock-motor)
+    """
+    if in_memory:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("--in_memory needs mongomock-motor: pip install mongomock-motor")
+        DatabaseClient.client = AsyncMongoMockClient()
+    else:
+        DatabaseClient.connect()
+    DatabaseClient.db = DatabaseClient.client[database]
+
+
+async def insert_in_batches(collection_name: str, documents: List[Dict]) -> None:
+    collection = DatabaseClient.get_collection(collection_name)
+    for start in range(0, len(documents), SEED_BATCH_SIZE):
+        await collection.insert_many(documents[start : start + SEED_BATCH_SIZE], ordered=False)
+
+
+async def seed(
+    catalog: SyntheticCatalog,
+    creators: int,
+    chatbots: int,
+    ads: int,
+    ranked_ads: int,
+    api_events: int,
+) -> List[str]:
+    """
+    Replace the content of the load test database with synthetic data, and return
+    the api keys of the chatbots
+    """
+    await DatabaseClient.clear_all_collections()
+    rng = catalog.rng
+
+    ad_documents = catalog.ads(ads)
+    await insert_in_batches("ads", ad_documents)
+    ad_ids = [ad["_id"] for ad in ad_documents]
+
+    creator_emails = [f"creator{i}@load.test" for i in range(creators)]
+    chatbot_documents = [
+        {
+            "name": f"chatbot{i}",
+            "source": "openai_gpts",
+            "amazon_product_key": f"loadtest{i}-20",
+            "link": f"https://chatbot{i}.load.test",
+            "creator_email": rng.choice(creator_emails),
+            "api_key": secrets.token_urlsafe(16),
+            "ranked_ad_ids": rng.sample(ad_ids, min(ranked_ads, len(ad_ids))),
+            "delivery_frequency": "high",
+        }
+        for i in range(chatbots)
+    ]
+    await insert_in_batches("chatbots", chatbot_documents)
+
+    chatbots_by_creator = {email: [] for email in creator_emails}
+    for chatbot in chatbot_documents:
+        chatbots_by_creator[chatbot["creator_email"]].append(chatbot["_id"])
+    await insert_in_batches(
+        "creators",
+        [{"email": email, "chatbots": ids} for email, ids in chatbots_by_creator.items()],
+    )
+
+    now = datetime.utcnow()
+    api_keys = [chatbot["api_key"] for chatbot in chatbot_documents]
+    for start in range(0, api_events, SEED_BATCH_SIZE):
+        events = []
+        for _ in range(min(SEED_BATCH_SIZE, api_events - start)):
+            receive_time = now - timedelta(seconds=rng.uniform(0, 90 * 24 * 3600))
+            events.append(
+                {
+                    "api_key": rng.choice(api_keys),
+                    "api_type": "get_product_info",
+                    "input_fields": {"query": catalog.query()},
+                    "output_fields": {"ad_id": str(rng.choice(ad_ids))},
+                    "call_receive_time": receive_time,
+                    "call_end_time": receive_time + timedelta(milliseconds=20),
+                    "error_details": {"detail": "get product info success"},
+                }
+            )
+        await DatabaseClient.get_collection("api_events").insert_many(events, ordered=False)
+        await increment_view_rollups(events)
+
+    return api_keys
+
+
+def summarize(latencies: List[float], errors: int, seconds: float, concurrency: int) -> Dict:
+    result = {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": seconds,
+        "throughput_rps": len(latencies) / seconds if seconds > 0 else 0.0,
+    }
+    if latencies:
+        values = np.percentile(np.array(latencies) * 1000, PERCENTILES)
+        result["latency_ms"] = {
+            f"p{percentile}": float(value) for percentile, value in zip(PERCENTILES, values)
+        }
+        result["latency_ms"]["mean"] = float(np.mean(latencies) * 1000)
+        result["latency_ms"]["max"] = float(np.max(latencies) * 1000)
+    return result
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    catalog: SyntheticCatalog,
+    api_keys: List[str],
+    concurrency: int,
+    requests: int,
+) -> Dict:
+    """
+    Send requests from concurrency concurrent callers, each sending its next
+    request as soon as its previous one returned
+    """
+    # Every chatbot starts the level with all of its ranked ads left to show. A
+    # missing delivery state would be backfilled from api_events, bringing back
+    # the ads shown in earlier levels, so every state is reset instead.
+    await DatabaseClient.get_collection("delivery_states").bulk_write(
+        [
+            UpdateOne(
+                {"api_key": api_key},
+                {"$set": {"backfilled": True, "shown_ad_ids": []}},
+                upsert=True,
+            )
+            for api_key in api_keys
+        ],
+        ordered=False,
+    )
+    calls = [(catalog.rng.choice(api_keys), catalog.query()) for _ in range(requests)]
+    latencies: List[float] = []
+    errors = 0
+
+    async def caller():
+        nonlocal errors
+        while calls:
+            api_key, query = calls.pop()
+            start = time.perf_counter()
+            response = await client.get(
+                "/api/get_product_info", params={"query": query, "api_key": api_key}
+            )
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start, concurrency)
+
+
+async def run_load_test(
+    concurrency_levels: List[int],
+    requests: int,
+    creators: int = 10,
+    chatbots: int = 100,
+    ads: int = 1000,
+    ranked_ads: int = 200,
+    api_events: int = 10000,
+    url: Optional[str] = None,
+    seed_value: int = 0,
+) -> Dict:
+    """
+    Seed the database DatabaseClient points at and run the load test, against the
+    app in this process or, given its url, a running server using that database
+    """
+    catalog = SyntheticCatalog(seed_value)
+    start = time.perf_counter()
+    api_keys = await seed(catalog, creators, chatbots, ads, ranked_ads, api_events)
+    report = {
+        "config": {
+            "creators": creators,
+            "chatbots": chatbots,
+            "ads": ads,
+            "ranked_ads": ranked_ads,
+            "api_events": api_events,
+            "requests_per_level": requests,
+            "target": url or "in-process",
+        },
+        "seed_seconds": time.perf_counter() - start,
+        "levels": [],
+    }
+
+    async with contextlib.AsyncExitStack() as stack:
+        if url is None:
+            from main import app, lifespan, preload
+
+            # Load the seeded ads, the lifespan keeps an ad index already loaded
+            await preload()
+            await stack.enter_async_context(lifespan(app))
+            transport = httpx.ASGITransport(app=app)
+            client = httpx.AsyncClient(transport=transport, base_url="http://load.test")
+        else:
+            client = httpx.AsyncClient(base_url=url, timeout=30)
+        await stack.enter_async_context(client)
+
+        # Warm up caches and connections before measuring
+        await run_level(client, catalog, api_keys, 1, min(requests, 20))
+        for concurrency in concurrency_levels:
+            report["levels"].append(
+                await run_level(client, catalog, api_keys, concurrency, requests)
+            )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test /api/get_product_info and report throughput and latency as JSON."
+    )
+    parser.add_argument(
+        "--concurrency",
+        help="Comma separated concurrency levels",
+        default="1,8,32,64",
+    )
+    parser.add_argument(
+        "--requests", type=int, help="Number of requests per concurrency level", default=2000
+    )
+    parser.add_argument("--creators", type=int, default=10)
+    parser.add_argument("--chatbots", type=int, default=100)
+    parser.add_argument("--ads", type=int, default=1000)
+    parser.add_argument(
+        "--ranked_ads", type=int, help="Number of ranked ads of every chatbot", default=200
+    )
+    parser.add_argument(
+        "--api_events", type=int, help="Number of historical api events", default=10000
+    )
+    parser.add_argument(
+        "--database",
+        help="Database to seed, its collections are cleared first",
+        default=LOAD_TEST_DATABASE,
+    )
+    parser.add_argument(
+        "--in_memory",
+        action="store_true",
+        help="Use an in-memory stand-in for MongoDB instead of MONGODB_CONNECTION_STRING",
+    )
+    parser.add_argument(
+        "--url",
+        help="Load test a running server instead of the app in this process. Start it "
+        "with MONGO_DATABASE_NAME set to --database.",
+    )
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+
+    args = parser.parse_args()
+    if args.in_memory and args.url:
+        parser.error("--in_memory only works with the app in this process")
+    if args.database == PRODUCTION_DATABASE:
+        parser.error(f"Refusing to clear the {PRODUCTION_DATABASE} database")
+
+    logging.disable(logging.INFO)
+    use_database(args.database, args.in_memory)
+    # The API prints every request, keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = asyncio.run(
+            run_load_test(
+                [int(level) for level in args.concurrency.split(",")],
+                args.requests,
+                creators=args.creators,
+                chatbots=args.chatbots,
+                ads=args.ads,
+                ranked_ads=args.ranked_ads,
+                api_events=args.api_events,
+                url=args.url,
+            )
+        )
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
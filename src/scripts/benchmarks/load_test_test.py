@@ -0,0 +1,34 @@
+import asyncio
+import pytest
+from src.models.mongo import DatabaseClient
+from src.scripts.benchmarks.load_test import run_load_test, summarize, use_database
+
+
+def test_summarize_reports_percentiles_in_milliseconds():
+    result = summarize([i / 1000 for i in range(1, 101)], errors=2, seconds=2.0, concurrency=4)
+
+    assert result["requests"] == 100
+    assert result["errors"] == 2
+    assert result["throughput_rps"] == 50
+    assert result["latency_ms"]["p50"] == pytest.approx(50.5)
+    assert result["latency_ms"]["p99"] == pytest.approx(99.01)
+    assert result["latency_ms"]["max"] == pytest.approx(100)
+
+
+def test_load_test_in_memory():
+    pytest.importorskip("mongomock_motor")
+    use_database("load_test", in_memory=True)
+    try:
+        report = asyncio.run(
+            run_load_test(
+                [1, 4], 30, creators=2, chatbots=3, ads=50, ranked_ads=40, api_events=20
+            )
+        )
+    finally:
+        DatabaseClient.client = DatabaseClient.db = None
+
+    assert [level["concurrency"] for level in report["levels"]] == [1, 4]
+    for level in report["levels"]:
+        assert level["requests"] == 30
+        assert level["errors"] == 0
+        assert set(level["latency_ms"]) == {"p50", "p95", "p99", "mean", "max"}
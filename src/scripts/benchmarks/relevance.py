@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from src.models.ad import (
+    calculate_weighted_relevance_score,
+    get_most_relevant_ad,
+    get_relevant_ads_by_queries,
+    get_top_n_relevant_ads,
+)
+from src.models.ad_index import AdIndex, current_ad_index, use_ad_index
+from src.models.ranking import RANKING_ENGINES
+from src.scripts.benchmarks.synthetic import SyntheticCatalog
+
+# Micro-benchmark of relevance scoring on synthetic catalogs. For every catalog
+# size it times each scoring function over a mix of queries, with the ranking
+# engines' score caches emptied before every query, and measures the memory the
+# ad index and each query take. Each query is timed REPEATS times and its fastest
+# time kept, which filters out most of the noise of a shared machine. Results
+# are compared with a stored baseline.
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "relevance_baseline.json")
+
+# calculate_weighted_relevance_score scores one ad, it is timed over this many ads
+# per query
+SCORE_SAMPLE_SIZE = 1000
+TOP_N = 20
+REPEATS = 3
+
+# Slowdowns smaller than this are not reported, however large relative to the
+# baseline, as sub-millisecond times vary too much between runs
+MIN_REGRESSION_MS = 0.25
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+
+
+def build_catalog(size: int, seed: int = 0) -> List[Dict]:
+    """
+    Build an ad index of size synthetic ads and make it the current one. Returns
+    a sample of the ad documents, the index only keeps compact records.
+    """
+    catalog = SyntheticCatalog(seed)
+    index = AdIndex()
+    sample = []
+    for _ in range(size):
+        ad = catalog.ad()
+        index.add(ad)
+        if len(sample) < SCORE_SAMPLE_SIZE:
+            sample.append(ad)
+    index.terms.compile()
+    use_ad_index(index)
+    return sample
+
+
+def _clear_score_caches() -> None:
+    for engine in current_ad_index().engines.values():
+        if engine.cache is not None:
+            engine.cache.clear()
+
+
+def time_per_query(run: Callable[[str], object], queries: List[str]) -> Dict:
+    """
+    Time run over every query, then measure the memory it allocates at peak for
+    the first few queries
+    """
+    times = []
+    for query in queries:
+        fastest = float("inf")
+        for _ in range(REPEATS):
+            _clear_score_caches()
+            start = time.perf_counter()
+            run(query)
+            fastest = min(fastest, time.perf_counter() - start)
+        times.append(fastest)
+
+    peaks = []
+    for query in queries[:5]:
+        _clear_score_caches()
+        tracemalloc.start()
+        run(query)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        "per_query_ms": statistics.median(times) * 1000,
+        "p95_ms": float(np.percentile(times, 95) * 1000),
+        "peak_kb": statistics.median(peaks) / 1000,
+    }
+
+
+def benchmark_size(size: int, queries: List[str], engines: List[str]) -> Dict:
+    gc.collect()
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    sample = build_catalog(size)
+    build_seconds = time.perf_counter() - start
+    gc.collect()
+    index = current_ad_index()
+
+    candidates = {query: index.search(query) for query in queries}
+    functions = {
+        "calculate_weighted_relevance_score": lambda query: [
+            calculate_weighted_relevance_score(ad, query, 3, 1) for ad in sample
+        ],
+    }
+    for engine in engines:
+        functions[f"get_most_relevant_ad[{engine}]"] = lambda query, engine=engine: (
+            get_most_relevant_ad(candidates[query], query, engine=engine)
+        )
+        functions[f"get_top_n_relevant_ads[{engine}]"] = lambda query, engine=engine: (
+            get_top_n_relevant_ads(candidates[query], [query], TOP_N, engine=engine)
+        )
+    # Chatbots are created with a couple of queries at once
+    query_pairs = {query: [query, other] for query, other in zip(queries, queries[1:] + queries[:1])}
+    functions["get_relevant_ads_by_queries"] = lambda query: asyncio.run(
+        get_relevant_ads_by_queries(query_pairs[query])
+    )
+
+    result = {
+        "build_seconds": build_seconds,
+        "index_mb": _rss_mb() - rss_before,
+        "candidates_per_query": statistics.mean(len(ads) for ads in candidates.values()),
+        "functions": {
+            name: time_per_query(run, queries) for name, run in functions.items()
+        },
+    }
+    use_ad_index(None)
+    return result
+
+
+def run_benchmark(sizes: List[int], query_count: int, engines: List[str]) -> Dict:
+    queries = SyntheticCatalog(seed=1).queries(query_count)
+    return {
+        "queries": query_count,
+        "sizes": {str(size): benchmark_size(size, queries, engines) for size in sizes},
+    }
+
+
+def compare_with_baseline(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Get the regressions of results against the baseline: per-query times or peak
+    memory more than tolerance (a fraction) above the baseline's
+    """
+    regressions = []
+    for size, size_results in results["sizes"].items():
+        baseline_functions = baseline["sizes"].get(size, {}).get("functions", {})
+        for name, measures in size_results["functions"].items():
+            for measure, min_increase in (("per_query_ms", MIN_REGRESSION_MS), ("peak_kb", 0)):
+                expected = baseline_functions.get(name, {}).get(measure)
+                if (
+                    expected
+                    and measures[measure] > expected * (1 + tolerance)
+                    and measures[measure] - expected > min_increase
+                ):
+                    regressions.append(
+                        f"{name} on {size} ads: {measure} {measures[measure]:.3f}, "
+                        f"baseline {expected:.3f}"
+                    )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark relevance scoring on synthetic catalogs and compare with a baseline."
+    )
+    parser.add_argument(
+        "--sizes",
+        help="Comma separated catalog sizes, up to 1000000",
+        default="1000,10000,100000",
+    )
+    parser.add_argument("--queries", type=int, help="Number of queries in the mix", default=50)
+    parser.add_argument(
+        "--engines", help="Comma separated ranking engines", default=",".join(RANKING_ENGINES)
+    )
+    parser.add_argument("--baseline", help="Baseline results file", default=BASELINE_PATH)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        help="Allowed slowdown or memory growth over the baseline, as a fraction",
+        default=0.25,
+    )
+    parser.add_argument(
+        "--write_baseline",
+        action="store_true",
+        help="Store the results as the new baseline instead of comparing",
+    )
+
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        [int(size) for size in args.sizes.split(",")],
+        args.queries,
+        args.engines.split(","),
+    )
+    print(json.dumps(results, indent=2))
+
+    if args.write_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+            file.write("\n")
+        print(f"Wrote the baseline to {args.baseline}")
+        return
+
+    with open(args.baseline) as file:
+        regressions = compare_with_baseline(results, json.load(file), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
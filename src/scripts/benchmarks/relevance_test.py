@@ -0,0 +1,36 @@
+from src.models.ad_index import current_ad_index
+from src.scripts.benchmarks.relevance import compare_with_baseline, run_benchmark
+
+
+def test_benchmark_measures_every_scoring_function():
+    results = run_benchmark([200], query_count=4, engines=["weighted"])
+
+    size_results = results["sizes"]["200"]
+    assert size_results["candidates_per_query"] > 0
+    assert set(size_results["functions"]) == {
+        "calculate_weighted_relevance_score",
+        "get_most_relevant_ad[weighted]",
+        "get_top_n_relevant_ads[weighted]",
+        "get_relevant_ads_by_queries",
+    }
+    for measures in size_results["functions"].values():
+        assert measures["per_query_ms"] > 0
+        assert measures["peak_kb"] > 0
+    assert current_ad_index() is None
+
+
+def test_compare_reports_only_regressions_beyond_tolerance():
+    def results(per_query_ms, peak_kb):
+        return {
+            "sizes": {
+                "1000": {"functions": {"scoring": {"per_query_ms": per_query_ms, "peak_kb": peak_kb}}}
+            }
+        }
+
+    baseline = results(10.0, 100.0)
+
+    assert compare_with_baseline(results(12.0, 120.0), baseline, 0.25) == []
+    assert len(compare_with_baseline(results(13.0, 130.0), baseline, 0.25)) == 2
+    # Tiny times are too noisy to compare
+    assert compare_with_baseline(results(0.2, 100.0), results(0.1, 100.0), 0.25) == []
+    assert compare_with_baseline(results(13.0, 100.0), {"sizes": {}}, 0.25) == []
@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules the API server must not load on startup, they are only needed by
+# the ad generation scripts
+LAZY_MODULES = ["selenium", "openai"]
+
+# Runs in a fresh interpreter: time the import of the API app and, optionally,
+# its lifespan startup and shutdown (which connects to MongoDB and loads the ad
+# index), then report what was loaded
+PROBE = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+import main
+import_seconds = time.perf_counter() - start
+from src.models.mongo import DatabaseClient
+connected_on_import = DatabaseClient.client is not None
+boot_seconds = None
+if {boot}:
+    async def boot():
+        async with main.lifespan(main.app):
+            pass
+    start = time.perf_counter()
+    asyncio.run(boot())
+    boot_seconds = time.perf_counter() - start
+print(json.dumps({{
+    "import_seconds": import_seconds,
+    "boot_seconds": boot_seconds,
+    "connected_on_import": connected_on_import,
+    "loaded_lazy_modules": [m for m in {lazy_modules!r} if m in sys.modules],
+}}))
+"""
+
+
+def measure_startup(boot: bool = False) -> dict:
+    """
+    Measure the startup of the API server in a fresh interpreter, run from the
+    repository root
+    """
+    root = os.path.dirname(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    )
+    probe = PROBE.format(boot=boot, lazy_modules=LAZY_MODULES)
+    output = subprocess.run(
+        [sys.executable, "-c", probe],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that the API server imports and boots within a time budget."
+    )
+    parser.add_argument(
+        "--runs", type=int, help="Number of fresh interpreters to time", default=5
+    )
+    parser.add_argument(
+        "--import_budget_seconds",
+        type=float,
+        help="Maximum median time to import the API app",
+        default=1.0,
+    )
+    parser.add_argument(
+        "--boot",
+        action="store_true",
+        help="Also run the app lifespan, which needs a reachable MongoDB",
+    )
+    parser.add_argument(
+        "--boot_budget_seconds",
+        type=float,
+        help="Maximum median time to run the app lifespan",
+        default=10.0,
+    )
+
+    args = parser.parse_args()
+
+    runs = [measure_startup(args.boot) for _ in range(args.runs)]
+    import_seconds = statistics.median(run["import_seconds"] for run in runs)
+    result = {
+        "import_seconds": import_seconds,
+        "connected_on_import": any(run["connected_on_import"] for run in runs),
+        "loaded_lazy_modules": sorted(
+            {module for run in runs for module in run["loaded_lazy_modules"]}
+        ),
+    }
+    failures = []
+    if import_seconds > args.import_budget_seconds:
+        failures.append(
+            f"import took {import_seconds:.3f}s, budget is {args.import_budget_seconds}s"
+        )
+    if args.boot:
+        boot_seconds = statistics.median(run["boot_seconds"] for run in runs)
+        result["boot_seconds"] = boot_seconds
+        if boot_seconds > args.boot_budget_seconds:
+            failures.append(
+                f"boot took {boot_seconds:.3f}s, budget is {args.boot_budget_seconds}s"
+            )
+    if result["connected_on_import"]:
+        failures.append("importing the app connected to MongoDB")
+    if result["loaded_lazy_modules"]:
+        failures.append(f"importing the app loaded {result['loaded_lazy_modules']}")
+
+    print(json.dumps(result, indent=2))
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+
+from src.scripts.benchmarks.startup_time import LAZY_MODULES
+
+ROOT = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+
+def test_api_startup_loads_only_the_serving_path():
+    # A fresh interpreter, this one may have loaded the lazy modules already
+    check = f"""
+import sys
+import main
+from src.models.mongo import DatabaseClient
+loaded = [module for module in {LAZY_MODULES!r} if module in sys.modules]
+assert not loaded, f"import main loaded {{loaded}}"
+assert DatabaseClient.client is None, "import main connected to MongoDB"
+"""
+    result = subprocess.run(
+        [sys.executable, "-c", check], cwd=ROOT, capture_output=True, text=True
+    )
+
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,98 @@
+import itertools
+import random
+from datetime import datetime
+from typing import Dict, List
+
+from bson import ObjectId
+
+from src.models.terms import TERM_FIELDS, term_frequencies
+
+# Synthetic ads and queries for the benchmarks. Titles and content are drawn from
+# product words, which queries use too, and a long tail of filler words with a
+# Zipf-like frequency, so that term frequencies and match rates resemble those
+# of the scraped Amazon catalog.
+PRODUCT_WORDS = [
+    "book", "shelf", "water", "flosser", "easter", "candy", "chocolate", "bunny",
+    "hiking", "shoes", "poles", "backpack", "tent", "lamp", "desk", "chair",
+    "coffee", "grinder", "kettle", "mug", "yoga", "mat", "dumbbell", "bike",
+    "helmet", "phone", "case", "charger", "cable", "headphones", "speaker",
+    "keyboard", "mouse", "monitor", "notebook", "pen", "pillow", "blanket",
+    "towel", "shampoo", "brush", "toothpaste", "razor", "wallet", "watch",
+    "sunglasses", "jacket", "socks", "gloves", "scarf", "blender", "knife",
+    "pan", "skillet", "plant", "pot", "garden", "hose", "drill", "lock",
+]
+ADJECTIVES = [
+    "wooden", "cordless", "portable", "compact", "classic", "modern", "organic",
+    "waterproof", "wireless", "ergonomic", "adjustable", "rechargeable", "kids",
+    "premium", "eco", "friendly", "stainless", "steel", "lightweight", "foldable",
+    "electric", "manual", "vintage", "minimalist", "gourmet", "travel", "smart",
+]
+SYLLABLES = ["ka", "lo", "mi", "ter", "pa", "ran", "sel", "vo", "dre", "qu", "ni", "tos"]
+FILLER_WORD_COUNT = 5000
+
+TITLE_WORDS = (4, 12)
+CONTENT_WORDS = (40, 120)
+
+
+def _filler_words(rng: random.Random) -> List[str]:
+    words = set()
+    while len(words) < FILLER_WORD_COUNT:
+        words.add("".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+class SyntheticCatalog:
+    """
+    Deterministic generator of ads and queries, seeded by seed
+    """
+
+    def __init__(self, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.filler_words = _filler_words(self.rng)
+        self.filler_cum_weights = list(
+            itertools.accumulate(1 / rank for rank in range(1, len(self.filler_words) + 1))
+        )
+
+    def _text(self, word_count: int, product_share: float) -> str:
+        product_count = max(1, int(word_count * product_share))
+        words = self.rng.choices(PRODUCT_WORDS + ADJECTIVES, k=product_count)
+        words += self.rng.choices(
+            self.filler_words,
+            cum_weights=self.filler_cum_weights,
+            k=word_count - product_count,
+        )
+        self.rng.shuffle(words)
+        return " ".join(words)
+
+    def ad(self) -> Dict:
+        ad_id = ObjectId()
+        ad = {
+            "_id": ad_id,
+            "source": "synthetic",
+            "generic_product_URL": f"https://www.amazon.com/s?k={ad_id}&tag={{amazon_tracking_id}}",
+            "description_for_chatbot": self._text(12, 0.5),
+            "product_title": self._text(self.rng.randint(*TITLE_WORDS), 0.6),
+            "full_content": self._text(self.rng.randint(*CONTENT_WORDS), 0.15),
+            "last_time_accessed": datetime.utcnow(),
+        }
+        for terms_field, text_field in TERM_FIELDS.items():
+            ad[terms_field] = term_frequencies(ad[text_field])
+        return ad
+
+    def ads(self, count: int) -> List[Dict]:
+        return [self.ad() for _ in range(count)]
+
+    def query(self) -> str:
+        """
+        A chatbot query: one or two product words, sometimes with an adjective or
+        a word that matches no ad
+        """
+        words = self.rng.sample(PRODUCT_WORDS, self.rng.choice((1, 2, 2, 2)))
+        if self.rng.random() < 0.3:
+            words.insert(0, self.rng.choice(ADJECTIVES))
+        if self.rng.random() < 0.1:
+            words.append("unmatched")
+        return " ".join(words)
+
+    def queries(self, count: int) -> List[str]:
+        return [self.query() for _ in range(count)]
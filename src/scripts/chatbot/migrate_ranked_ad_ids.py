@@ -0,0 +1,62 @@
+import argparse
+import asyncio
+from bson import ObjectId
+from pymongo import UpdateOne
+from src.models.mongo import DatabaseClient
+
+
+def to_object_ids(ad_ids):
+    return [ObjectId(ad_id) if isinstance(ad_id, str) else ad_id for ad_id in ad_ids]
+
+
+async def migrate(collection_name: str, field: str, batch_size: int) -> int:
+    collection = DatabaseClient.get_collection(collection_name)
+
+    updates = []
+    updated_count = 0
+    async for document in collection.find({field: {"$type": "string"}}, {field: 1}):
+        updates.append(
+            UpdateOne(
+                {"_id": document["_id"]},
+                {"$set": {field: to_object_ids(document[field])}},
+            )
+        )
+
+        if len(updates) >= batch_size:
+            await collection.bulk_write(updates, ordered=False)
+            updated_count += len(updates)
+            updates = []
+
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
+        updated_count += len(updates)
+
+    return updated_count
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Convert chatbot ranked_ad_ids and shown ad ids stored as strings to ObjectIds."
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        help="Number of documents to update per bulk write",
+        default=500,
+    )
+
+    args = parser.parse_args()
+
+    chatbot_count = await migrate("chatbots", "ranked_ad_ids", args.batch_size)
+    delivery_state_count = await migrate(
+        "delivery_states", "shown_ad_ids", args.batch_size
+    )
+
+    print(
+        f"Migrated ranked_ad_ids of {chatbot_count} chatbots and shown ad ids of "
+        f"{delivery_state_count} delivery states to ObjectIds."
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,16 +2,13 @@ import time
 from datetime import datetime
 from dotenv import load_dotenv
 import os
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from openai import OpenAI
-from pymongo.results import InsertOneResult
+from typing import Dict
 import logging
-from src.models.ad import Ad
+from src.models import amazon_product_key
+from src.models.ad import Ad, upsert_ads
 from src.scripts.utils import amazon_search_product_lines
 import io
 import sys
-from src.models.mongo import DatabaseClient
 
 load_dotenv()
 MONGO_URL = os.getenv("MONGODB_CONNECTION_STRING")
@@ -26,24 +23,32 @@ logger = logging.getLogger(__name__)
 logger.addHandler(stdout_handler)
 
 
-async def store_link_for_amazon_search(url: str, search_keywords: str, title_for_product, full_content: str) -> InsertOneResult:
-    description_for_chatbot = f"Amazon search results for '{search_keywords}'"
-
-    ad = Ad(
-        source="Amazon|associates|search_results",
-        generic_product_URL=url,
-        full_content=full_content,
-        product_title=title_for_product,
-        description_for_chatbot=description_for_chatbot,
-        last_time_accessed=datetime.utcnow(),
-    )
-    client = DatabaseClient()
-    collection = client.get_collection("ads")
-    ads_id = await collection.insert_one(ad.model_dump())
-
-    return ads_id
+def amazon_search_ad(url: str, search_keywords: str, title_for_product, full_content: str) -> Dict:
+    """
+    Ad record of an Amazon search results page, for ingest_ads
+    """
+    return {
+        "source": "Amazon|associates|search_results",
+        "generic_product_URL": url,
+        "full_content": full_content,
+        "product_title": title_for_product,
+        "description_for_chatbot": f"Amazon search results for '{search_keywords}'",
+        "last_time_accessed": datetime.utcnow(),
+    }
+
+
+async def store_link_for_amazon_search(url: str, search_keywords: str, title_for_product, full_content: str) -> Dict[str, int]:
+    """
+    Store a single search results page, replacing the ad with the same URL if
+    there is one. Use ingest_ads for many pages.
+    """
+    ad = Ad.model_validate(amazon_search_ad(url, search_keywords, title_for_product, full_content))
+    return await upsert_ads([ad])
 
 def enriched_description_for(search_keywords: str) -> str:
+    # Imported here so that importing this module does not load the OpenAI SDK
+    from openai import OpenAI
+
     client = OpenAI()
 
     completion = client.chat.completions.create(
@@ -66,63 +71,18 @@ def enriched_description_for(search_keywords: str) -> str:
     return completion.choices[0].message.content
 
 
+# Selenium is imported inside the AmazonAutomator methods, so that scripts that
+# only store links do not load it
 class AmazonAutomator:
     def __init__(self):
         return
-    
-        self.link_to_any_page_url = "https://affiliate-program.amazon.com/home/textlink/general?ac-ms-src=ac-nav"
-        user_data_dir = f"{os.getenv('PROFILE_PATH')}/Profile"
-        logger.debug("user data dir:", user_data_dir)
-
-        options = webdriver.ChromeOptions()
-        options.add_argument(f"--user-data-dir={user_data_dir}")
-        options.add_argument("--silent")
-        options.add_argument("--headless")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--log-level=3")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-extensions")
-
-        # todo: enable add profile & automate login
-        self.driver = webdriver.Chrome(options=options)
-        logger.info("Initialized selenium driver")
-        self.driver.get(self.link_to_any_page_url)
-        logger.info("Retrieved amazon product page")
-
-        if self.driver.current_url != self.link_to_any_page_url:
-            try:
-                amazon_email = os.getenv("AMAZON_EMAIL")
-                amazon_pwd = os.getenv("AMAZON_PWD")
-                logger.debug("amazon email password:", amazon_email, amazon_pwd)
-                self.driver.find_element(By.ID, "ap_email").clear()
-                time.sleep(1)
-                self.driver.find_element(By.ID, "ap_email").send_keys(amazon_email)
-                time.sleep(1)
-                self.driver.find_element(By.ID, "ap_password").clear()
-                time.sleep(1)
-                self.driver.find_element(By.ID, "ap_password").send_keys(amazon_pwd)
-                time.sleep(1)
-                self.driver.find_element(By.ID, "signInSubmit").click()
-                time.sleep(5)
-                if "ap/cvf/request?" in self.driver.current_url:
-                    logger.warn(
-                        "Captcha encountered, please get base64 image from /get_screenshot "
-                        "endpoint and enter the captcha at /enter_captcha endpoint. You might "
-                        "need to manually login at "
-                        "https://affiliate-program.amazon.com/home/textlink/general?ac-ms-src=ac-nav"
-                    )
-
-            finally:
-                logger.error(
-                    "Failed to retrieve Amazon Product Page. Check if Chromedriver successfully logged into Amazon"
-                )
 
     def get_current_url(self) -> str:
         return self.driver.current_url
 
     def input_validate_code(self, code: str) -> str:
+        from selenium.webdriver.common.by import By
+
         self.driver.find_element(
             By.CSS_SELECTOR, "input.cvf-widget-input-code.cvf-widget-input-captcha"
         ).clear()
@@ -139,12 +99,11 @@ class AmazonAutomator:
 
     # next key: 101
     async def add_amazon_product_keys(self, start, end=-1) -> None:
-        client = DatabaseClient()
-        key_collection = client.get_collection("extra_amazon_product_keys")
-
-        # manually add keys
-        for num in range(start, end + 1):
-            await key_collection.insert_one({"key": f"product_key_{num}-23"})
+        # manually add keys, in a single insert
+        added = await amazon_product_key.add_amazon_product_keys(
+            f"product_key_{num}-23" for num in range(start, end + 1)
+        )
+        logger.info(f"Added {added} amazon product keys")
 
         # link = "https://affiliate-program.amazon.com/home/account/tag/manage"
         # self.driver.get(link)
@@ -179,6 +138,8 @@ class AmazonAutomator:
     def get_link_for_amazon_search(
         self, search_keywords: str, product_line_name: str = "All Products"
     ) -> str:
+        from selenium.webdriver.common.by import By
+
         logger.debug("Getting amazon affiliate link")
         if (
             "https://affiliate-program.amazon.com/home/textlink/"